@@ -0,0 +1,116 @@
+"""
+Timing, saving and comparison of benchmark results, see bench/run.py.
+"""
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from constant import SEED, BENCH_REPEAT, BENCH_REGRESSION_THRESHOLD
+
+
+class BenchCase:
+    """
+    One measured operation.
+    setup is called before every repetition and is not timed, its return value is passed to run.
+    run returns the number of items it processed (flowcharts, samples...), used for the throughput.
+    """
+    def __init__(self, name: str, unit: str, run: Callable[[Any], int], setup: Callable[[], Any] = None):
+        self.name = name
+        self.unit = unit
+        self.run = run
+        self.setup = setup
+
+
+def measure(case: BenchCase, repeat: int = BENCH_REPEAT, seed: int = SEED) -> Dict[str, Any]:
+    """
+    Time a case, the random states are reseeded before every setup so all repetitions do the same work.
+    Prints of the measured code are discarded.
+    """
+    times = []
+    items = 0
+    for _ in range(repeat):
+        random.seed(seed)
+        np.random.seed(seed)
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            state = case.setup() if case.setup is not None else None
+            st_clk = time.perf_counter()
+            items = case.run(state)
+            times.append(time.perf_counter() - st_clk)
+    median = statistics.median(times)
+    return {
+        "name": case.name,
+        "unit": case.unit,
+        "items": items,
+        "repeat": repeat,
+        "min": min(times),
+        "median": median,
+        "mean": statistics.mean(times),
+        "items_per_sec": items / median if median > 0 else 0,
+    }
+
+
+def get_commit() -> Optional[str]:
+    """Short hash of the checked out commit, None outside of a git repository"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment() -> Dict[str, Any]:
+    return {
+        "commit": get_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": SEED,
+    }
+
+
+def save_results(path: str, sizes: Dict[str, Any], results: List[Dict[str, Any]]):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "w") as f:
+        json.dump({"environment": get_environment(), "sizes": sizes, "results": results}, f, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    threshold: float = BENCH_REGRESSION_THRESHOLD) -> List[str]:
+    """
+    Compare the median times of the cases found in both results.
+    :param threshold: ratio current/baseline above which a case is reported as a regression
+    :return: one line per case, regressions are marked with "REGRESSION"
+    """
+    baseline_results = {(r["size"], r["name"]): r for r in baseline["results"]}
+    lines = [f"--- {baseline['environment'].get('commit')} -> {current['environment'].get('commit')} "
+             f"(median time ratio, regression above {threshold:.2f}) ---"]
+    for result in current["results"]:
+        old = baseline_results.get((result["size"], result["name"]))
+        if old is None or old["median"] <= 0:
+            continue
+        if old["items"] != result["items"]:
+            lines.append(f"{result['size']}/{result['name']}: not comparable, "
+                         f"{old['items']} -> {result['items']} {result['unit']}")
+            continue
+        ratio = result["median"] / old["median"]
+        mark = "  REGRESSION" if ratio > threshold else ""
+        lines.append(f"{result['size']}/{result['name']}: {ratio:.2f}x "
+                     f"({old['median'] * 1000:.2f} -> {result['median'] * 1000:.2f} ms){mark}")
+    return lines
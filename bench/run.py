@@ -0,0 +1,329 @@
+"""
+Benchmarks of every generation stage, with fixed seeds, on flowcharts of configurable size.
+Each size runs in its own temporary data/ tree, rendering and OCR use stub backends.
+Usage: python -m bench.run [--size small medium large] [--charts N --nodes N] [--repeat N] [--only NAME]
+                           [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+import utils
+import gen.manifest
+import gen.gen_flowcharts as gen_flowcharts
+import gen.gen_ocr_contents as gen_ocr_contents
+import gen.gen_conversations as gen_conversations
+from bench.harness import BenchCase, measure, save_results, load_results, compare_results, get_commit
+from conv.inference_builder import InferenceBuilder
+from flowchart.builder import FlowchartBuilder
+from flowchart.flowchart import Flowchart
+from flowchart.reach_index import ReachIndex
+from flowchart.statistics import FlowchartStatistics
+from gen.manifest import get_manifest, MMD_ARTIFACT, PKL_ARTIFACT, PNG_ARTIFACT, OCR_STAGE, DONE_STATUS
+from gen.ocr_store import OcrStore, get_ocr_store_path
+from render.pool import RenderPool, RENDER_OK
+from sample.builder import SampleBuilder
+from sample.statistics import SampleStatistics
+from utils import load_pickle
+from constant import SEED, MMD_DIR, PKL_DIR, IMG_DIR, QA_DIR, STATS_DIR, GROUND_TRUTH_FILE_NAME, YES_ID, NO_ID, \
+    DECISION_TYPE, BENCH_SIZES, BENCH_REPEAT, BENCH_RESULTS_DIR
+
+SAMPLE_METHODS = ["build_nextok_samples", "build_allnext_samples", "build_allprev_samples",
+                  "build_valid_samples", "build_cond_samples"]
+
+_placeholder_png = None
+
+
+def get_placeholder_png() -> bytes:
+    """Blank image of the usual size of a rendered flowchart, written by the stub renderer"""
+    global _placeholder_png
+    if _placeholder_png is None:
+        buffer = io.BytesIO()
+        Image.new("RGB", (800, 400), "white").save(buffer, format="PNG")
+        _placeholder_png = buffer.getvalue()
+    return _placeholder_png
+
+
+class StubRenderer:
+    """Renderer writing a placeholder image, so only the rendering pipeline around the renderer is measured"""
+    def render(self, input_path: str, output_path: str) -> str:
+        with open(input_path, "r") as f:
+            f.read()
+        with open(output_path, "wb") as f:
+            f.write(get_placeholder_png())
+        return RENDER_OK
+
+    def close(self):
+        pass
+
+
+class StubReader:
+    """Replaces the EasyOCR reader, recognizes the same text on every image"""
+    def readtext_batched(self, images, allowlist=None):
+        return [[([[0, 0], [40, 0], [40, 16], [0, 16]], "stub", 0.9)] for _ in images]
+
+
+def reset_run_caches():
+    """Forget the manifest, archive and OCR store opened for the previous working directory"""
+    gen.manifest._manifest = None
+    utils._archive = None
+    if utils._ocr_store is not None:
+        utils._ocr_store.close()
+    utils._ocr_store = None
+
+
+@contextmanager
+def workspace():
+    """Temporary working directory holding the data/ tree of a benchmark size"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        reset_run_caches()
+        try:
+            yield directory
+        finally:
+            reset_run_caches()
+            os.chdir(cwd)
+
+
+def build_flowcharts(chart_num: int, node_num: int) -> List[Flowchart]:
+    """
+    :param node_num: number of nodes of every flowchart, 0 for the usual distribution of FlowchartBuilder
+    """
+    flowcharts = []
+    for _ in range(chart_num):
+        builder = FlowchartBuilder()
+        if node_num > 0:
+            builder.node_num = node_num
+        flowcharts.append(builder.build())
+    return flowcharts
+
+
+def store_flowcharts(flowcharts: List[Flowchart]):
+    """Write the flowcharts like a generation run, with placeholder images and OCR contents of their node names"""
+    for directory in [MMD_DIR, PKL_DIR, IMG_DIR, QA_DIR, STATS_DIR, "log"]:
+        os.makedirs(directory, exist_ok=True)
+    manifest = get_manifest()
+    for i, flowchart in enumerate(flowcharts):
+        manifest.record(i, MMD_ARTIFACT, DONE_STATUS, flowchart.save_mmd(os.path.join(MMD_DIR, f"{i}.mmd"), "LR"))
+        manifest.record(i, PKL_ARTIFACT, DONE_STATUS, flowchart.save_pickle(os.path.join(PKL_DIR, f"{i}.pkl")))
+        with open(os.path.join(IMG_DIR, f"{i}.png"), "wb") as f:
+            f.write(get_placeholder_png())
+        manifest.record(i, PNG_ARTIFACT, DONE_STATUS, get_placeholder_png())
+    manifest.flush()
+    with OcrStore(get_ocr_store_path()) as store:
+        store.put_many((i, [], gen_ocr_contents.generate_node_list_content([name for name, _ in flowchart.nodes]))
+                       for i, flowchart in enumerate(flowcharts))
+
+
+def get_sample_builders(chart_num: int) -> List[SampleBuilder]:
+    return [SampleBuilder(i, 0, random.Random((SEED << 32) + i)) for i in range(chart_num)]
+
+
+def get_inference_inputs(flowcharts: List[Flowchart]) -> Dict[str, List[Tuple]]:
+    """Arguments of the InferenceBuilder methods for every node of the flowcharts"""
+    inputs = {"nextok": [], "allnext": [], "allprev": [], "cond": [], "valid": []}
+    for flowchart in flowcharts:
+        graph_index = flowchart.build_graph_index()
+        node_data = flowchart.build_node_data()
+        names = [node.name for node in node_data]
+        for i in range(flowchart.node_num):
+            next_states = [names[j] for j in graph_index.get_next_ids(i)]
+            next_id = (i + 1) % flowchart.node_num
+            inputs["nextok"].append((names[i], names[next_id], next_states, graph_index.has_edge(i, next_id)))
+            inputs["allnext"].append((names[i], next_states))
+            inputs["allprev"].append((names[i], [names[j] for j in graph_index.get_prev_ids(i)]))
+            if node_data[i].type == DECISION_TYPE:
+                branches = [("true", names[j]) for j in graph_index.get_cond_next_ids(i, YES_ID)] + \
+                           [("false", names[j]) for j in graph_index.get_cond_next_ids(i, NO_ID)]
+                inputs["cond"].append((names[i], random.choice(["true", "false"]), branches))
+        sequence = random.sample(range(flowchart.node_num), min(flowchart.node_num, 4))
+        inputs["valid"].append((graph_index, node_data, sequence))
+    return inputs
+
+
+def count_lines(path: str) -> int:
+    with open(path, "r") as f:
+        return sum(1 for _ in f)
+
+
+def get_cases(flowcharts: List[Flowchart], node_num: int) -> List[BenchCase]:
+    """Cases of one size, in pipeline order, run in the workspace where the flowcharts are stored"""
+    chart_num = len(flowcharts)
+    cases = [
+        BenchCase("flowchart.build", "flowcharts", lambda _: len(build_flowcharts(chart_num, node_num))),
+        BenchCase("flowchart.to_mmd", "flowcharts", lambda _: len([f.to_mmd() for f in flowcharts])),
+        BenchCase("flowchart.build_matrix", "flowcharts", lambda _: len([f.build_matrix() for f in flowcharts])),
+        BenchCase("flowchart.build_graph_index", "flowcharts",
+                  lambda _: len([f.build_graph_index() for f in flowcharts])),
+        BenchCase("flowchart.build_reach_index", "flowcharts",
+                  lambda _: len([ReachIndex(f.build_graph_index()) for f in flowcharts])),
+        BenchCase("flowchart.structural_hash", "flowcharts",
+                  lambda _: len([f.structural_hash() for f in flowcharts])),
+        BenchCase("flowchart.build_node_data", "flowcharts",
+                  lambda _: len([f.build_node_data() for f in flowcharts])),
+        BenchCase("flowchart.save_pickle", "flowcharts",
+                  lambda _: len([f.save_pickle(os.path.join(PKL_DIR, f"{i}.pkl")) for i, f in enumerate(flowcharts)])),
+        BenchCase("flowchart.load_pickle", "flowcharts", lambda _: len([load_pickle(i) for i in range(chart_num)])),
+        BenchCase("sample.init", "flowcharts", lambda _: len(get_sample_builders(chart_num))),
+    ]
+
+    def run_sample_method(method: str):
+        def run(builders: List[SampleBuilder]) -> int:
+            for builder in builders:
+                getattr(builder, method)()
+            return sum(len(builder.sample_collector) for builder in builders)
+        return run
+
+    for method in SAMPLE_METHODS:
+        cases.append(BenchCase(f"sample.{method}", "samples", run_sample_method(method),
+                               lambda: get_sample_builders(chart_num)))
+
+    random.seed(SEED)
+    inference_inputs = get_inference_inputs(flowcharts)
+    inference_methods = {
+        "nextok": InferenceBuilder.build_nextok_inference,
+        "allnext": InferenceBuilder.build_allnext_inference,
+        "allprev": InferenceBuilder.build_allprev_inference,
+        "cond": InferenceBuilder.build_cond_inference,
+        "valid": InferenceBuilder.build_valid_reasoning,
+    }
+
+    def run_inference(name: str):
+        def run(_) -> int:
+            method = inference_methods[name]
+            return len([method(*args) for args in inference_inputs[name]])
+        return run
+
+    for name in inference_methods:
+        cases.append(BenchCase(f"inference.{name}", "answers", run_inference(name)))
+
+    def all_samples() -> List:
+        return [sample for builder in get_sample_builders(chart_num)
+                for sample in builder.build_samples_for_flowchart().get_samples()]
+
+    def run_flowchart_statistics(_) -> int:
+        flowchart_statistics = FlowchartStatistics()
+        for flowchart in flowcharts:
+            flowchart_statistics.add_flowchart(flowchart)
+        flowchart_statistics.summary()
+        return chart_num
+
+    def run_sample_statistics(samples: List) -> int:
+        sample_statistics = SampleStatistics()
+        for sample in samples:
+            sample_statistics.add_sample(sample)
+        sample_statistics.show_all()
+        return len(samples)
+
+    def run_gen_samples(_) -> int:
+        return sum(variant.statistics.all_num() for variant in gen_conversations.gen_samples(chart_num))
+
+    def run_gen_qas(sample_num: int) -> int:
+        gen_conversations.gen_qas()
+        return sample_num
+
+    def setup_gen_imgs():
+        manifest = get_manifest()
+        for i in range(chart_num):
+            manifest.invalidate(i, [PNG_ARTIFACT])
+
+    def run_gen_imgs(_) -> int:
+        get_render_pool = gen_flowcharts.get_render_pool
+        gen_flowcharts.get_render_pool = lambda backend: RenderPool(StubRenderer)
+        try:
+            gen_flowcharts.gen_imgs(chart_num)
+        finally:
+            gen_flowcharts.get_render_pool = get_render_pool
+        return chart_num
+
+    def setup_ocr():
+        with OcrStore(get_ocr_store_path()) as store:
+            store.clear()
+        get_manifest().mark_stage(OCR_STAGE, done=False)
+
+    def run_ocr(_) -> int:
+        reader = gen_ocr_contents._reader
+        gen_ocr_contents._reader = StubReader()
+        try:
+            gen_ocr_contents.generate_ocr_contents(chart_num)
+        finally:
+            gen_ocr_contents._reader = reader
+        return chart_num
+
+    cases += [
+        BenchCase("statistics.flowchart", "flowcharts", run_flowchart_statistics),
+        BenchCase("statistics.sample", "samples", run_sample_statistics, all_samples),
+        BenchCase("gen.gen_samples", "samples", run_gen_samples),
+        BenchCase("gen.gen_qas", "samples", run_gen_qas,
+                  lambda: count_lines(os.path.join(QA_DIR, GROUND_TRUTH_FILE_NAME))),
+        BenchCase("render.gen_imgs (stub)", "images", run_gen_imgs, setup_gen_imgs),
+        # last, the stub contents replace the node names used by the sample cases
+        BenchCase("ocr.generate_ocr_contents (stub)", "images", run_ocr, setup_ocr),
+    ]
+    return cases
+
+
+def run_size(size: str, chart_num: int, node_num: int, repeat: int, only: str = None) -> List[Dict]:
+    results = []
+    with workspace():
+        random.seed(SEED)
+        np.random.seed(SEED)
+        flowcharts = build_flowcharts(chart_num, node_num)
+        store_flowcharts(flowcharts)
+        for case in get_cases(flowcharts, node_num):
+            if only is not None and only not in case.name:
+                continue
+            result = measure(case, repeat)
+            result["size"] = size
+            results.append(result)
+            print(f"{size}/{result['name']}: {result['median'] * 1000:.2f} ms, "
+                  f"{result['items_per_sec']:.2f} {result['unit']}/sec ({result['items']} {result['unit']})")
+    return results
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description="Benchmark the generation stages")
+    parser.add_argument("--size", nargs="+", choices=list(BENCH_SIZES), default=list(BENCH_SIZES),
+                        help="sizes defined in BENCH_SIZES")
+    parser.add_argument("--charts", type=int, help="number of flowcharts of a custom size, replaces --size")
+    parser.add_argument("--nodes", type=int, default=0, help="nodes per flowchart of the custom size, 0 for the usual")
+    parser.add_argument("--repeat", type=int, default=BENCH_REPEAT, help="repetitions of each case")
+    parser.add_argument("--only", help="only run the cases whose name contains this string")
+    parser.add_argument("--output", help="results file, BENCH_RESULTS_DIR/<commit>.json by default")
+    parser.add_argument("--compare", help="results file of a baseline, regressions make the exit status 1")
+    args = parser.parse_args(argv)
+
+    if args.charts is not None:
+        sizes = {"custom": (args.charts, args.nodes)}
+    else:
+        sizes = {size: BENCH_SIZES[size] for size in args.size}
+    baseline = load_results(args.compare) if args.compare else None
+    output = os.path.abspath(args.output) if args.output else None
+
+    results = []
+    for size, (chart_num, node_num) in sizes.items():
+        print(f"--- {size}: {chart_num} flowcharts, {node_num or 'usual'} nodes ---")
+        results += run_size(size, chart_num, node_num, args.repeat, args.only)
+
+    if output is None:
+        output = os.path.abspath(os.path.join(BENCH_RESULTS_DIR, f"{get_commit() or 'latest'}.json"))
+    save_results(output, {size: {"charts": c, "nodes": n} for size, (c, n) in sizes.items()}, results)
+    print(f"---Results saved to {output}---")
+    if baseline is not None:
+        lines = compare_results(baseline, load_results(output))
+        print("\n".join(lines))
+        return 1 if any(line.endswith("REGRESSION") for line in lines) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
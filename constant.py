@@ -8,14 +8,19 @@ File structure of generated data:
   - {GEN_IDENTIFIER}/  # unique id
     - mmd/  # Flowchart Mermaid scripts
     - pkl/  # Flowchart objects in pickle format
-    - img/  # Flowchart images
+    - archive/  # Flowchart objects in a packed columnar archive (FLOWCHART_STORAGE = "archive")
+    - img/  # Flowchart images, {id}.png or {id}.webp (IMG_FORMAT)
     - qa/  # Question-Answer pairs, for testing
       - questions.jsonl
       - ground_truth.jsonl
     - conversations.json/  # Conversations for training
     - conversations_qa.json/  # Conversations for testing, with more information
-    - ocr_results.pkl
+    - conversations.idx, qa/conversations_qa.idx  # Byte offset, length, flowchart id and question type of each sample (CONV_INDEX_ON)
+    - ocr_results.sqlite  # OCR results (formatted contents, raw boxes and confidences), one row per flowchart
+    - manifest.jsonl  # Status and content hash of every artifact, used to resume a run
     - statistics.txt  # Statistics information for flowcharts and conversations
+    - shards/  # Tar shards of SHARD_SIZE flowcharts: {id}.png, {id}.conversations.json, {id}.qa.json, and index.json
+    - {cot|wo-cot} & {ocr|wo-ocr}/  # one dataset per entry of VARIANTS: conversations, qa/, stats/ and img linked to ../img
 """
 
 # id for the data generation process, used in directory names
@@ -23,27 +28,114 @@ GEN_IDENTIFIER = "test" # change this to a unique identifier for your generation
 
 USE_COT = True  # whether to use chain-of-thought reasoning in qa generation
 USE_OCR = True  # whether to use OCR results in question generation
+VARIANTS = []  # (use_cot, use_ocr) pairs: one pass renders and OCRs once, then writes each dataset to data/{GEN_IDENTIFIER}/{"cot" or "wo-cot"} & {"ocr" or "wo-ocr"}/ with img/ linked to the shared images; empty for the single dataset of USE_COT/USE_OCR
+SHARDS_ON = False  # whether the images and conversations of each dataset are also packed into tar shards (WebDataset layout) in its shards/ directory, see gen/gen_shards.py
+SHARD_SIZE = 1000  # flowcharts per shard, with all their samples
+SHARD_IMAGE_REFS = False  # whether the image field of the records in the shards is the image member of the same shard ({id}.png) instead of img/{id}.png
+MULTIHOP_QUESTIONS_ON = False  # whether to add the multi-hop questions (reach, distance, unreachable) to the samples of every flowchart
+CONV_TEMPLATE_SET = "default"  # texts of the questions and answers, "default": one wording per question type, "paraphrase": the default wording and a paraphrase, drawn per sample
 GEN_IMGS_ON = True  # whether to generate images
+RESUME = True  # whether to skip the work recorded as completed in the run manifest
+RESUME_CHECK_HASHES = False  # whether a resumed run also compares the content hash of the stored files, not only their size
+FLOWCHART_STORAGE = "pkl"  # PKL_STORAGE: one pickle per flowchart, ARCHIVE_STORAGE: one packed archive per run
 FLOWCHART_NUM = 5
+FLOWCHART_GENERATOR = "builder"  # SCALAR_GENERATOR: FlowchartBuilder on the global random state, BATCH_GENERATOR: BatchFlowchartBuilder
+FLOWCHART_BATCH_SIZE = 10000  # number of flowcharts built per call by the batch generator
+FLOWCHART_DEDUP_QUOTA = 0  # max flowcharts with the same structure (isomorphic, names ignored), the next ones are redrawn before rendering, 0 to keep all
+FLOWCHART_DEDUP_MAX_REDRAWS = 100  # redraws of a flowchart over quota before it is kept anyway (small node numbers have few structures)
+SEED = 42  # seed of the global random state, of the batch generator and of the per-flowchart sample streams
+PIPELINE_MODE = "staged"  # STAGED_PIPELINE: each stage runs over all the flowcharts before the next, STREAMING_PIPELINE: all the stages run concurrently, see gen/pipeline.py
+PIPELINE_QUEUE_SIZE = 64  # max flowcharts waiting between two stages of the streaming pipeline
+SAMPLE_WORKERS = 0  # processes building samples from per-flowchart random streams (same output for any number), 0 for the serial mode on the global random state
+
+# image rendering
+RENDER_BACKEND = "mmdc"  # "mmdc": one mmdc process per image, "server": long-lived Node renderers, "pil": in-process Pillow renderer
+MMDC_BIN = "mmdc"  # mmdc executable, can be replaced by a fake script for testing
+NODE_BIN = "node"  # node executable, used by the "server" backend
+RENDER_WORKERS = 0  # number of concurrent renderers, 0 for os.cpu_count()
+RENDER_QUEUE_SIZE = 64  # max number of pending render jobs
+RENDER_TIMEOUT = 10  # seconds before a mmdc process (and its browser) is killed
+RENDER_RETRIES = 2  # extra attempts after a failed or timed out render
+RENDER_SERVER_RECYCLE_JOBS = 1000  # restart a render server after this many images, 0 to disable
+RENDER_SERVER_MAX_RSS_MB = 2048  # restart a render server above this memory (browser included), 0 to disable
+RENDER_SERVER_STARTUP_TIMEOUT = 60  # seconds to wait for a render server to launch its browser
+RENDER_SCALE = 4  # device scale factor of the "mmdc" and "server" backends (mmdc -s)
+PIL_RENDER_SCALE = 2  # scale of the "pil" backend, 1 draws 16px fonts like Mermaid
+IMG_FORMAT = "png"  # PNG_FORMAT, or WEBP_FORMAT for lossless WebP, images are saved as img/{id}.{IMG_FORMAT}
+IMG_MAX_SIDE = 0  # images are downscaled once after rendering (aspect ratio kept) so their longest side is at most this many pixels, 0 for no limit
+IMG_MAX_PIXELS = 0  # images are downscaled so that width * height is at most this, e.g. 448 * 448, 0 for no limit
+IMG_COLOR_MODE = "rgb"  # RGB_COLOR_MODE, GRAY_COLOR_MODE: 8-bit grayscale, PALETTE_COLOR_MODE: at most IMG_PALETTE_SIZE colors, enough for flat diagrams
+IMG_PALETTE_SIZE = 64  # number of colors of the palette images
+IMG_PNG_COMPRESS_LEVEL = None  # zlib level (0-9) of the PNG images, None keeps the files of the renderer as they are unless they are resized or converted
+RENDER_REPORT_SAMPLE_NUM = 200  # number of flowcharts rendered per backend by render/report.py
+
+# run metrics
+METRICS_ON = True  # whether per-stage timings, counters and memory are recorded and saved to METRICS_DIR
+METRICS_REPORT_INTERVAL = 10  # seconds between two progress reports (throughput and ETA) of a stage, 0 to disable them
+METRICS_DIR = "log"  # metrics are saved as metrics-{GEN_IDENTIFIER}-{start time}.json
+
+# benchmarks (python -m bench.run)
+BENCH_SIZES = {  # name: (number of flowcharts, nodes per flowchart, 0 for the usual distribution up to MAX_NODE_NUM)
+    "small": (500, 0),
+    "medium": (100, 100),
+    "large": (10, 1000),
+}
+BENCH_REPEAT = 5  # repetitions of each case, the median time is reported
+BENCH_RESULTS_DIR = "bench/results"  # results are saved as <commit>.json
+BENCH_REGRESSION_THRESHOLD = 1.2  # median time ratio (current/baseline) above which a case is a regression
 
 # directories for storing generated data
 MMD_DIR = f"data/{GEN_IDENTIFIER}/mmd"
 PKL_DIR = f"data/{GEN_IDENTIFIER}/pkl"
+ARCHIVE_DIR = f"data/{GEN_IDENTIFIER}/archive"
 IMG_DIR = f"data/{GEN_IDENTIFIER}/img"
 CONVS_DIR = f"data/{GEN_IDENTIFIER}"  # conversations
 OCR_DIR = f"data/{GEN_IDENTIFIER}"
 QA_DIR = f"data/{GEN_IDENTIFIER}/qa"
 STATS_DIR = f"data/{GEN_IDENTIFIER}/stats"
 
+CONV_OUTPUT_FORMAT = "json"  # "json": one JSON array (LLaVA format), "jsonl": one sample per line (.jsonl files)
+CONV_INDEX_ON = True  # whether the conversation files get a binary offset index ({name}.idx) to read one sample without parsing the file, see sample/index.py
 CONV_FILE_NAME = "conversations.json"
 CONV_QA_FILE_NAME = "conversations_qa.json"
 QUESTIONS_FILE_NAME = "questions.jsonl"
 GROUND_TRUTH_FILE_NAME = "ground_truths.jsonl"
 FLOWCHART_STATS_FILE_NAME = "flowchart_statistics.txt"
 CONV_STATS_FILE_NAME = "conversation_statistics.txt"
+MANIFEST_FILE_NAME = "manifest.jsonl"
+OCR_STORE_FILE_NAME = "ocr_results.sqlite"
+SHARD_DIR_NAME = "shards"
+SHARD_INDEX_FILE_NAME = "index.json"
+RENDER_REPORT_FILE_NAME = "render_report.txt"
+OCR_SIMULATION_REPORT_FILE_NAME = "ocr_simulation_report.txt"
 
 IMG_REF_DIR = f"img"  # used in conversations to refer to images
 
+# flowchart storages
+PKL_STORAGE = "pkl"  # one pickle file per flowchart
+ARCHIVE_STORAGE = "archive"  # one packed, memory-mappable archive for the whole run
+
+# OCR modes
+REAL_OCR = "easyocr"  # EasyOCR on the rendered images
+SIMULATED_OCR = "simulated"  # calibrated error model applied to the ground-truth node names, no image needed
+
+# flowchart generators
+SCALAR_GENERATOR = "builder"  # one flowchart at a time, scalar random calls
+BATCH_GENERATOR = "batch"  # many flowcharts per call, vectorized on a numpy.random.Generator
+
+# image formats
+PNG_FORMAT = "png"
+WEBP_FORMAT = "webp"  # always lossless
+
+# image color modes
+RGB_COLOR_MODE = "rgb"
+GRAY_COLOR_MODE = "gray"
+PALETTE_COLOR_MODE = "palette"
+
+# pipeline modes
+STAGED_PIPELINE = "staged"  # generate, render, OCR then build the samples, one stage after the other
+STREAMING_PIPELINE = "streaming"  # a flowchart goes to the next stage as soon as it is ready, through bounded queues
+
 # flowchart/node types
 NORMAL_TYPE = 0  # normal flowchart/non-decision node
 DECISION_TYPE = 1  # decision flowchart/decision node
@@ -54,22 +146,37 @@ ALLNEXT_TYPE = 2
 ALLPREV_TYPE = 3
 COND_TYPE = 4
 VALID_TYPE = 5
+REACH_TYPE = 6  # multi-hop: can a state eventually reach another one
+DISTANCE_TYPE = 7  # multi-hop: minimum number of steps between two states
+UNREACHABLE_TYPE = 8  # multi-hop: states that cannot be reached from the start state
 
 # used in convs generation
 IMG_PLACEHOLDER = "<image>\n"
 
 # cond ids in matrix
 INVALID_ID = 0  # invalid edge id in matrix
+PLAIN_ID = 1  # edge without condition id in matrix
 YES_ID = 10  # yes_edge id in matrix
 NO_ID = 11  # no_edge id in matrix
 
-MAX_NODE_NUM = 25  # max node number in a flowchart
+MAX_NODE_NUM = 25  # max node number in a flowchart, node codes go on after Z with AA, AB, ...
+NODE_NUM_MEAN = 6.5  # mean of the (truncated normal) node number of a flowchart, raise it with MAX_NODE_NUM for larger flowcharts
+NODE_NUM_STD = 1  # standard deviation of the node number of a flowchart
 
 # a-z
 ALLOWED_CHARACTERS = "abcdefghijklmnopqrstuvwxyz"
 
 MIN_CONFIDENCE = 0.7
 
+# OCR
+OCR_MODE = "easyocr"  # REAL_OCR: EasyOCR on the images, SIMULATED_OCR: error model applied to the node names
+OCR_ERROR_MODEL_PATH = "data/ocr_error_model.json"  # error model of the simulated OCR, written by gen/ocr_simulator.py
+OCR_CALIBRATION_NUM = 3000  # number of real OCR results used to calibrate the error model
+OCR_GPU = True  # whether EasyOCR uses the GPU (it falls back to the CPU without CUDA)
+OCR_WORKERS = 1  # OCR processes, each loads its own model, 0 for os.cpu_count()
+OCR_BATCH_SIZE = 8  # images detected and recognized in one readtext_batched call
+OCR_PREFETCH_BATCHES = 4  # batches handed to a worker at once, the next one is decoded while the current one is recognized
+
 # simple answers
 YES_ANSWER = "yes"
 NO_ANSWER = "no"
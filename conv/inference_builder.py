@@ -1,5 +1,10 @@
 from typing import List, Tuple
 
+from constant import REACH_TYPE, DISTANCE_TYPE, UNREACHABLE_TYPE
+from conv.templates import DEFAULT_TEMPLATES, ConvTemplates
+
+_default_templates = ConvTemplates(DEFAULT_TEMPLATES, use_cot=True, use_ocr=False)
+
 
 class InferenceBuilder:
     @staticmethod
@@ -97,28 +102,23 @@ class InferenceBuilder:
         return '\n'.join([step1, step2, step3])
 
     @staticmethod
-    def build_valid_reasoning(matrix, node_data, sequence: List[int]) -> str:
-        sequence_str = '->'.join([node_data[node_id].name for node_id in sequence])
+    def build_valid_reasoning(graph_index, node_data, sequence: List[int]) -> str:
+        names = [node_data[node_id].name for node_id in sequence]
+        sequence_str = '->'.join(names)
+        pairs = list(zip(names, names[1:]))
+        valid_transitions = [graph_index.has_edge(sequence[i], sequence[i + 1]) for i in range(len(sequence) - 1)]
 
+        transitions = [f"{first} -> {second}" for first, second in pairs]
         step1 = f"Step 1: Check the transition between each pair of consecutive states in {sequence_str}. " + \
-                f"The transitions are: "
-        transitions = []
-        for i in range(len(sequence) - 1):
-            transitions.append(f"{node_data[sequence[i]].name} -> {node_data[sequence[i + 1]].name}")
-        step1 += ', '.join(transitions) + "."
-
-        step2 = f"Step 2: Verify if each transition is valid."
-        if_valid = True
-        invalid_transitions = []
-        for i in range(len(sequence) - 1):
-            if matrix[sequence[i]][sequence[i + 1]] != 0:
-                step2 += f"\nThe transition from {node_data[sequence[i]].name} to {node_data[sequence[i + 1]].name} is valid."
-            else:
-                step2 += f"\nThe transition from {node_data[sequence[i]].name} to {node_data[sequence[i + 1]].name} is NOT valid."
-                invalid_transitions.append(f"{node_data[sequence[i]].name} -> {node_data[sequence[i + 1]].name}")
-                if_valid = False
+                f"The transitions are: {', '.join(transitions)}."
+
+        checks = [f"\nThe transition from {first} to {second} is valid." if valid else
+                  f"\nThe transition from {first} to {second} is NOT valid."
+                  for (first, second), valid in zip(pairs, valid_transitions)]
+        step2 = "Step 2: Verify if each transition is valid." + "".join(checks)
 
-        if if_valid:
+        invalid_transitions = [transition for transition, valid in zip(transitions, valid_transitions) if not valid]
+        if not invalid_transitions:
             step3 = (f"Step 3: Final answer. "
                      f"Since all transitions are valid, the sequence {sequence_str} is valid.")
         else:
@@ -127,3 +127,26 @@ class InferenceBuilder:
                      f"the sequence {sequence_str} is NOT valid.")
 
         return '\n'.join([step1, step2, step3])
+
+    # the multi-hop reasonings are only defined in conv/templates.py, these give its default variant
+
+    @staticmethod
+    def build_reach_inference(cur_state: str, target_state: str, path: List[str], reachable_states: List[str]) -> str:
+        """
+        path: states of a shortest path from cur_state to target_state, empty if there is none
+        """
+        return _default_templates.answer(REACH_TYPE, 0, "", cur_state=cur_state, target_state=target_state,
+                                         path=path, states=reachable_states)
+
+    @staticmethod
+    def build_distance_inference(cur_state: str, target_state: str, path: List[str]) -> str:
+        """
+        path: states of a shortest path from cur_state to target_state, empty if there is none
+        """
+        return _default_templates.answer(DISTANCE_TYPE, 0, "", cur_state=cur_state, target_state=target_state,
+                                         path=path)
+
+    @staticmethod
+    def build_unreachable_inference(start_state: str, reachable_states: List[str], unreachable_states: List[str]) -> str:
+        return _default_templates.answer(UNREACHABLE_TYPE, 0, "", start_state=start_state, states=reachable_states,
+                                         unreachable_states=unreachable_states)
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 
-from constant import IMG_PLACEHOLDER, NEXTOK_TYPE, ALLNEXT_TYPE, ALLPREV_TYPE, COND_TYPE, VALID_TYPE, USE_COT, USE_OCR
+from constant import IMG_PLACEHOLDER, NEXTOK_TYPE, ALLNEXT_TYPE, ALLPREV_TYPE, COND_TYPE, VALID_TYPE, \
+    REACH_TYPE, DISTANCE_TYPE, UNREACHABLE_TYPE, USE_COT, USE_OCR
+from conv.templates import DEFAULT_TEMPLATES
 
 
 class QuestionBuilder(ABC):
@@ -92,3 +94,37 @@ class ValidQuestionBuilder(QuestionBuilder):
 
     def build_cot_prompt(self):
         return f"Please first check the transition between each pair of consecutive states in {self.sequence}, verify if each transition is valid, and then give your final answer."
+
+
+class TemplateQuestionBuilder(QuestionBuilder):
+    """
+    Question built from the default variant of its type in conv/templates.py,
+    the attributes of the builder are the placeholders of the templates.
+    """
+    type: int
+
+    def build_basic_question(self):
+        return IMG_PLACEHOLDER + DEFAULT_TEMPLATES[self.type][0]["question"].format(**vars(self))
+
+    def build_cot_prompt(self):
+        return DEFAULT_TEMPLATES[self.type][0]["cot_prompt"].format(**vars(self))
+
+
+class ReachQuestionBuilder(TemplateQuestionBuilder):
+    def __init__(self, cur_state: str, target_state: str):
+        self.type = REACH_TYPE
+        self.cur_state = cur_state
+        self.target_state = target_state
+
+
+class DistanceQuestionBuilder(TemplateQuestionBuilder):
+    def __init__(self, cur_state: str, target_state: str):
+        self.type = DISTANCE_TYPE
+        self.cur_state = cur_state
+        self.target_state = target_state
+
+
+class UnreachableQuestionBuilder(TemplateQuestionBuilder):
+    def __init__(self, start_state: str):
+        self.type = UNREACHABLE_TYPE
+        self.start_state = start_state
@@ -1,16 +1,20 @@
 from typing import List
 
-from utils import is_valid_transition, is_conditionally_valid_transition
+from flowchart.graph_index import GraphIndex
+from flowchart.reach_index import ReachIndex
 
 
 class QuestionSolver:
-    def __init__(self, matrix: List[List[int]]):
+    def __init__(self, graph_index: GraphIndex, reach_index: ReachIndex = None):
         """
-        Initialize the question answerer with an adjacency matrix.
-        :param matrix: adjacency matrix representing the flowchart
+        Initialize the question answerer with the graph index of a flowchart.
+        :param graph_index: adjacency lists and sets of the flowchart, see Flowchart.build_graph_index()
+        :param reach_index: reachability and distances of the flowchart, see Flowchart.get_reach_index(),
+                            only needed by the multi-hop questions
         """
-        self.matrix = matrix
-        self.node_num = len(matrix)
+        self.graph_index = graph_index
+        self.reach_index = reach_index
+        self.node_num = graph_index.node_num
 
     def nextok_answer(self, cur_id: int, next_id: int) -> bool:
         """
@@ -19,7 +23,7 @@ class QuestionSolver:
         :param next_id: next state ID
         :return: True if the transition is valid, False otherwise
         """
-        return is_valid_transition(self.matrix, cur_id, next_id)
+        return self.graph_index.is_valid_transition(cur_id, next_id)
 
     def allnext_answer(self, cur_id: int) -> List[int]:
         """
@@ -27,7 +31,7 @@ class QuestionSolver:
         :param cur_id: current state ID
         :return: list of IDs of all possible next states
         """
-        return [i for i in range(self.node_num) if is_valid_transition(self.matrix, cur_id, i)]
+        return list(self.graph_index.get_next_ids(cur_id))
 
     def allprev_answer(self, cur_id: int) -> List[int]:
         """
@@ -35,7 +39,7 @@ class QuestionSolver:
         :param cur_id: current state ID
         :return: list of IDs of all possible previous states
         """
-        return [i for i in range(self.node_num) if is_valid_transition(self.matrix, i, cur_id)]
+        return list(self.graph_index.get_prev_ids(cur_id))
 
     def cond_answer(self, cur_id: int, value_id: int) -> List[int]:
         """
@@ -44,15 +48,41 @@ class QuestionSolver:
         :param value_id: condition value ID
         :return: list of IDs of all possible next states that match the condition
         """
-        return [i for i in range(self.node_num) if is_conditionally_valid_transition(self.matrix, cur_id, i, value_id)]
+        return list(self.graph_index.get_cond_next_ids(cur_id, value_id))
 
     def valid_answer(self, sequence: List[int]) -> bool:
         """
-        Check if a given sequence of states is valid according to the adjacency matrix.
+        Check if a given sequence of states is valid according to the graph index.
         :param sequence: list of state IDs representing the sequence
         :return: True if the sequence is valid, False otherwise
         """
         for i in range(len(sequence) - 1):
-            if not is_valid_transition(self.matrix, sequence[i], sequence[i + 1]):
+            if not self.graph_index.is_valid_transition(sequence[i], sequence[i + 1]):
                 return False
         return True
+
+    def reach_answer(self, cur_id: int, target_id: int) -> bool:
+        """
+        Check if the target state can eventually be reached from the current state.
+        :param cur_id: current state ID
+        :param target_id: target state ID
+        :return: True if there is a path from the current state to the target state, False otherwise
+        """
+        return self.reach_index.can_reach(cur_id, target_id)
+
+    def distance_answer(self, cur_id: int, target_id: int) -> int:
+        """
+        Get the minimum number of steps from the current state to the target state.
+        :param cur_id: current state ID
+        :param target_id: target state ID
+        :return: number of transitions of a shortest path, -1 if the target state cannot be reached
+        """
+        return self.reach_index.distance(cur_id, target_id)
+
+    def unreachable_answer(self, start_id: int) -> List[int]:
+        """
+        Get all states that cannot be reached from the start state.
+        :param start_id: start state ID, see GraphIndex.get_start_id()
+        :return: list of IDs of all unreachable states
+        """
+        return self.reach_index.get_unreachable_ids(start_id)
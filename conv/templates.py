@@ -0,0 +1,380 @@
+"""
+Templates of the question and chain-of-thought answer texts of every question type.
+A template set has one or more paraphrase variants per question type. It is compiled once per run
+for the USE_COT/USE_OCR flags, then each sample only formats its fields into the chosen variant.
+The "default" set gives exactly the texts of QuestionBuilder and InferenceBuilder, whose multi-hop
+question types (reach, distance, unreachable) are built from it.
+"""
+import random
+from typing import Any, Callable, Dict, List, Tuple
+
+from constant import IMG_PLACEHOLDER, NEXTOK_TYPE, ALLNEXT_TYPE, ALLPREV_TYPE, COND_TYPE, VALID_TYPE, \
+    REACH_TYPE, DISTANCE_TYPE, UNREACHABLE_TYPE, USE_COT, USE_OCR, CONV_TEMPLATE_SET
+
+# question type -> list of variants, each with its question, CoT prompt and reasoning fragments
+DEFAULT_TEMPLATES = {
+    NEXTOK_TYPE: [{
+        "question": "Given that the current state is {cur_state}, is it possible to take state {next_state} "
+                    "as the next step?",
+        "cot_prompt": "Please first find all the possible next states from {cur_state}, then check if {next_state} "
+                      "is among them, and finally give your answer.",
+        "step1": "Step 1: Find all possible next states from {cur_state}. The possible next states are {states}. ",
+        "step1_none": "Step 1: Find all possible next states from {cur_state}. There are no possible next states. ",
+        "step2_yes": "Step 2: Check if {next_state} is among them. "
+                     "Since {next_state} is in the list, the answer is yes.",
+        "step2_no": "Step 2: Check if {next_state} is among them. "
+                    "Since {next_state} is NOT in the list, the answer is no.",
+    }],
+    ALLNEXT_TYPE: [{
+        "question": "Given that the current state is {cur_state}, what are the possible next states?",
+        "cot_prompt": "Please first list all outgoing edges from {cur_state}, explain each, "
+                      "and then summarize the possible next states.",
+        "step1": "Step 1: Find all outgoing edges from {cur_state}. The outgoing edges point to {states}. ",
+        "step2": "Step 2: Explain each outgoing edge:\n{explanations} ",
+        "explanation": "- {cur_state} can transition to {state}.",
+        "step3": "Step 3: Summarize. The possible next states from {cur_state} are {states}.",
+        "step1_none": "Step 1: Find all outgoing edges from {cur_state}. There are no outgoing edges. ",
+        "step2_none": "Step 2: No edges to explain. ",
+        "step3_none": "Step 3: Summarize. There are no possible next states from {cur_state}.",
+    }],
+    ALLPREV_TYPE: [{
+        "question": "Given that the current state is {cur_state}, what states might be the previous states?",
+        "cot_prompt": "Please first find all incoming edges to {cur_state}, explain the origin of each, "
+                      "and then list the possible previous states.",
+        "step1": "Step 1: Find all incoming edges to {cur_state}. The incoming edges come from {states}. ",
+        "step2": "Step 2: Explain each incoming edge:\n{explanations} ",
+        "explanation": "- There is an edge from {state} to {cur_state}.",
+        "step3": "Step 3: Summarize. The possible previous states leading to {cur_state} are {states}.",
+        "step1_none": "Step 1: Find all incoming edges to {cur_state}. There are no incoming edges. ",
+        "step2_none": "Step 2: No edges to explain. ",
+        "step3_none": "Step 3: Summarize. There are no possible previous states leading to {cur_state}.",
+    }],
+    COND_TYPE: [{
+        "question": "Given that the current state is {cur_state}, what might be the next states "
+                    "when the condition is {value}?",
+        "cot_prompt": "Please first list all conditional branches from {cur_state}, identify the branch where "
+                      "the condition is {value}, and then specify the possible next states accordingly.",
+        "branch": "{cond}->{state}",
+        "step1": "Step 1: List all conditional branches from {cur_state}. The branches are: {branches}. ",
+        "step2": "Step 2: Identify branches where the condition is {value}. "
+                 "The matching branches lead to {states}. ",
+        "step3": "Step 3: Summarize. When the condition is {value}, "
+                 "the possible next states from {cur_state} are {states}.",
+        "step2_unmatched": "Step 2: Identify branches where the condition is {value}. "
+                           "No branches match this condition. ",
+        "step3_unmatched": "Step 3: Summarize. When the condition is {value}, "
+                           "there are no next states from {cur_state}.",
+        "step1_none": "Step 1: List all conditional branches from {cur_state}. There are no conditional branches. ",
+        "step2_none": "Step 2: Identify branches where the condition is {value}. No branches exist. ",
+        "step3_none": "Step 3: Summarize. No possible next states from {cur_state}.",
+    }],
+    VALID_TYPE: [{
+        "question": "Is the sequence {sequence} a valid state sequence?",
+        "cot_prompt": "Please first check the transition between each pair of consecutive states in {sequence}, "
+                      "verify if each transition is valid, and then give your final answer.",
+        "transition": "{first} -> {second}",
+        "step1": "Step 1: Check the transition between each pair of consecutive states in {sequence}. "
+                 "The transitions are: {transitions}.",
+        "step2": "Step 2: Verify if each transition is valid.{checks}",
+        "check_valid": "\nThe transition from {first} to {second} is valid.",
+        "check_invalid": "\nThe transition from {first} to {second} is NOT valid.",
+        "step3_valid": "Step 3: Final answer. Since all transitions are valid, the sequence {sequence} is valid.",
+        "step3_invalid": "Step 3: Final answer. Since transitions {transitions} are NOT valid, "
+                         "the sequence {sequence} is NOT valid.",
+    }],
+    REACH_TYPE: [{
+        "question": "Given that the current state is {cur_state}, is it possible to eventually reach state "
+                    "{target_state}?",
+        "cot_prompt": "Please first search the states reachable from {cur_state} by following the edges, "
+                      "then check if {target_state} is among them, and finally give your answer.",
+        "step1": "Step 1: Follow the edges from {cur_state} to search for {target_state}. A path is found: {path}. ",
+        "step1_unreached": "Step 1: Follow the edges from {cur_state} to search for {target_state}. "
+                           "The reachable states are {states}. ",
+        "step1_none": "Step 1: Follow the edges from {cur_state} to search for {target_state}. "
+                      "There are no reachable states. ",
+        "step2_yes": "Step 2: Since there is a path from {cur_state} to {target_state}, the answer is yes.",
+        "step2_no": "Step 2: Since {target_state} is NOT among the reachable states, the answer is no.",
+    }],
+    DISTANCE_TYPE: [{
+        "question": "Given that the current state is {cur_state}, what is the minimum number of steps "
+                    "to reach state {target_state}?",
+        "cot_prompt": "Please first find a shortest path from {cur_state} to {target_state} by searching "
+                      "the states level by level, then count its transitions, and finally give your answer.",
+        "step1": "Step 1: Search the states level by level from {cur_state} until {target_state} is found. "
+                 "A shortest path is {path}. ",
+        "step1_none": "Step 1: Search the states level by level from {cur_state} until {target_state} is found. "
+                      "{target_state} is never found. ",
+        "step2": "Step 2: Count the transitions of the path. Its length is {distance}, so the answer is {distance}.",
+        "step2_none": "Step 2: Since {target_state} cannot be reached from {cur_state}, the answer is none.",
+    }],
+    UNREACHABLE_TYPE: [{
+        "question": "Starting from the start state {start_state}, which states can never be reached?",
+        "cot_prompt": "Please first find all the states reachable from {start_state} by following the edges, "
+                      "and then list the other states.",
+        "step1": "Step 1: Find all states reachable from {start_state}. The reachable states are {states}. ",
+        "step1_none": "Step 1: Find all states reachable from {start_state}. There are no reachable states. ",
+        "step2": "Step 2: List the other states. "
+                 "The states that cannot be reached from {start_state} are {unreachable_states}.",
+        "step2_none": "Step 2: List the other states. All the states can be reached from {start_state}.",
+    }],
+}
+
+# paraphrases added to the default variants
+PARAPHRASES = {
+    NEXTOK_TYPE: {
+        "question": "The flowchart is currently at state {cur_state}. Can it move to state {next_state} "
+                    "in a single step?",
+        "cot_prompt": "List the states reachable from {cur_state} in one step, check whether {next_state} "
+                      "is one of them, then answer.",
+        "step1": "Step 1: Collect the states reachable from {cur_state} in one step: {states}. ",
+        "step1_none": "Step 1: Collect the states reachable from {cur_state} in one step. There are none. ",
+        "step2_yes": "Step 2: Look for {next_state} in this list. {next_state} is in it, so the answer is yes.",
+        "step2_no": "Step 2: Look for {next_state} in this list. {next_state} is NOT in it, so the answer is no.",
+    },
+    ALLNEXT_TYPE: {
+        "question": "Which states can directly follow state {cur_state}?",
+        "cot_prompt": "Go through every edge leaving {cur_state}, describe where it leads, "
+                      "then give the list of next states.",
+        "step1": "Step 1: Collect the edges leaving {cur_state}. They lead to {states}. ",
+        "step2": "Step 2: Describe each edge:\n{explanations} ",
+        "explanation": "- From {cur_state}, the flow can go to {state}.",
+        "step3": "Step 3: Conclude. The states that can follow {cur_state} are {states}.",
+        "step1_none": "Step 1: Collect the edges leaving {cur_state}. There are none. ",
+        "step2_none": "Step 2: There is no edge to describe. ",
+        "step3_none": "Step 3: Conclude. No state can follow {cur_state}.",
+    },
+    ALLPREV_TYPE: {
+        "question": "From which states can the flowchart reach state {cur_state} in one step?",
+        "cot_prompt": "Go through every edge entering {cur_state}, describe where it starts, "
+                      "then give the list of previous states.",
+        "step1": "Step 1: Collect the edges entering {cur_state}. They start from {states}. ",
+        "step2": "Step 2: Describe each edge:\n{explanations} ",
+        "explanation": "- The flow can go from {state} to {cur_state}.",
+        "step3": "Step 3: Conclude. The states that can precede {cur_state} are {states}.",
+        "step1_none": "Step 1: Collect the edges entering {cur_state}. There are none. ",
+        "step2_none": "Step 2: There is no edge to describe. ",
+        "step3_none": "Step 3: Conclude. No state can precede {cur_state}.",
+    },
+    COND_TYPE: {
+        "question": "At the decision {cur_state}, which states come next if the condition is {value}?",
+        "cot_prompt": "List the branches of {cur_state} with their conditions, keep the ones for {value}, "
+                      "then give the next states.",
+        "branch": "{cond}->{state}",
+        "step1": "Step 1: List the branches of {cur_state} with their conditions: {branches}. ",
+        "step2": "Step 2: Keep the branches for the condition {value}. They lead to {states}. ",
+        "step3": "Step 3: Conclude. If the condition is {value}, {cur_state} leads to {states}.",
+        "step2_unmatched": "Step 2: Keep the branches for the condition {value}. None of them match. ",
+        "step3_unmatched": "Step 3: Conclude. If the condition is {value}, {cur_state} leads to no state.",
+        "step1_none": "Step 1: List the branches of {cur_state} with their conditions. There are none. ",
+        "step2_none": "Step 2: Keep the branches for the condition {value}. There are none. ",
+        "step3_none": "Step 3: Conclude. {cur_state} leads to no state.",
+    },
+    VALID_TYPE: {
+        "question": "Can the flowchart go through the states {sequence} in this order?",
+        "cot_prompt": "Check every step of {sequence} against the edges of the flowchart, then answer.",
+        "transition": "{first} -> {second}",
+        "step1": "Step 1: Split {sequence} into steps: {transitions}.",
+        "step2": "Step 2: Check each step against the edges.{checks}",
+        "check_valid": "\nThere is an edge from {first} to {second}.",
+        "check_invalid": "\nThere is NO edge from {first} to {second}.",
+        "step3_valid": "Step 3: Conclude. Every step follows an edge, so {sequence} is valid.",
+        "step3_invalid": "Step 3: Conclude. The steps {transitions} do NOT follow an edge, "
+                         "so {sequence} is NOT valid.",
+    },
+    REACH_TYPE: {
+        "question": "Starting at state {cur_state}, can the flowchart get to state {target_state} "
+                    "after one or more steps?",
+        "cot_prompt": "Walk the edges from {cur_state} looking for {target_state}, then answer.",
+        "step1": "Step 1: Walk the edges from {cur_state} looking for {target_state}. It is reached by {path}. ",
+        "step1_unreached": "Step 1: Walk the edges from {cur_state} looking for {target_state}. "
+                           "Only {states} can be reached. ",
+        "step1_none": "Step 1: Walk the edges from {cur_state} looking for {target_state}. No state can be reached. ",
+        "step2_yes": "Step 2: {target_state} is reached, so the answer is yes.",
+        "step2_no": "Step 2: {target_state} is never reached, so the answer is no.",
+    },
+    DISTANCE_TYPE: {
+        "question": "How many transitions at least does it take to go from state {cur_state} to state {target_state}?",
+        "cot_prompt": "Search outward from {cur_state} one step at a time until {target_state} appears, "
+                      "then count the transitions.",
+        "step1": "Step 1: Search outward from {cur_state} one step at a time. {target_state} first appears "
+                 "through {path}. ",
+        "step1_none": "Step 1: Search outward from {cur_state} one step at a time. {target_state} never appears. ",
+        "step2": "Step 2: The length of this path is {distance}, so the answer is {distance}.",
+        "step2_none": "Step 2: No path leads from {cur_state} to {target_state}, so the answer is none.",
+    },
+    UNREACHABLE_TYPE: {
+        "question": "Which states of the flowchart are never visited when starting from {start_state}?",
+        "cot_prompt": "Collect every state that can be reached from {start_state}, then give the states left out.",
+        "step1": "Step 1: Collect the states reachable from {start_state}: {states}. ",
+        "step1_none": "Step 1: Collect the states reachable from {start_state}. There are none. ",
+        "step2": "Step 2: Give the states left out: {unreachable_states}.",
+        "step2_none": "Step 2: No state is left out, every state can be reached from {start_state}.",
+    },
+}
+
+TEMPLATE_SETS = {
+    "default": DEFAULT_TEMPLATES,
+    "paraphrase": {question_type: variants + [PARAPHRASES[question_type]]
+                   for question_type, variants in DEFAULT_TEMPLATES.items()},
+}
+
+
+def render_nextok_reasoning(f: Dict[str, Callable], cur_state: str, next_state: str, states: List[str],
+                            reachable: bool) -> str:
+    step1 = f["step1"](cur_state=cur_state, states=', '.join(states)) if states else \
+        f["step1_none"](cur_state=cur_state)
+    step2 = f["step2_yes" if reachable else "step2_no"](next_state=next_state)
+    return '\n'.join([step1, step2])
+
+
+def render_edges_reasoning(f: Dict[str, Callable], cur_state: str, states: List[str]) -> str:
+    """Reasoning of the all next/all previous questions"""
+    if not states:
+        return '\n'.join([f["step1_none"](cur_state=cur_state), f["step2_none"](), f["step3_none"](cur_state=cur_state)])
+    states_str = ', '.join(states)
+    explanations = "\n".join([f["explanation"](cur_state=cur_state, state=state) for state in states])
+    return '\n'.join([f["step1"](cur_state=cur_state, states=states_str), f["step2"](explanations=explanations),
+                      f["step3"](cur_state=cur_state, states=states_str)])
+
+
+def render_cond_reasoning(f: Dict[str, Callable], cur_state: str, value: str, branches: List[Tuple[str, str]]) -> str:
+    if not branches:
+        return '\n'.join([f["step1_none"](cur_state=cur_state), f["step2_none"](value=value),
+                          f["step3_none"](cur_state=cur_state)])
+    step1 = f["step1"](cur_state=cur_state, branches=', '.join([f["branch"](cond=cond, state=state)
+                                                                for cond, state in branches]))
+    matched_states = [state for cond, state in branches if cond.lower() == value.lower()]
+    if matched_states:
+        states_str = ', '.join(matched_states)
+        step2 = f["step2"](value=value, states=states_str)
+        step3 = f["step3"](cur_state=cur_state, value=value, states=states_str)
+    else:
+        step2 = f["step2_unmatched"](value=value)
+        step3 = f["step3_unmatched"](cur_state=cur_state, value=value)
+    return '\n'.join([step1, step2, step3])
+
+
+def render_valid_reasoning(f: Dict[str, Callable], states: List[str], valid_transitions: List[bool]) -> str:
+    """
+    :param states: names of the states of the sequence
+    :param valid_transitions: whether each transition between consecutive states is valid
+    """
+    sequence = '->'.join(states)
+    pairs = list(zip(states, states[1:]))
+    step1 = f["step1"](sequence=sequence, transitions=', '.join([f["transition"](first=first, second=second)
+                                                                 for first, second in pairs]))
+    step2 = f["step2"](checks="".join([f["check_valid" if valid else "check_invalid"](first=first, second=second)
+                                       for (first, second), valid in zip(pairs, valid_transitions)]))
+    invalid = [f["transition"](first=first, second=second)
+               for (first, second), valid in zip(pairs, valid_transitions) if not valid]
+    if invalid:
+        step3 = f["step3_invalid"](sequence=sequence, transitions=', '.join(invalid))
+    else:
+        step3 = f["step3_valid"](sequence=sequence)
+    return '\n'.join([step1, step2, step3])
+
+
+def render_reach_reasoning(f: Dict[str, Callable], cur_state: str, target_state: str, path: List[str],
+                           states: List[str]) -> str:
+    """
+    :param path: names of the states of a shortest path from cur_state to target_state, empty if there is none
+    :param states: names of the states reachable from cur_state, only listed when target_state is not among them
+    """
+    if path:
+        return '\n'.join([f["step1"](cur_state=cur_state, target_state=target_state, path='->'.join(path)),
+                          f["step2_yes"](cur_state=cur_state, target_state=target_state)])
+    if states:
+        step1 = f["step1_unreached"](cur_state=cur_state, target_state=target_state, states=', '.join(states))
+    else:
+        step1 = f["step1_none"](cur_state=cur_state, target_state=target_state)
+    return '\n'.join([step1, f["step2_no"](cur_state=cur_state, target_state=target_state)])
+
+
+def render_distance_reasoning(f: Dict[str, Callable], cur_state: str, target_state: str, path: List[str]) -> str:
+    """
+    :param path: names of the states of a shortest path from cur_state to target_state, empty if there is none
+    """
+    if not path:
+        return '\n'.join([f["step1_none"](cur_state=cur_state, target_state=target_state),
+                          f["step2_none"](cur_state=cur_state, target_state=target_state)])
+    return '\n'.join([f["step1"](cur_state=cur_state, target_state=target_state, path='->'.join(path)),
+                      f["step2"](distance=len(path) - 1)])
+
+
+def render_unreachable_reasoning(f: Dict[str, Callable], start_state: str, states: List[str],
+                                 unreachable_states: List[str]) -> str:
+    """
+    :param states: names of the states reachable from start_state
+    :param unreachable_states: names of the other states, start_state excluded
+    """
+    step1 = f["step1"](start_state=start_state, states=', '.join(states)) if states else \
+        f["step1_none"](start_state=start_state)
+    step2 = f["step2"](start_state=start_state, unreachable_states=', '.join(unreachable_states)) \
+        if unreachable_states else f["step2_none"](start_state=start_state)
+    return '\n'.join([step1, step2])
+
+
+REASONING_RENDERERS = {
+    NEXTOK_TYPE: render_nextok_reasoning,
+    ALLNEXT_TYPE: render_edges_reasoning,
+    ALLPREV_TYPE: render_edges_reasoning,
+    COND_TYPE: render_cond_reasoning,
+    VALID_TYPE: render_valid_reasoning,
+    REACH_TYPE: render_reach_reasoning,
+    DISTANCE_TYPE: render_distance_reasoning,
+    UNREACHABLE_TYPE: render_unreachable_reasoning,
+}
+
+
+class ConvTemplates:
+    """
+    A template set compiled for the given flags: the image placeholder, CoT prompt and OCR slot
+    of every question variant are joined into one format string, and every fragment is bound
+    to its format method, so rendering a sample is only formatting its fields.
+    """
+    def __init__(self, templates: Dict[int, List[Dict[str, str]]], use_cot: bool = USE_COT, use_ocr: bool = USE_OCR):
+        self.use_cot = use_cot
+        self.use_ocr = use_ocr
+        self._questions: Dict[int, List[Callable]] = {}
+        self._fragments: Dict[int, List[Dict[str, Callable]]] = {}
+        for question_type, variants in templates.items():
+            self._questions[question_type] = []
+            self._fragments[question_type] = []
+            for variant in variants:
+                question = IMG_PLACEHOLDER + variant["question"]
+                if use_cot:
+                    question += " " + variant["cot_prompt"]
+                if use_ocr:
+                    question += " {ocr_content}"
+                self._questions[question_type].append(question.format)
+                self._fragments[question_type].append({key: text.format for key, text in variant.items()})
+
+    def choose_variant(self, question_type: int, rng=random) -> int:
+        """Index of a random variant, nothing is drawn when there is a single variant"""
+        variant_num = len(self._questions[question_type])
+        return rng.randrange(variant_num) if variant_num > 1 else 0
+
+    def question(self, question_type: int, variant: int, ocr_content: str = "", **fields: Any) -> str:
+        """Question text, fields are the placeholders of the question and CoT prompt, e.g. cur_state"""
+        return self._questions[question_type][variant](ocr_content=ocr_content, **fields)
+
+    def answer(self, question_type: int, variant: int, plain_answer: str, **fields: Any) -> str:
+        """
+        Answer text: the chain-of-thought reasoning built from the fields when CoT is used, plain_answer otherwise.
+        The fields are the arguments of the reasoning renderer of the question type, e.g. render_cond_reasoning.
+        """
+        if not self.use_cot:
+            return plain_answer
+        return REASONING_RENDERERS[question_type](self._fragments[question_type][variant], **fields)
+
+
+_conv_templates: Dict[Tuple[bool, bool], ConvTemplates] = {}
+
+
+def get_conv_templates(use_cot: bool = USE_COT, use_ocr: bool = USE_OCR) -> ConvTemplates:
+    """Templates of the run (CONV_TEMPLATE_SET) for the given flags, compiled on first use"""
+    if (use_cot, use_ocr) not in _conv_templates:
+        if CONV_TEMPLATE_SET not in TEMPLATE_SETS:
+            raise ValueError(f"Unknown template set: {CONV_TEMPLATE_SET}")
+        _conv_templates[(use_cot, use_ocr)] = ConvTemplates(TEMPLATE_SETS[CONV_TEMPLATE_SET], use_cot, use_ocr)
+    return _conv_templates[(use_cot, use_ocr)]
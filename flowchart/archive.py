@@ -0,0 +1,195 @@
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from flowchart.flowchart import Flowchart
+
+# columns of the archive: file name -> dtype
+COLUMNS = {
+    "chart_types": np.int8,  # type of each flowchart
+    "node_offsets": np.int64,  # index of the first node of each flowchart, plus the total node number
+    "node_types": np.int8,  # type of each node
+    "name_offsets": np.int64,  # offset of the name of each node in name_blob, plus the blob size
+    "name_blob": np.uint8,  # all the node names, utf-8 encoded
+    "edge_offsets": np.int64,  # index of the first edge of each flowchart, plus the total edge number
+    "edge_src": np.int32,  # first node of each edge, relative to its flowchart
+    "edge_dst": np.int32,  # second node of each edge, relative to its flowchart
+    "edge_cond": np.int8,  # condition of each edge, see CONDITION_CODES
+}
+OFFSET_COLUMNS = ["node_offsets", "name_offsets", "edge_offsets"]  # start with a leading 0
+
+CONDITION_CODES = {"": 0, "Y": 1, "N": 2}
+CONDITIONS = ["", "Y", "N"]
+
+META_FILE_NAME = "meta.json"
+
+
+class FlowchartArchiveWriter:
+    """
+    Appends flowcharts to a packed archive: one flat binary file per column, plus a meta file
+    with the number of committed elements of each column. Only committed data is visible to readers,
+    and reopening an archive drops whatever was written after the last commit.
+    """
+    def __init__(self, path: str, commit_every: int = 1000):
+        """
+        :param path: directory of the archive, created if needed, appended to if it exists
+        :param commit_every: number of flowcharts buffered before they are written and committed
+        """
+        self.path = path
+        self.commit_every = commit_every
+        if not os.path.exists(path):
+            os.makedirs(path)
+        meta = read_meta(path)
+        self.count = meta["count"]
+        self.sizes = meta["sizes"]
+        # tails of the offset columns, the next offsets continue from them
+        self.node_total = self.sizes["node_types"]
+        self.name_total = self.sizes["name_blob"]
+        self.edge_total = self.sizes["edge_src"]
+        self._files = {}
+        for column, dtype in COLUMNS.items():
+            filename = os.path.join(path, f"{column}.bin")
+            f = open(filename, "r+b" if os.path.exists(filename) else "w+b")
+            f.truncate(self.sizes[column] * np.dtype(dtype).itemsize)  # drop uncommitted data
+            f.seek(0, os.SEEK_END)
+            self._files[column] = f
+        self._buffers = {column: [] for column in COLUMNS}
+        self._pending = 0
+        if self.sizes["node_offsets"] == 0:  # new archive
+            for column in OFFSET_COLUMNS:
+                self._buffers[column].append(0)
+
+    def __len__(self):
+        return self.count + self._pending
+
+    def append(self, flowchart: Flowchart) -> bytes:
+        """
+        Append a flowchart, its id is the number of flowcharts before it.
+        :return: the packed record of the flowchart, e.g. for hashing
+        """
+        names = [name.encode("utf-8") for name, _ in flowchart.nodes]
+        name_offsets = np.cumsum([len(name) for name in names], dtype=np.int64) + self.name_total
+        record = {
+            "chart_types": [flowchart.type],
+            "node_offsets": [self.node_total + flowchart.node_num],
+            "node_types": [node_type for _, node_type in flowchart.nodes],
+            "name_offsets": name_offsets.tolist(),
+            "name_blob": list(b"".join(names)),
+            "edge_offsets": [self.edge_total + len(flowchart.edges)],
+            "edge_src": [edge[0] for edge in flowchart.edges],
+            "edge_dst": [edge[1] for edge in flowchart.edges],
+            "edge_cond": [CONDITION_CODES[edge[2]] for edge in flowchart.edges],
+        }
+        for column, values in record.items():
+            self._buffers[column].extend(values)
+        self.node_total += flowchart.node_num
+        self.name_total += sum(len(name) for name in names)
+        self.edge_total += len(flowchart.edges)
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+        return b"".join(np.asarray(values, dtype=COLUMNS[column]).tobytes() for column, values in record.items())
+
+    def commit(self):
+        for column, dtype in COLUMNS.items():
+            values = self._buffers[column]
+            if values:
+                self._files[column].write(np.asarray(values, dtype=dtype).tobytes())
+                self.sizes[column] += len(values)
+            self._files[column].flush()
+            self._buffers[column] = []
+        self.count += self._pending
+        self._pending = 0
+        write_meta(self.path, {"count": self.count, "sizes": self.sizes})
+
+    def close(self):
+        self.commit()
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class FlowchartArchive:
+    """
+    Read-only view of a packed archive. Columns are memory-mapped,
+    so opening is cheap and any flowchart can be loaded by id in O(1).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        meta = read_meta(path)
+        self.count = meta["count"]
+        self.columns: Dict[str, np.ndarray] = {}
+        for column, dtype in COLUMNS.items():
+            size = meta["sizes"][column]
+            if size == 0:
+                self.columns[column] = np.zeros(0, dtype=dtype)
+            else:
+                self.columns[column] = np.memmap(os.path.join(path, f"{column}.bin"), dtype=dtype,
+                                                 mode="r", shape=(size,))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, flowchart_id: int) -> Flowchart:
+        return self.get(flowchart_id)
+
+    def get(self, flowchart_id: int) -> Flowchart:
+        if not 0 <= flowchart_id < self.count:
+            raise IndexError(f"Flowchart {flowchart_id} is not in the archive {self.path}")
+        c = self.columns
+        node_start, node_end = int(c["node_offsets"][flowchart_id]), int(c["node_offsets"][flowchart_id + 1])
+        edge_start, edge_end = int(c["edge_offsets"][flowchart_id]), int(c["edge_offsets"][flowchart_id + 1])
+        name_offsets = c["name_offsets"][node_start:node_end + 1].tolist()
+        blob = c["name_blob"][name_offsets[0]:name_offsets[-1]].tobytes()
+        base = name_offsets[0]
+        node_types = c["node_types"][node_start:node_end].tolist()
+        nodes = [(blob[name_offsets[i] - base:name_offsets[i + 1] - base].decode("utf-8"), node_types[i])
+                 for i in range(node_end - node_start)]
+        edges = [(src, dst, CONDITIONS[cond]) for src, dst, cond in zip(c["edge_src"][edge_start:edge_end].tolist(),
+                                                                        c["edge_dst"][edge_start:edge_end].tolist(),
+                                                                        c["edge_cond"][edge_start:edge_end].tolist())]
+        return Flowchart(int(c["chart_types"][flowchart_id]), node_end - node_start, nodes, edges)
+
+    def node_nums(self) -> np.ndarray:
+        return np.diff(self.columns["node_offsets"][:self.count + 1])
+
+    def edge_nums(self) -> np.ndarray:
+        return np.diff(self.columns["edge_offsets"][:self.count + 1])
+
+    def decision_node_nums(self, decision_type: int) -> np.ndarray:
+        is_decision = np.concatenate([[0], np.cumsum(self.columns["node_types"] == decision_type, dtype=np.int64)])
+        offsets = self.columns["node_offsets"][:self.count + 1]
+        return is_decision[offsets[1:]] - is_decision[offsets[:-1]]
+
+    def chart_types(self) -> np.ndarray:
+        return self.columns["chart_types"][:self.count]
+
+
+def read_meta(path: str) -> dict:
+    meta_path = os.path.join(path, META_FILE_NAME)
+    if not os.path.exists(meta_path):
+        return {"count": 0, "sizes": {column: 0 for column in COLUMNS}}
+    with open(meta_path, "r") as f:
+        return json.load(f)
+
+
+def write_meta(path: str, meta: dict):
+    """Written to a temporary file then renamed, so a crash never leaves a partial meta file."""
+    tmp_path = os.path.join(path, META_FILE_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(path, META_FILE_NAME))
+
+
+def ordered_counts(values: np.ndarray) -> List[tuple]:
+    """(value, count) pairs in order of first occurrence, like counting into a dict one value at a time."""
+    uniques, first_index, counts = np.unique(values, return_index=True, return_counts=True)
+    order = np.argsort(first_index)
+    return [(uniques[i].item(), int(counts[i])) for i in order]
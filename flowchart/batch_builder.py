@@ -0,0 +1,229 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from flowchart.flowchart import Flowchart
+from constant import NORMAL_TYPE, DECISION_TYPE, MAX_NODE_NUM, NODE_NUM_MEAN, NODE_NUM_STD, ALLOWED_CHARACTERS, SEED, FLOWCHART_BATCH_SIZE
+
+# edge conditions by code
+CONDITIONS = np.array(["", "Y", "N"])
+PLAIN_CODE, YES_CODE, NO_CODE = 0, 1, 2
+
+CHARACTER_TABLE = np.frombuffer(ALLOWED_CHARACTERS.encode("ascii"), dtype=np.uint8)
+
+
+def normal_random_ints(rng: np.random.Generator, mean, std, low, high, size: int) -> np.ndarray:
+    """Vectorized utils.get_normal_random_int, mean/std/low/high may be arrays of the given size"""
+    # np.rint rounds half to even like round()
+    return np.clip(np.rint(rng.normal(mean, std, size)), low, high).astype(np.int64)
+
+
+def rank_in_groups(groups: np.ndarray, keys: np.ndarray, group_starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sort elements by (group, key) and rank them within their group.
+    :param groups: sorted group index of each element
+    :param keys: random keys, a group sorted by keys is a uniformly random permutation of it
+    :param group_starts: index of the first element of each group
+    :return: (order of the elements, rank of each element in its group)
+    """
+    # keys are in [0, 1), so a single sort of group + key orders by group then by key
+    order = np.argsort(groups + keys)
+    ranks = np.empty(len(groups), dtype=np.int64)
+    ranks[order] = np.arange(len(groups)) - group_starts[groups[order]]
+    return order, ranks
+
+
+class BatchFlowchartBuilder:
+    """
+    Builds many flowcharts per call with vectorized draws from a numpy.random.Generator.
+    Types, node numbers, edges and decision nodes follow the same distributions as FlowchartBuilder,
+    and node names are unique within each flowchart.
+    """
+    def __init__(self, rng: np.random.Generator):
+        self.rng = rng
+
+    def gen_names(self, node_nums: np.ndarray) -> List[List[str]]:
+        """Random node names like utils.gen_random_str, redrawn until they are unique within each flowchart"""
+        lengths = normal_random_ints(self.rng, 7, 1.8, 1, 16, int(node_nums.sum()))
+        codes = self.rng.integers(0, len(ALLOWED_CHARACTERS), int(lengths.sum()))
+        text = CHARACTER_TABLE[codes].tobytes().decode("ascii")
+        ends = np.cumsum(lengths).tolist()
+        starts = [0] + ends[:-1]
+        names = [text[start:end] for start, end in zip(starts, ends)]
+        charts, node_start = [], 0
+        for node_num in node_nums.tolist():
+            chart_names = names[node_start:node_start + node_num]
+            node_start += node_num
+            if len(set(chart_names)) < node_num:
+                seen = set()
+                for i, name in enumerate(chart_names):
+                    while name in seen:
+                        length = int(normal_random_ints(self.rng, 7, 1.8, 1, 16, 1)[0])
+                        name = CHARACTER_TABLE[self.rng.integers(0, len(ALLOWED_CHARACTERS), length)] \
+                            .tobytes().decode("ascii")
+                    chart_names[i] = name
+                    seen.add(name)
+            charts.append(chart_names)
+        return charts
+
+    def gen_node_types(self, chart_types: np.ndarray, node_nums: np.ndarray, chart_of_node: np.ndarray,
+                       node_starts: np.ndarray) -> np.ndarray:
+        """Decision flowcharts get about node_num/4 decision nodes (at least one) at random positions"""
+        decision_nums = normal_random_ints(self.rng, node_nums / 4, 1, 1, node_nums, len(node_nums))
+        decision_nums[chart_types == NORMAL_TYPE] = 0
+        _, ranks = rank_in_groups(chart_of_node, self.rng.random(len(chart_of_node)), node_starts)
+        return np.where(ranks < decision_nums[chart_of_node], DECISION_TYPE, NORMAL_TYPE)
+
+    def gen_forward_edges(self, nodes: np.ndarray, node_ids: np.ndarray, successor_nums: np.ndarray,
+                          forward_nums: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        forward_num distinct successors of each node, in random order like random.sample.
+        Draw j picks an index among the successors not drawn yet, shifted past the ones drawn before,
+        so the work is linear in the number of edges, not in the number of successors.
+        :return: (global index of the first node, second node id, draw number) of each edge
+        """
+        max_forward = int(forward_nums.max()) if len(nodes) else 0
+        offsets = np.zeros((len(nodes), max_forward), dtype=np.int64)  # successor offsets drawn by each node
+        src, dst, slots = [], [], []
+        for j in range(max_forward):
+            rows = np.flatnonzero(forward_nums > j)
+            picks = self.rng.integers(0, successor_nums[rows] - j)
+            for drawn in np.sort(offsets[rows, :j], axis=1).T:  # ascending, so each shift sees the previous ones
+                picks += picks >= drawn
+            offsets[rows, j] = picks
+            src.append(nodes[rows])
+            dst.append(node_ids[rows] + 1 + picks)
+            slots.append(np.full(len(rows), j))
+        empty = np.zeros(0, dtype=np.int64)
+        return np.concatenate(src or [empty]), np.concatenate(dst or [empty]), np.concatenate(slots or [empty])
+
+    def gen_normal_edges(self, nodes: np.ndarray, node_ids: np.ndarray, node_nums: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        Edges of normal nodes, see FlowchartBuilder.gen_edges_for_normal_node:
+        [1, node_num - i - 1] distinct forward edges (none for the last node),
+        and a back edge with 15% chance (except for the first node).
+        :param nodes: global index of each normal node
+        :param node_ids: index of each normal node in its flowchart
+        :param node_nums: node number of the flowchart of each normal node
+        :return: (global index of the first node, second node id, condition code, slot) of each edge
+        """
+        successor_nums = node_nums - node_ids - 1
+        forward_nums = normal_random_ints(self.rng, 1.2, 0.8, 1, np.maximum(successor_nums, 1), len(nodes))
+        forward_nums[successor_nums == 0] = 0
+        forward = self.gen_forward_edges(nodes, node_ids, successor_nums, forward_nums)
+        # back edges, after the forward ones
+        has_back = (node_ids > 0) & (self.rng.random(len(nodes)) < 0.15)
+        back_targets = self.rng.integers(0, np.maximum(node_ids, 1))
+        src = np.concatenate([forward[0], nodes[has_back]])
+        dst = np.concatenate([forward[1], back_targets[has_back]])
+        slots = np.concatenate([forward[2], np.full(int(has_back.sum()), MAX_NODE_NUM)])
+        return src, dst, np.full(len(src), PLAIN_CODE), slots
+
+    def gen_decision_edges(self, nodes: np.ndarray, node_ids: np.ndarray, node_nums: np.ndarray) -> Tuple[np.ndarray, ...]:
+        """
+        A Y edge and a N edge per decision node, see FlowchartBuilder.gen_edges_for_decision_node:
+        for 70% chance, all out edges are forward (if valid)
+        for 10% chance, all out edges are backward (if valid)
+        for 20% chance, one forward and one backward
+        """
+        rng, size = self.rng, len(nodes)
+        predecessor_nums, successor_nums = node_ids, node_nums - node_ids - 1
+        # candidate targets of every kind, drawn for all nodes and selected below
+        first = rng.integers(0, np.maximum(successor_nums, 1))
+        second = rng.integers(0, np.maximum(successor_nums - 1, 1))
+        two_forward = (node_ids + 1 + first, node_ids + 1 + second + (second >= first))
+        first = rng.integers(0, np.maximum(predecessor_nums, 1))
+        second = rng.integers(0, np.maximum(predecessor_nums - 1, 1))
+        two_backward = (first, second + (second >= first))
+        one_backward = rng.integers(0, np.maximum(predecessor_nums, 1))
+        one_forward = node_ids + 1 + rng.integers(0, np.maximum(successor_nums, 1))
+        # (use two forward, use two backward) for each case, one backward and one forward otherwise
+        random_nums = rng.random(size)
+        mostly_forward, mostly_backward = random_nums < 0.7, (random_nums >= 0.7) & (random_nums < 0.8)
+        mixed = random_nums >= 0.8
+        use_forward = (mostly_forward & (successor_nums >= 2)) | \
+                      (mostly_backward & (predecessor_nums == 0)) | \
+                      (mixed & ((predecessor_nums == 0) | (successor_nums == 0)) & (predecessor_nums < 2))
+        use_backward = (mostly_forward & (successor_nums == 0)) | \
+                       (mostly_backward & (predecessor_nums >= 2)) | \
+                       (mixed & ((predecessor_nums == 0) | (successor_nums == 0)) & (predecessor_nums >= 2))
+        yes_targets = np.where(use_forward, two_forward[0], np.where(use_backward, two_backward[0], one_backward))
+        no_targets = np.where(use_forward, two_forward[1], np.where(use_backward, two_backward[1], one_forward))
+        # 10% case with a single predecessor: [node_id - 1, random successor]
+        single_predecessor = mostly_backward & (predecessor_nums == 1)
+        yes_targets[single_predecessor] = node_ids[single_predecessor] - 1
+        src = np.concatenate([nodes, nodes])
+        dst = np.concatenate([yes_targets, no_targets])
+        conditions = np.concatenate([np.full(size, YES_CODE), np.full(size, NO_CODE)])
+        slots = np.concatenate([np.zeros(size, dtype=np.int64), np.ones(size, dtype=np.int64)])
+        return src, dst, conditions, slots
+
+    def build(self, chart_num: int) -> List[Flowchart]:
+        """Build chart_num flowcharts"""
+        rng = self.rng
+        chart_types = np.where(rng.random(chart_num) < 0.8, NORMAL_TYPE, DECISION_TYPE)
+        node_nums = normal_random_ints(rng, NODE_NUM_MEAN, NODE_NUM_STD, 3, MAX_NODE_NUM, chart_num)
+        node_starts = np.concatenate([[0], np.cumsum(node_nums)[:-1]])
+        chart_of_node = np.repeat(np.arange(chart_num), node_nums)
+        node_ids = np.arange(len(chart_of_node)) - node_starts[chart_of_node]
+        names = self.gen_names(node_nums)
+        node_types = self.gen_node_types(chart_types, node_nums, chart_of_node, node_starts)
+
+        is_normal = node_types == NORMAL_TYPE
+        normal_nodes, decision_nodes = np.flatnonzero(is_normal), np.flatnonzero(~is_normal)
+        normal_edges = self.gen_normal_edges(normal_nodes, node_ids[normal_nodes], node_nums[chart_of_node[normal_nodes]])
+        decision_edges = self.gen_decision_edges(decision_nodes, node_ids[decision_nodes],
+                                                 node_nums[chart_of_node[decision_nodes]])
+        src, dst, conditions, slots = (np.concatenate(columns) for columns in zip(normal_edges, decision_edges))
+        # edges in the order of FlowchartBuilder: by first node, then forward before backward / Y before N
+        order = np.lexsort((slots, src))
+        src, dst, conditions = src[order], dst[order], conditions[order]
+        edge_nums = np.bincount(chart_of_node[src], minlength=chart_num)
+
+        node_types, src_ids, dst = node_types.tolist(), node_ids[src].tolist(), dst.tolist()
+        conditions = CONDITIONS[conditions].tolist()
+        flowcharts, node_start, edge_start = [], 0, 0
+        for chart_names, chart_type, node_num, edge_num in zip(names, chart_types.tolist(), node_nums.tolist(),
+                                                               edge_nums.tolist()):
+            node_end, edge_end = node_start + node_num, edge_start + edge_num
+            nodes = list(zip(chart_names, node_types[node_start:node_end]))
+            edges = list(zip(src_ids[edge_start:edge_end], dst[edge_start:edge_end], conditions[edge_start:edge_end]))
+            flowcharts.append(Flowchart(chart_type, node_num, nodes, edges))
+            node_start, edge_start = node_end, edge_end
+        return flowcharts
+
+    def gen_directions(self, chart_num: int) -> List[str]:
+        """Directions of the Mermaid scripts, 70% LR and 30% TB like Flowchart.to_mmd()"""
+        return np.where(self.rng.random(chart_num) < 0.7, "LR", "TB").tolist()
+
+
+class SeededFlowchartBatches:
+    """
+    The flowcharts of a run, built batch by batch when first needed.
+    Batch b is built by its own generator seeded with (seed, b), so any flowchart
+    can be rebuilt (e.g. when resuming a run) without building the batches before it.
+    Batches are always built whole, so a flowchart does not depend on the number of flowcharts of the run,
+    and a run resumed with a larger FLOWCHART_NUM keeps the flowchart ids of a run made in one go.
+    """
+    def __init__(self, batch_size: int = FLOWCHART_BATCH_SIZE, seed: int = SEED):
+        self.batch_size = batch_size
+        self.seed = seed
+        self._batches: Dict[int, List[Tuple[Flowchart, str]]] = {}
+
+    def get(self, flowchart_id: int) -> Tuple[Flowchart, str]:
+        """:return: (flowchart, direction of its Mermaid script)"""
+        batch_id, index = divmod(flowchart_id, self.batch_size)
+        if batch_id not in self._batches:
+            self._batches = {}  # only the current batch is kept in memory
+            builder = BatchFlowchartBuilder(np.random.default_rng([self.seed, batch_id]))
+            self._batches[batch_id] = list(zip(builder.build(self.batch_size), builder.gen_directions(self.batch_size)))
+        return self._batches[batch_id][index]
+
+    def redraw(self, flowchart_id: int, attempt: int) -> Tuple[Flowchart, str]:
+        """
+        Another flowchart in place of flowchart_id (e.g. a duplicate), from a generator seeded
+        with (seed, flowchart_id, attempt), so redraws are also reproducible.
+        :param attempt: number of the redraw, from 1
+        """
+        builder = BatchFlowchartBuilder(np.random.default_rng([self.seed, flowchart_id, attempt]))
+        return builder.build(1)[0], builder.gen_directions(1)[0]
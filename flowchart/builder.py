@@ -8,7 +8,7 @@ from utils import get_normal_random_int, gen_random_str
 class FlowchartBuilder:
     def __init__(self):
         self.type = NORMAL_TYPE if random.random() < 0.8 else DECISION_TYPE
-        self.node_num = get_normal_random_int(mean=6.5, std=1, low=3, high=MAX_NODE_NUM)
+        self.node_num = get_normal_random_int(mean=NODE_NUM_MEAN, std=NODE_NUM_STD, low=3, high=MAX_NODE_NUM)
         self.edges = []
         self.nodes = []
 
@@ -88,7 +88,7 @@ class FlowchartBuilder:
     def build_decision_flowchart(self):
         """Generate a random decision flowchart with given node number"""
         decision_num = get_normal_random_int(mean=self.node_num/4, std=1, low=1, high=self.node_num)
-        decision_nodes = random.sample(range(self.node_num), decision_num)
+        decision_nodes = set(random.sample(range(self.node_num), decision_num))
         for i in range(self.node_num):
             if i in decision_nodes:
                 self.nodes.append(self.gen_node(1))
@@ -4,8 +4,11 @@ import mermaid as md
 from mermaid import Graph
 import pickle
 
-from flowchart.node_data import NodeData
-from constant import YES_ID, NO_ID, NORMAL_TYPE
+from flowchart.node_data import NodeData, node_code
+from flowchart.graph_index import GraphIndex
+from flowchart.reach_index import ReachIndex
+from flowchart.structural_hash import structural_hash
+from constant import PLAIN_ID, YES_ID, NO_ID, NORMAL_TYPE
 
 class Flowchart:
     def __init__(self, type_: int, node_num: int, nodes: List[Tuple[str, int]], edges: List[Tuple[int, int, str]]):
@@ -21,6 +24,12 @@ class Flowchart:
         self.node_num = node_num
         self.nodes = nodes
         self.edges = edges
+        self._reach_index = None  # cached by get_reach_index(), never pickled
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_reach_index", None)
+        return state
 
     def __str__(self):
         return f"Flowchart(type={self.type},\n node_num={self.node_num},\n nodes={self.nodes},\n edges={self.edges})"
@@ -33,65 +42,94 @@ class Flowchart:
         node_data = []
         for i in range(self.node_num):
             node = self.nodes[i]
-            node_data.append(NodeData(i, chr(ord('A') + i), node[0], node[1]))
+            node_data.append(NodeData(i, node_code(i), node[0], node[1]))
         return node_data
     
-    @staticmethod 
+    @staticmethod
+    def node_to_str(node: NodeData) -> str:
+        """Declare a node with its shape and name in Mermaid"""
+        if node.type == NORMAL_TYPE:  # non-decision node
+            return f"\t{node.code}({node.name})"
+        return f"\t{node.code}{{{node.name}}}"  # decision node
+
+    @staticmethod
     def edge_to_str(edge: Tuple[int, int, str], node_data: List[NodeData]) -> str:
-        """Convert an edge to a Mermaid string"""
+        """Convert an edge to a Mermaid string, between the codes of its (declared) nodes"""
         first_id, second_id, condition = edge
-        first, second = node_data[first_id], node_data[second_id]
-        ret = f"\t{first.code}"
-        if first.type == NORMAL_TYPE:  # non-decision node
-            ret += f"({first.name})"
-        else:  # decision node
-            ret += f"{{{first.name}}}"
         if condition != "":
-            ret += f"-- {condition} -->{second.code}"
-        else:
-            ret += f"-->{second.code}"
-        if second.type == NORMAL_TYPE:
-            ret += f"({second.name})"
-        else:
-            ret += f"{{{second.name}}}"
-        return ret
+            return f"\t{node_data[first_id].code}-- {condition} -->{node_data[second_id].code}"
+        return f"\t{node_data[first_id].code}-->{node_data[second_id].code}"
     
     def build_matrix(self) -> List[List[int]]:
-        """Convert the flowchart to an adjacency matrix"""
+        """
+        Convert the flowchart to an adjacency matrix.
+        It takes node_num^2 memory, the generation pipeline uses the sparse build_graph_index instead.
+        """
         matrix = [[0 for _ in range(self.node_num)] for _ in range(self.node_num)]
         if self.type == NORMAL_TYPE:  # non-decision flowchart
             for edge in self.edges:
-                matrix[edge[0]][edge[1]] = 1
+                matrix[edge[0]][edge[1]] = PLAIN_ID
         else:  # decision flowchart
             for edge in self.edges:
                 if edge[2] == "":
-                    matrix[edge[0]][edge[1]] = 1
+                    matrix[edge[0]][edge[1]] = PLAIN_ID
                 elif edge[2] == "Y":
                     matrix[edge[0]][edge[1]] = YES_ID
                 else:
                     matrix[edge[0]][edge[1]] = NO_ID
         return matrix
+
+    def build_graph_index(self) -> GraphIndex:
+        """Build the adjacency lists and sets of the flowchart, see GraphIndex"""
+        return GraphIndex(self.type, self.node_num, self.edges)
+
+    def get_reach_index(self, graph_index: GraphIndex = None) -> ReachIndex:
+        """
+        Reachability between all the nodes and shortest paths, see ReachIndex.
+        It is built on first use and cached with the flowchart.
+        :param graph_index: graph index of this flowchart if already built
+        """
+        if getattr(self, "_reach_index", None) is None:
+            self._reach_index = ReachIndex(graph_index if graph_index is not None else self.build_graph_index())
+        return self._reach_index
     
-    def to_mmd(self) -> str:
-        """Generate mermaid script of this flowchart"""
-        # 70% LR, 30% TB
-        direction = "LR" if random.random() < 0.7 else "TB"
-        mmd = f"flowchart {direction}\n"
+    def structural_hash(self) -> str:
+        """Hash of the structure of the flowchart, the same for all the flowcharts isomorphic to it, see structural_hash"""
+        return structural_hash(self.type, self.nodes, self.edges)
+
+    def to_mmd(self, direction: str = None) -> str:
+        """
+        Generate mermaid script of this flowchart
+        :param direction: "LR" or "TB", drawn at random if not given
+        """
+        if direction is None:
+            # 70% LR, 30% TB
+            direction = "LR" if random.random() < 0.7 else "TB"
         node_data = self.build_node_data()
-        # the code of each node is assigned with "A", "B", "C", ..., !!!do not use more than 26 nodes!!!
-        for edge in self.edges:
-            mmd += Flowchart.edge_to_str(edge, node_data) + "\n"
-        return mmd
+        # nodes are declared in the order they first appear in the edges, which is the order Mermaid lays them out,
+        # then the nodes without edges
+        order = list(dict.fromkeys(node_id for first_id, second_id, _ in self.edges for node_id in (first_id, second_id)))
+        if len(order) < self.node_num:
+            declared = set(order)
+            order.extend(i for i in range(self.node_num) if i not in declared)
+        lines = [f"flowchart {direction}"]
+        lines.extend(Flowchart.node_to_str(node_data[i]) for i in order)
+        lines.extend(Flowchart.edge_to_str(edge, node_data) for edge in self.edges)
+        return "\n".join(lines) + "\n"
     
-    def save_mmd(self, filename: str):
-        """Save mermaid script to a file"""
+    def save_mmd(self, filename: str, direction: str = None) -> str:
+        """Save mermaid script to a file, return the saved script"""
+        mmd = self.to_mmd(direction)
         with open(filename, "w") as f:
-            f.write(self.to_mmd())
+            f.write(mmd)
+        return mmd
 
-    def save_pickle(self, filename: str):
-        """Save the flowchart to a pickle file"""
+    def save_pickle(self, filename: str) -> bytes:
+        """Save the flowchart to a pickle file, return the pickled bytes"""
+        data = pickle.dumps(self)
         with open(filename, "wb") as f:
-            pickle.dump(self, f)
+            f.write(data)
+        return data
 
     @staticmethod
     def load_pickle(filename: str):
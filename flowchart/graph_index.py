@@ -0,0 +1,88 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+from constant import NORMAL_TYPE, INVALID_ID, PLAIN_ID, YES_ID, NO_ID
+
+EDGE_IDS = [PLAIN_ID, YES_ID, NO_ID]
+
+
+class GraphIndex:
+    """
+    Adjacency lists and sets of a flowchart, split by edge condition, in O(node_num + edge_num) memory.
+    It holds the same edges as Flowchart.build_matrix() (a later edge between two nodes overrides
+    an earlier one), so the queries give the same answers as scanning the matrix,
+    but run in O(degree) instead of O(node_num).
+    All the id lists are sorted, like the results of a scan over range(node_num).
+    Self loops are kept in edge_ids only, they are never valid transitions.
+    """
+    def __init__(self, type_: int, node_num: int, edges: List[Tuple[int, int, str]]):
+        """
+        :param type_: type of the flowchart, conditions are ignored in non-decision flowcharts
+        :param node_num: number of nodes
+        :param edges: list of tuples (first_id, second_id, condition), see Flowchart
+        """
+        self.node_num = node_num
+        self.edge_ids: Dict[Tuple[int, int], int] = {}  # (first_id, second_id) -> edge id in matrix
+        for first_id, second_id, condition in edges:
+            if type_ == NORMAL_TYPE or condition == "":
+                self.edge_ids[(first_id, second_id)] = PLAIN_ID
+            else:
+                self.edge_ids[(first_id, second_id)] = YES_ID if condition == "Y" else NO_ID
+        # edge id -> node id -> ids of the next/previous nodes through edges with this id
+        self.cond_next_ids: Dict[int, List[List[int]]] = {edge_id: [[] for _ in range(node_num)]
+                                                          for edge_id in EDGE_IDS}
+        self.cond_prev_ids: Dict[int, List[List[int]]] = {edge_id: [[] for _ in range(node_num)]
+                                                          for edge_id in EDGE_IDS}
+        self.next_ids: List[List[int]] = [[] for _ in range(node_num)]
+        self.prev_ids: List[List[int]] = [[] for _ in range(node_num)]
+        # same ids as next_ids/prev_ids, for membership tests
+        self.next_sets: List[Set[int]] = [set() for _ in range(node_num)]
+        self.prev_sets: List[Set[int]] = [set() for _ in range(node_num)]
+        # in (first_id, second_id) order, so both the next and the previous ids come out sorted
+        for (first_id, second_id), edge_id in sorted(self.edge_ids.items()):
+            if first_id == second_id:
+                continue
+            self.cond_next_ids[edge_id][first_id].append(second_id)
+            self.cond_prev_ids[edge_id][second_id].append(first_id)
+            self.next_ids[first_id].append(second_id)
+            self.prev_ids[second_id].append(first_id)
+            self.next_sets[first_id].add(second_id)
+            self.prev_sets[second_id].add(first_id)
+
+    def edge_id(self, from_id: int, to_id: int) -> int:
+        """Id of the edge from from_id to to_id, like matrix[from_id][to_id]"""
+        return self.edge_ids.get((from_id, to_id), INVALID_ID)
+
+    def has_edge(self, from_id: int, to_id: int) -> bool:
+        """Whether there is an edge from from_id to to_id, self loops included"""
+        return (from_id, to_id) in self.edge_ids
+
+    def is_valid_transition(self, from_id: int, to_id: int) -> bool:
+        """Same as utils.is_valid_transition on the adjacency matrix"""
+        return to_id in self.next_sets[from_id]
+
+    def is_conditionally_valid_transition(self, from_id: int, to_id: int, condition_id: int) -> bool:
+        """Same as utils.is_conditionally_valid_transition on the adjacency matrix"""
+        return from_id != to_id and self.edge_id(from_id, to_id) == condition_id
+
+    def get_start_id(self) -> Optional[int]:
+        """Id of the first node without previous nodes (self loops aside), None if every node has one"""
+        for i in range(self.node_num):
+            if not self.prev_ids[i]:
+                return i
+        return None
+
+    def get_next_ids(self, cur_id: int) -> List[int]:
+        return self.next_ids[cur_id]
+
+    def get_prev_ids(self, cur_id: int) -> List[int]:
+        return self.prev_ids[cur_id]
+
+    def get_cond_next_ids(self, cur_id: int, condition_id: int) -> List[int]:
+        if condition_id not in self.cond_next_ids:
+            return []
+        return self.cond_next_ids[condition_id][cur_id]
+
+    def get_cond_prev_ids(self, cur_id: int, condition_id: int) -> List[int]:
+        if condition_id not in self.cond_prev_ids:
+            return []
+        return self.cond_prev_ids[condition_id][cur_id]
@@ -1,6 +1,16 @@
 class NodeData:
     def __init__(self, id_: int, code: str, name: str, type_: int):
         self.id = id_  # 0, 1, 2, ...
-        self.code = code  # A, B, C, ...
+        self.code = code  # A, B, ..., Z, AA, AB, ..., see node_code
         self.name = name  # given random string
         self.type = type_  # 0 for non-decision node, 1 for decision node
+
+
+def node_code(node_id: int) -> str:
+    """Mermaid code of a node: A, B, ..., Z, then AA, AB, ..., ZZ, AAA, ... (bijective base 26)"""
+    code = ""
+    node_id += 1
+    while node_id > 0:
+        node_id, rest = divmod(node_id - 1, 26)
+        code = chr(ord('A') + rest) + code
+    return code
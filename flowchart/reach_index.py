@@ -0,0 +1,140 @@
+from collections import deque
+from typing import Dict, List, Tuple
+
+from flowchart.graph_index import GraphIndex
+
+UNREACHABLE = -1  # distance and parent of the nodes that cannot be reached
+
+
+def transitive_closure(next_ids: List[List[int]]) -> List[int]:
+    """
+    Bitsets of the nodes reachable from each node (bit j for node j), a node is in its own bitset
+    only if it is on a cycle. The strongly connected components are found with Tarjan's algorithm,
+    which closes every component after the components it leads to, so the bitset of a component
+    is the union of the bitsets of its successors: O(node_num + edge_num) bitset operations.
+    :param next_ids: ids of the next nodes of each node, see GraphIndex.next_ids
+    """
+    node_num = len(next_ids)
+    order = [UNREACHABLE] * node_num  # visit order of the nodes
+    low = [0] * node_num  # lowest visit order reachable through the nodes on the stack
+    on_stack = [False] * node_num
+    stack: List[int] = []
+    closure = [0] * node_num
+    counter = 0
+    for root in range(node_num):
+        if order[root] != UNREACHABLE:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        # depth-first search without recursion, so long chains do not hit the recursion limit
+        work = [(root, iter(next_ids[root]))]
+        while work:
+            cur_id, successors = work[-1]
+            for next_id in successors:
+                if order[next_id] == UNREACHABLE:
+                    order[next_id] = low[next_id] = counter
+                    counter += 1
+                    stack.append(next_id)
+                    on_stack[next_id] = True
+                    work.append((next_id, iter(next_ids[next_id])))
+                    break
+                if on_stack[next_id]:
+                    low[cur_id] = min(low[cur_id], order[next_id])
+            else:
+                work.pop()
+                if work:
+                    parent_id = work[-1][0]
+                    low[parent_id] = min(low[parent_id], low[cur_id])
+                if low[cur_id] != order[cur_id]:
+                    continue
+                # cur_id is the root of a component, the components it leads to are closed already
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == cur_id:
+                        break
+                reach = 0
+                for member in component:
+                    for next_id in next_ids[member]:
+                        reach |= (1 << next_id) | closure[next_id]
+                for member in component:
+                    closure[member] = reach
+    return closure
+
+
+class ReachIndex:
+    """
+    Transitive closure of a flowchart, for the multi-hop questions.
+    The reach bitsets of all the nodes are built once per flowchart from the adjacency lists of a GraphIndex,
+    in O(node_num + edge_num) bitset operations and O(node_num^2) bits, so reachability queries are O(1).
+    Distances and shortest paths are only needed for a few nodes of a flowchart: they come from
+    a breadth-first search from their source, run on first use and cached.
+    A node reaches itself at distance 0, it is not counted among its reachable nodes.
+    """
+    def __init__(self, graph_index: GraphIndex):
+        """
+        :param graph_index: adjacency lists of the flowchart, see Flowchart.build_graph_index()
+        """
+        self.graph_index = graph_index
+        self.node_num = graph_index.node_num
+        # reach_masks[i]: bitset of the nodes reachable from i (bit j for node j), i excluded
+        self.reach_masks: List[int] = [mask & ~(1 << i)
+                                       for i, mask in enumerate(transitive_closure(graph_index.next_ids))]
+        # source id -> (distances, parents) of the nodes, see _search()
+        self._searches: Dict[int, Tuple[List[int], List[int]]] = {}
+
+    def _search(self, source: int) -> Tuple[List[int], List[int]]:
+        """
+        Breadth-first search from source: the number of edges of a shortest path to each node
+        and the node before it on that path, UNREACHABLE if there is none
+        """
+        if source not in self._searches:
+            distance = [UNREACHABLE] * self.node_num
+            parent = [UNREACHABLE] * self.node_num
+            distance[source] = 0
+            queue = deque([source])
+            while queue:
+                cur_id = queue.popleft()
+                # next ids are sorted, so the shortest path found is the first in id order
+                for next_id in self.graph_index.next_ids[cur_id]:
+                    if distance[next_id] == UNREACHABLE:
+                        distance[next_id] = distance[cur_id] + 1
+                        parent[next_id] = cur_id
+                        queue.append(next_id)
+            self._searches[source] = distance, parent
+        return self._searches[source]
+
+    def can_reach(self, from_id: int, to_id: int) -> bool:
+        """Whether there is a path of at least one edge from from_id to to_id (to a different node)"""
+        return bool(self.reach_masks[from_id] >> to_id & 1)
+
+    def distance(self, from_id: int, to_id: int) -> int:
+        """Number of edges of a shortest path from from_id to to_id, UNREACHABLE if there is none"""
+        if from_id != to_id and not self.can_reach(from_id, to_id):
+            return UNREACHABLE
+        return self._search(from_id)[0][to_id]
+
+    def shortest_path(self, from_id: int, to_id: int) -> List[int]:
+        """Node ids of a shortest path from from_id to to_id, both included, empty if there is none"""
+        if from_id != to_id and not self.can_reach(from_id, to_id):
+            return []
+        path = [to_id]
+        parents = self._search(from_id)[1]
+        while path[-1] != from_id:
+            path.append(parents[path[-1]])
+        path.reverse()
+        return path
+
+    def get_reachable_ids(self, cur_id: int) -> List[int]:
+        """Sorted ids of the nodes reachable from cur_id, cur_id excluded"""
+        mask = self.reach_masks[cur_id]
+        return [i for i in range(self.node_num) if mask >> i & 1]
+
+    def get_unreachable_ids(self, cur_id: int) -> List[int]:
+        """Sorted ids of the nodes that cannot be reached from cur_id, cur_id excluded"""
+        mask = self.reach_masks[cur_id] | (1 << cur_id)
+        return [i for i in range(self.node_num) if not mask >> i & 1]
@@ -1,4 +1,6 @@
-from constant import NORMAL_TYPE
+import numpy as np
+
+from constant import NORMAL_TYPE, DECISION_TYPE
 
 class FlowchartStatistics:
     def __init__(self):
@@ -8,6 +10,10 @@ class FlowchartStatistics:
         self.edge_num = {}
         self.edge_density = {}
         self.decision_node_num = {}
+        self.structures = {}  # structural hash -> number of flowcharts
+        self.redrawn_num = 0  # duplicates over FLOWCHART_DEDUP_QUOTA replaced before rendering
+        self.image_num = 0
+        self.image_bytes = 0  # size of the image files, see IMG_FORMAT
 
     def add_flowchart(self, flowchart):
         self.total_num += 1
@@ -26,6 +32,47 @@ class FlowchartStatistics:
         decision_nodes = sum(1 for node in flowchart.nodes if node[1] == 1)
         self.decision_node_num[decision_nodes] = self.decision_node_num.get(decision_nodes, 0) + 1
 
+    def add_archive(self, archive, start: int = 0, stop: int = None):
+        """
+        Add flowcharts [start, stop) of a FlowchartArchive, reading its columns directly.
+        Same result as calling add_flowchart on each of them in order.
+        """
+        from flowchart.archive import ordered_counts
+        stop = len(archive) if stop is None else stop
+        if stop <= start:
+            return
+        chart_types = archive.chart_types()[start:stop]
+        node_nums = archive.node_nums()[start:stop]
+        edge_nums = archive.edge_nums()[start:stop]
+        self.total_num += stop - start
+        decision_num = int((chart_types != NORMAL_TYPE).sum())
+        self.type_count["normal"] += stop - start - decision_num
+        self.type_count["decision"] += decision_num
+        densities = np.where(node_nums > 0, edge_nums / np.maximum(node_nums, 1), 0)
+        for counter, values in ((self.node_num, node_nums), (self.edge_num, edge_nums),
+                                (self.edge_density, densities),
+                                (self.decision_node_num, archive.decision_node_nums(DECISION_TYPE)[start:stop])):
+            for value, count in ordered_counts(values):
+                counter[value] = counter.get(value, 0) + count
+
+    def add_structure(self, structure: str, redrawn_num: int = 0):
+        """
+        Count the structural hash of a flowchart, see Flowchart.structural_hash()
+        :param redrawn_num: number of duplicates drawn and discarded before this flowchart
+        """
+        self.structures[structure] = self.structures.get(structure, 0) + 1
+        self.redrawn_num += redrawn_num
+
+    def add_image(self, size: int):
+        """Count a rendered image of size bytes"""
+        self.image_num += 1
+        self.image_bytes += size
+
+    def duplicate_rate(self) -> float:
+        """Share of the flowcharts whose structure is the same as an earlier flowchart's"""
+        hashed_num = sum(self.structures.values())
+        return (hashed_num - len(self.structures)) / hashed_num if hashed_num > 0 else 0
+
     def summary(self):
         return ("--- Flowchart Statistics ---\n"
                 f"Total Flowcharts: {self.total_num}\n"
@@ -37,7 +84,14 @@ class FlowchartStatistics:
                 f"  Avg Edge Count: {round(sum(k * v for k, v in self.edge_num.items()) / self.total_num, 2)}\n"
                 f"  Avg Edge Density: {round(sum(k * v for k, v in self.edge_density.items()) / self.total_num, 2)}\n"
                 f"Decision Node Count Distribution: {self.decision_node_num}\n"
-                f"  Avg Decision Node Count: {round(sum(k * v for k, v in self.decision_node_num.items()) / self.type_count['decision'] if self.type_count['decision'] > 0 else 0, 2)}"
+                f"  Avg Decision Node Count: {round(sum(k * v for k, v in self.decision_node_num.items()) / self.type_count['decision'] if self.type_count['decision'] > 0 else 0, 2)}\n"
+                f"Distinct Structures: {len(self.structures)}\n"
+                f"  Duplicate Rate: {self.duplicate_rate():.2%}\n"
+                f"  Max Flowcharts per Structure: {max(self.structures.values(), default=0)}\n"
+                f"  Redrawn Duplicates: {self.redrawn_num}"
+                + (f"\nImages: {self.image_num}\n"
+                   f"  Avg Bytes per Image: {round(self.image_bytes / self.image_num, 2)}\n"
+                   f"  Total Image Bytes: {self.image_bytes}" if self.image_num > 0 else "")
         )
     
     def save(self, file):
@@ -0,0 +1,39 @@
+import hashlib
+from typing import List, Tuple
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def structural_hash(type_: int, nodes: List[Tuple[str, int]], edges: List[Tuple[int, int, str]]) -> str:
+    """
+    Canonical hash of the structure of a flowchart: node types and edges with their conditions, names ignored.
+    Weisfeiler-Lehman refinement: each node starts with its type as label, then its label is repeatedly
+    replaced by a digest of its label and of the multisets of (condition, label) of its outgoing and
+    incoming edges, until the partition of the nodes stops being refined. The hash is a digest of the
+    multiset of the final labels, so isomorphic flowcharts always get the same hash and
+    non-isomorphic ones almost always different hashes (WL cannot tell some regular graphs apart).
+    :param type_: type of the flowchart
+    :param nodes: list of tuples (name, type), see Flowchart
+    :param edges: list of tuples (first_id, second_id, condition), see Flowchart
+    """
+    node_num = len(nodes)
+    out_edges: List[List[Tuple[str, int]]] = [[] for _ in range(node_num)]
+    in_edges: List[List[Tuple[str, int]]] = [[] for _ in range(node_num)]
+    for first_id, second_id, condition in edges:
+        out_edges[first_id].append((condition, second_id))
+        in_edges[second_id].append((condition, first_id))
+    labels = [str(node_type) for _, node_type in nodes]
+    class_num = len(set(labels))
+    # the partition is refined at most node_num - 1 times
+    for _ in range(node_num):
+        labels = [_digest("|".join([labels[i],
+                                    ",".join(sorted(f"{condition}>{labels[j]}" for condition, j in out_edges[i])),
+                                    ",".join(sorted(f"{condition}<{labels[j]}" for condition, j in in_edges[i]))]))
+                  for i in range(node_num)]
+        new_class_num = len(set(labels))
+        if new_class_num == class_num:
+            break
+        class_num = new_class_num
+    return hashlib.sha1(f"{type_}|{node_num}|{len(edges)}|{','.join(sorted(labels))}".encode("utf-8")).hexdigest()
@@ -1,78 +1,208 @@
 import os
-import json
+import random
+import sys
+from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Pool
+from typing import Iterable, Iterator, List, Tuple
 
+import numpy as np
+
+from flowchart.flowchart import Flowchart
 from sample.builder import SampleBuilder
+from sample.sample import Sample
 from sample.collector import SampleCollector
+from sample.writer import JsonLinesWriter, open_sample_writer, iter_samples
+from sample.index import SampleIndexWriter, get_index_path
 from sample.statistics import SampleStatistics
-from constant import FLOWCHART_NUM, CONVS_DIR, QA_DIR, CONV_FILE_NAME, CONV_QA_FILE_NAME, \
-    QUESTIONS_FILE_NAME, GROUND_TRUTH_FILE_NAME, STATS_DIR, CONV_STATS_FILE_NAME
+from gen.manifest import get_manifest, SAMPLES_STAGE
+from gen.metrics import get_metrics, SAMPLES_COUNTER
+from constant import FLOWCHART_NUM, CONVS_DIR, CONV_FILE_NAME, CONV_QA_FILE_NAME, IMG_DIR, IMG_REF_DIR, \
+    QUESTIONS_FILE_NAME, GROUND_TRUTH_FILE_NAME, CONV_STATS_FILE_NAME, RESUME, SEED, SAMPLE_WORKERS, \
+    USE_COT, USE_OCR, VARIANTS, CONV_INDEX_ON
+
+
+class Variant:
+    """
+    One conversation dataset built from the flowcharts of the run: its USE_COT/USE_OCR flags,
+    its output directory (conversations, qa/ and stats/) and its statistics.
+    """
+    def __init__(self, use_cot: bool, use_ocr: bool, output_dir: str):
+        self.use_cot = use_cot
+        self.use_ocr = use_ocr
+        self.output_dir = output_dir
+        self.qa_dir = os.path.join(output_dir, "qa")
+        self.stats_dir = os.path.join(output_dir, "stats")
+        self.statistics = SampleStatistics()
+
+    @property
+    def flags(self) -> Tuple[bool, bool]:
+        return self.use_cot, self.use_ocr
+
 
-conv_statistics = SampleStatistics()
+def get_variant_name(use_cot: bool, use_ocr: bool) -> str:
+    """Directory name of a variant, e.g. cot & wo-ocr"""
+    return f"{'cot' if use_cot else 'wo-cot'} & {'ocr' if use_ocr else 'wo-ocr'}"
+
+def get_variants() -> List[Variant]:
+    """
+    Variants of the run: one per (use_cot, use_ocr) of VARIANTS, each in its own subdirectory,
+    or the single dataset of USE_COT/USE_OCR written in the run directory if VARIANTS is empty.
+    """
+    if not VARIANTS:
+        return [Variant(USE_COT, USE_OCR, CONVS_DIR)]
+    return [Variant(use_cot, use_ocr, os.path.join(CONVS_DIR, get_variant_name(use_cot, use_ocr)))
+            for use_cot, use_ocr in dict.fromkeys(VARIANTS)]
+
+def link_images(variant: Variant):
+    """
+    Refer to the images of the run from the directory of a variant, as IMG_REF_DIR, so the image paths
+    of its conversations are valid there. A relative symbolic link is used, hard links to each image
+    where symbolic links are not allowed (e.g. on Windows without developer mode), nothing is copied.
+    """
+    link_path = os.path.join(variant.output_dir, IMG_REF_DIR)
+    if os.path.lexists(link_path) or os.path.abspath(link_path) == os.path.abspath(IMG_DIR):
+        return
+    try:
+        os.symlink(os.path.relpath(IMG_DIR, variant.output_dir), link_path, target_is_directory=True)
+    except OSError:
+        os.makedirs(link_path)
+        for name in (os.listdir(IMG_DIR) if os.path.exists(IMG_DIR) else []):
+            os.link(os.path.join(IMG_DIR, name), os.path.join(link_path, name))
 
-def gen_samples():
+def build_flowchart_samples(flowchart_id: int, flags: List[Tuple[bool, bool]],
+                            flowchart: Flowchart = None) -> List[SampleCollector]:
+    """
+    Build the samples of one flowchart from its own random stream, derived from the run seed,
+    so they do not depend on the other flowcharts. Samples are numbered from 0, see SampleCollector.rebase.
+    :param flags: (use_cot, use_ocr) of each variant, all the variants draw the same stream
+    :param flowchart: the flowchart if already in memory, loaded from its storage if not given
+    """
+    return [SampleBuilder(flowchart_id, 0, random.Random((SEED << 32) + flowchart_id), use_cot, use_ocr, flowchart)
+            .build_samples_for_flowchart() for use_cot, use_ocr in flags]
+
+def build_serial_samples(flowchart_id: int, base_id: int, flags: List[Tuple[bool, bool]]) -> List[SampleCollector]:
+    """
+    Build the samples of one flowchart for each variant from the global random states.
+    The states are restored before each variant after the first, so all the variants draw the same samples.
+    """
+    collectors = []
+    states = (random.getstate(), np.random.get_state()) if len(flags) > 1 else None
+    for k, (use_cot, use_ocr) in enumerate(flags):
+        if k > 0:
+            random.setstate(states[0])
+            np.random.set_state(states[1])
+        collectors.append(SampleBuilder(flowchart_id, base_id, None, use_cot, use_ocr).build_samples_for_flowchart())
+    return collectors
+
+def iter_sample_collectors(chart_num: int, workers: int = SAMPLE_WORKERS,
+                           flags: List[Tuple[bool, bool]] = None) -> Iterator[List[SampleCollector]]:
+    """
+    Build the samples of every flowchart, yielded in flowchart order, one collector per variant.
+    :param workers: number of processes, 0 for the serial mode on the global random state
+    :param flags: (use_cot, use_ocr) of each variant, (USE_COT, USE_OCR) if not given
+    """
+    flags = flags if flags is not None else [(USE_COT, USE_OCR)]
+    if workers == 0:
+        sample_num = 0
+        for i in range(chart_num):
+            sample_collectors = build_serial_samples(i, sample_num, flags)
+            sample_num += len(sample_collectors[0])
+            yield sample_collectors
+    elif workers == 1:
+        yield from map(partial(build_flowchart_samples, flags=flags), range(chart_num))
+    else:
+        with Pool(workers) as pool:
+            # imap keeps the flowchart order whatever the worker finishing order
+            yield from pool.imap(partial(build_flowchart_samples, flags=flags), range(chart_num), chunksize=16)
+
+def gen_samples(chart_num: int = FLOWCHART_NUM, variants: List[Variant] = None,
+                sample_collectors: Iterable[List[SampleCollector]] = None) -> List[Variant]:
     """
     Generate samples from flowchart original data.
+    The train conversations, q&a conversations, questions and ground truths of every variant
+    are written in one pass, each flowchart is loaded once for all of them.
+    :param chart_num: number of flowcharts to build samples for
+    :param variants: datasets to write, see get_variants()
+    :param sample_collectors: collectors of each flowchart in flowchart order, one per variant,
+                              built by iter_sample_collectors() if not given (see gen/pipeline.py)
+    :return: the variants, with their statistics
+    """
+    variants = variants if variants is not None else get_variants()
+    for variant in variants:
+        for directory in (variant.qa_dir, variant.stats_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        link_images(variant)
+    # samples are written as soon as their flowchart is done, only one flowchart's samples are kept in memory
+    sample_num = 0
+    with ExitStack() as stack:
+        writers = [(stack.enter_context(open_sample_writer(os.path.join(variant.output_dir, CONV_FILE_NAME))),
+                    stack.enter_context(open_sample_writer(os.path.join(variant.qa_dir, CONV_QA_FILE_NAME))),
+                    stack.enter_context(JsonLinesWriter(os.path.join(variant.qa_dir, QUESTIONS_FILE_NAME))),
+                    stack.enter_context(JsonLinesWriter(os.path.join(variant.qa_dir, GROUND_TRUTH_FILE_NAME))))
+                   for variant in variants]
+        # offset index of the two conversation files of each variant
+        indexes = [tuple(stack.enter_context(SampleIndexWriter(get_index_path(writer.path)))
+                         for writer in variant_writers[:2]) if CONV_INDEX_ON else (None, None)
+                   for variant_writers in writers]
+        if sample_collectors is None:
+            sample_collectors = iter_sample_collectors(chart_num, flags=[variant.flags for variant in variants])
+        with get_metrics().stage(SAMPLES_STAGE, total=chart_num) as stage:
+            for flowchart_collectors in sample_collectors:
+                for variant, (conv_writer, qa_writer, questions_writer, ground_truths_writer), \
+                        (conv_index, qa_index), sample_collector in zip(variants, writers, indexes, flowchart_collectors):
+                    # sample ids are assigned here, in flowchart order, so they do not depend on the workers
+                    sample_collector.rebase(sample_num)
+                    for sample in sample_collector.iter_samples():
+                        variant.statistics.add_sample(sample)
+                        # the texts are rendered here, once for both formats
+                        conversations = sample.conversations
+                        conv_location = conv_writer.write(sample.to_dict(qa_mode=False, conversations=conversations))
+                        qa = sample.to_dict(qa_mode=True, conversations=conversations)
+                        qa_location = qa_writer.write(qa)
+                        if conv_index is not None:
+                            conv_index.add(*conv_location, sample.flowchart_id, sample.question_type)
+                            qa_index.add(*qa_location, sample.flowchart_id, sample.question_type)
+                        for question in Sample.qa_to_questions(qa):
+                            questions_writer.write(question)
+                        ground_truths_writer.write(Sample.qa_to_ground_truth(qa))
+                    stage.count(SAMPLES_COUNTER, len(sample_collector))
+                sample_num += len(flowchart_collectors[0])
+                stage.tick()
+    # the files are only complete once closed
+    stage.add_bytes(sum(os.path.getsize(writer.path) for variant_writers in writers + indexes
+                        for writer in variant_writers if writer is not None))
+    return variants
+
+def gen_qas(variants: List[Variant] = None):
+    """
+    Rebuild the question-answer files of each variant from its existing conversations_qa file.
+    The file is streamed, so it is never loaded whole.
     """
-    if not os.path.exists(QA_DIR):
-        os.makedirs(QA_DIR)
-    if not os.path.exists(STATS_DIR):
-        os.makedirs(STATS_DIR)
-    sample_collector = SampleCollector()
-    for i in range(FLOWCHART_NUM):
-        sample_builder = SampleBuilder(i, sample_collector.get_id())
-        new_sample_collector = sample_builder.build_samples_for_flowchart()
-        for sample in new_sample_collector.get_samples():
-            conv_statistics.add_sample(sample)
-        sample_collector.extend(new_sample_collector.get_samples())
-
-    with open(os.path.join(CONVS_DIR, CONV_FILE_NAME), "w") as f:
-        json.dump([sample.to_dict(qa_mode=False) for sample in sample_collector.get_samples()], f, indent=2)
-    with open(os.path.join(QA_DIR, CONV_QA_FILE_NAME), "w") as f:
-        json.dump([sample.to_dict(qa_mode=True) for sample in sample_collector.get_samples()], f, indent=2)
-
-def gen_qas():
-    """
-    Generate question-answer pairs from file.
-    """
-    with open(os.path.join(QA_DIR, CONV_QA_FILE_NAME), "r") as f:
-        samples = json.load(f)
-    questions = []
-    ground_truths = []
-    for sample in samples:
-        question_id = sample["id"]
-        image = sample["image"]
-        conversations = sample["conversations"]
-        question_type = sample["type"]
-        ground_truth = sample["ground_truth"]
-        for i, message in enumerate(conversations):
-            if message["from"] == "human":
-                question_id = question_id
-                # remove "<image>\n" from the question
-                question_text = message["value"].replace("<image>\n", "")
-                question_type = question_type
-                questions.append({
-                    "question_id": question_id,
-                    "image": image,
-                    "text": question_text,
-                    "type": question_type
-                })
-        ground_truths.append({
-            "question_id": question_id,
-            "ground_truth": ground_truth
-        })
-
-    with open(os.path.join(QA_DIR, QUESTIONS_FILE_NAME), "w") as f:
-        for q in questions:
-            f.write(json.dumps(q) + "\n")
-
-    with open(os.path.join(QA_DIR, GROUND_TRUTH_FILE_NAME), "w") as f:
-        for gt in ground_truths:
-            f.write(json.dumps(gt) + "\n")
+    for variant in (variants if variants is not None else get_variants()):
+        with JsonLinesWriter(os.path.join(variant.qa_dir, QUESTIONS_FILE_NAME)) as questions_writer, \
+                JsonLinesWriter(os.path.join(variant.qa_dir, GROUND_TRUTH_FILE_NAME)) as ground_truths_writer:
+            for qa in iter_samples(os.path.join(variant.qa_dir, CONV_QA_FILE_NAME)):
+                for question in Sample.qa_to_questions(qa):
+                    questions_writer.write(question)
+                ground_truths_writer.write(Sample.qa_to_ground_truth(qa))
 
 def gen_samples_and_qas():
-    gen_samples()
-    gen_qas()
-    conv_statistics.save(os.path.join(STATS_DIR, CONV_STATS_FILE_NAME))
+    manifest = get_manifest()
+    manifest.check_stage(SAMPLES_STAGE, FLOWCHART_NUM)
+    if RESUME and manifest.stage_done(SAMPLES_STAGE):
+        print("---Conversations already generated, skipped---")
+        return
+    manifest.start_stage(SAMPLES_STAGE)
+    for variant in gen_samples():
+        variant.statistics.save(os.path.join(variant.stats_dir, CONV_STATS_FILE_NAME))
+    manifest.mark_stage(SAMPLES_STAGE, chart_num=FLOWCHART_NUM)
 
 if __name__ == "__main__":
-    gen_samples_and_qas()
+    # python -m gen.gen_conversations --qa-only: only rebuild questions.jsonl and ground_truths.jsonl
+    if "--qa-only" in sys.argv[1:]:
+        gen_qas()
+    else:
+        gen_samples_and_qas()
+        get_metrics().save()
@@ -1,15 +1,56 @@
 import os
-import subprocess
+import shutil
 import time
 import logging
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
 
 from constant import *
+from flowchart.archive import FlowchartArchive, FlowchartArchiveWriter
 from flowchart.builder import FlowchartBuilder
+from flowchart.batch_builder import SeededFlowchartBatches
+from flowchart.flowchart import Flowchart
 from flowchart.statistics import FlowchartStatistics
+from gen.manifest import get_manifest, MMD_ARTIFACT, PKL_ARTIFACT, PNG_ARTIFACT, OCR_ARTIFACT, \
+    STAGES, FLOWCHARTS_STAGE, IMGS_STAGE, SAMPLES_STAGE, DONE_STATUS, FAILED_STATUS
+from gen.metrics import get_metrics, FAILURES_COUNTER, TIMEOUTS_COUNTER, RETRIES_COUNTER, SKIPPED_COUNTER, \
+    REDRAWN_COUNTER
+from render.backends import get_render_pool, PIL_BACKEND
+from render.pool import RenderResult, RENDER_OK, RENDER_TIMEOUT_EXPIRED
+from utils import load_pickle, get_img_path
 
 flowchart_statistics = FlowchartStatistics()
 
-def gen_flowcharts_and_mmds(chart_num: int):
+def draw_flowchart(flowchart_id: int, batches: Optional[SeededFlowchartBatches],
+                   structure_counts: Dict[str, int]) -> Tuple[Flowchart, Optional[str], str, int]:
+    """
+    Build a flowchart, redrawn while FLOWCHART_DEDUP_QUOTA flowcharts already have its structure
+    (at most FLOWCHART_DEDUP_MAX_REDRAWS times), so duplicates are dropped before they are rendered.
+    :param batches: flowcharts of the batch generator, None for the scalar generator
+    :param structure_counts: structural hash -> number of flowcharts kept so far
+    :return: (flowchart, direction of its Mermaid script or None, structural hash, number of redraws)
+    """
+    attempt = 0
+    while True:
+        if batches is not None:
+            flowchart, direction = batches.get(flowchart_id) if attempt == 0 else batches.redraw(flowchart_id, attempt)
+        else:
+            flowchart, direction = FlowchartBuilder().build(), None
+        structure = flowchart.structural_hash()
+        if FLOWCHART_DEDUP_QUOTA <= 0 or structure_counts.get(structure, 0) < FLOWCHART_DEDUP_QUOTA \
+                or attempt >= FLOWCHART_DEDUP_MAX_REDRAWS:
+            return flowchart, direction, structure, attempt
+        attempt += 1
+
+def count_structure(structure_counts: Dict[str, int], structure: str, redrawn_num: int = 0):
+    structure_counts[structure] = structure_counts.get(structure, 0) + 1
+    flowchart_statistics.add_structure(structure, redrawn_num)
+
+def iter_flowcharts(chart_num: int) -> Iterator[Tuple[int, Flowchart]]:
+    """
+    Generate the flowcharts with their Mermaid scripts and pickles (or archive), yielded in order as soon
+    as they are stored, the flowcharts generated by a previous run are loaded instead.
+    The stage is only marked as completed once all of them have been yielded.
+    """
     # first check if the directories exist, if not, create them
     if not os.path.exists(MMD_DIR):
         os.makedirs(MMD_DIR)
@@ -19,41 +60,195 @@ def gen_flowcharts_and_mmds(chart_num: int):
         os.makedirs(PKL_DIR)
     if not os.path.exists(STATS_DIR):
         os.makedirs(STATS_DIR)
-    for i in range(chart_num):
-        flowchart = FlowchartBuilder().build()
-        flowchart_statistics.add_flowchart(flowchart)
-        flowchart.save_mmd(os.path.join(MMD_DIR, f"{i}.mmd"))
-        flowchart.save_pickle(os.path.join(PKL_DIR, f"{i}.pkl"))
+    manifest = get_manifest()
+    archive_writer = FlowchartArchiveWriter(ARCHIVE_DIR) if FLOWCHART_STORAGE == ARCHIVE_STORAGE else None
+    # the archive is append-only: the flowcharts already in it are kept, the next ones are generated in order
+    archived_num = min(len(archive_writer), chart_num) if archive_writer is not None else 0
+    if archived_num > 0:
+        archive = FlowchartArchive(ARCHIVE_DIR)
+        flowchart_statistics.add_archive(archive, 0, archived_num)
+    manifest.start_stage(FLOWCHARTS_STAGE)
+    batches = SeededFlowchartBatches() if FLOWCHART_GENERATOR == BATCH_GENERATOR else None
+    structure_counts: Dict[str, int] = {}  # counted over the flowcharts kept, previous runs included
+    with get_metrics().stage(FLOWCHARTS_STAGE, total=chart_num) as stage:
+        generated_num = 0
+        for i in range(chart_num):
+            stored = i < archived_num or \
+                (archive_writer is None and manifest.is_done(i, MMD_ARTIFACT) and manifest.is_done(i, PKL_ARTIFACT))
+            # a flowchart generated by a previous run is drawn again when the draws matter: the scalar generator
+            # draws from the global random state, so the stored flowchart is drawn again with its Mermaid script
+            # and the next flowcharts and the samples are those of a run made in one go; with deduplication,
+            # its redraws are counted as in a run made in one go
+            replay = stored and (batches is None or FLOWCHART_DEDUP_QUOTA > 0)
+            if replay:
+                drawn, direction, structure, redrawn_num = draw_flowchart(i, batches, structure_counts)
+                if batches is None:
+                    drawn.to_mmd(direction)
+                count_structure(structure_counts, structure, redrawn_num)
+            if i < archived_num:
+                flowchart = archive.get(i)
+                if not manifest.is_done(i, MMD_ARTIFACT):
+                    manifest.record(i, MMD_ARTIFACT, DONE_STATUS, flowchart.save_mmd(os.path.join(MMD_DIR, f"{i}.mmd")))
+                if not replay:
+                    count_structure(structure_counts, flowchart.structural_hash())
+                stage.count(SKIPPED_COUNTER)
+                yield i, flowchart
+                continue
+            if stored:
+                # only needed for the statistics and the structure counts
+                flowchart = load_pickle(i)
+                flowchart_statistics.add_flowchart(flowchart)
+                if not replay:
+                    count_structure(structure_counts, flowchart.structural_hash())
+                stage.count(SKIPPED_COUNTER)
+                yield i, flowchart
+                continue
+            flowchart, direction, structure, redrawn_num = draw_flowchart(i, batches, structure_counts)
+            count_structure(structure_counts, structure, redrawn_num)
+            stage.count(REDRAWN_COUNTER, redrawn_num)
+            flowchart_statistics.add_flowchart(flowchart)
+            manifest.invalidate(i, [PNG_ARTIFACT, OCR_ARTIFACT])
+            mmd = flowchart.save_mmd(os.path.join(MMD_DIR, f"{i}.mmd"), direction)
+            manifest.record(i, MMD_ARTIFACT, DONE_STATUS, mmd)
+            if archive_writer is not None:
+                data = archive_writer.append(flowchart)
+            else:
+                data = flowchart.save_pickle(os.path.join(PKL_DIR, f"{i}.pkl"))
+            manifest.record(i, PKL_ARTIFACT, DONE_STATUS, data)
+            stage.tick(len(mmd.encode("utf-8")) + len(data))
+            generated_num += 1
+            yield i, flowchart
+    if archive_writer is not None:
+        archive_writer.close()
+    if generated_num > 0:
+        manifest.mark_stage(IMGS_STAGE, done=False)
+    manifest.mark_stage(FLOWCHARTS_STAGE, chart_num=chart_num)
 
-def gen_imgs(chart_num: int):
+def gen_flowcharts_and_mmds(chart_num: int):
+    for _ in iter_flowcharts(chart_num):
+        pass
+
+def render_imgs(flowchart_ids: Iterable[int], total: int = 0,
+                on_image: Callable[[int, Optional[bytes]], None] = None,
+                get_flowchart: Callable[[int], Flowchart] = None) -> bool:
+    """
+    Render the images of the flowcharts, whose Mermaid scripts are written.
+    :param flowchart_ids: ids of the flowcharts to render, may be produced while the images are rendered
+    :param total: number of flowchart ids if known, for the progress reports
+    :param on_image: called with each flowchart id and its PNG bytes (None if it failed) once rendered,
+                     in the order the renders complete
+    :param get_flowchart: gives the flowchart of an id from memory, passed to the pil renderers so they need
+                          not load it from the run storage, which may not have it yet (archive storage)
+    :return: whether all the images were rendered
+    """
     st_clk = time.time()
-    cnt = 1
     # Configure logging
     logging.basicConfig(filename=f'log/flowchart-generation-{GEN_IDENTIFIER}.log', level=logging.INFO, 
                         format='%(asctime)s - %(levelname)s - %(message)s')
 
-    for filename in os.listdir(MMD_DIR):
-        if filename.endswith(".mmd"):
-            input_path = os.path.join(MMD_DIR, filename)
-            output_path = os.path.join(IMG_DIR, filename.replace(".mmd", ".png"))
-            try:
-                # Call mmdc to generate the image
-                subprocess.run(["mmdc", "-i", input_path, "-o", output_path, "-s", "4", "-q"], timeout=10)
-                if filename.replace(".mmd", ".png") in os.listdir(IMG_DIR):
-                    logging.info(f"{cnt} images generated in {time.time() - st_clk:.2f} seconds")
-                    print(f"{cnt} images generated in {time.time() - st_clk:.2f} seconds")
-                    cnt += 1
-                else:
-                    logging.error(f"Failed to generate image for {filename}")
-                    print(f"Failed to generate image for {filename}")
-            except subprocess.TimeoutExpired:
-                logging.error(f"Timeout expired for {filename}")
-                print(f"Timeout expired for {filename}")
-    logging.info(f"---Generated {cnt - 1} images successfully, {chart_num - cnt + 1} images failed---")
-    print(f"---Generated {cnt - 1} images successfully, {chart_num - cnt + 1} images failed---")
+    manifest = get_manifest()
+    manifest.start_stage(IMGS_STAGE)
+    counter = {"success": 0, "failure": 0}
+
+    def on_result(result: RenderResult):
+        flowchart_id = int(result.name[:-len(".mmd")])
+        data = None
+        if result.status == RENDER_OK:
+            with open(result.output_path, "rb") as f:
+                data = f.read()
+            manifest.record(flowchart_id, PNG_ARTIFACT, DONE_STATUS, data)
+            flowchart_statistics.add_image(len(data))
+            stage.record(result.elapsed, len(data))
+        else:
+            manifest.record(flowchart_id, PNG_ARTIFACT, FAILED_STATUS)
+            stage.record(result.elapsed)
+            stage.count(TIMEOUTS_COUNTER if result.status == RENDER_TIMEOUT_EXPIRED else FAILURES_COUNTER)
+        stage.count(RETRIES_COUNTER, result.attempts - 1)
+        if result.status == RENDER_OK:
+            counter["success"] += 1
+            logging.info(f"{counter['success']} images generated in {time.time() - st_clk:.2f} seconds")
+            print(f"{counter['success']} images generated in {time.time() - st_clk:.2f} seconds")
+        elif result.status == RENDER_TIMEOUT_EXPIRED:
+            counter["failure"] += 1
+            logging.error(f"Timeout expired for {result.name}")
+            print(f"Timeout expired for {result.name}")
+        else:
+            counter["failure"] += 1
+            logging.error(f"Failed to generate image for {result.name}")
+            print(f"Failed to generate image for {result.name}")
+        if on_image is not None:
+            on_image(flowchart_id, data)
+
+    def iter_jobs():
+        for i in flowchart_ids:
+            job = (f"{i}.mmd", os.path.join(MMD_DIR, f"{i}.mmd"), get_img_path(i))
+            if get_flowchart is not None and RENDER_BACKEND == PIL_BACKEND:
+                job += (get_flowchart(i),)
+            yield job
+
+    with get_metrics().stage(IMGS_STAGE, total=total) as stage:
+        get_render_pool(RENDER_BACKEND).run(iter_jobs(), on_result)
+    manifest.flush()
+    cnt = counter["success"]
+    job_num = cnt + counter["failure"]
+    elapsed = time.time() - st_clk
+    logging.info(f"---Generated {cnt} images successfully, {job_num - cnt} images failed---")
+    print(f"---Generated {cnt} images successfully, {job_num - cnt} images failed---")
+    logging.info(f"---{RENDER_BACKEND} backend: {cnt / elapsed if elapsed > 0 else 0:.2f} images/sec---")
+    print(f"---{RENDER_BACKEND} backend: {cnt / elapsed if elapsed > 0 else 0:.2f} images/sec---")
+    return cnt == job_num
+
+def count_images(flowchart_ids: Iterable[int]):
+    """Add the images rendered by a previous run to the statistics"""
+    for i in flowchart_ids:
+        if os.path.exists(get_img_path(i)):
+            flowchart_statistics.add_image(os.path.getsize(get_img_path(i)))
+
+def gen_imgs(chart_num: int):
+    manifest = get_manifest()
+    pending_ids = manifest.pending(range(chart_num), PNG_ARTIFACT)
+    skipped_num = chart_num - len(pending_ids)
+    if skipped_num > 0:
+        logging.info(f"---Skipped {skipped_num} images already generated---")
+        print(f"---Skipped {skipped_num} images already generated---")
+        count_images(set(range(chart_num)).difference(pending_ids))
+    if render_imgs(pending_ids, len(pending_ids)):
+        manifest.mark_stage(IMGS_STAGE, chart_num=chart_num)
+
 
+def reset_run(chart_num: int = FLOWCHART_NUM):
+    """
+    Discard the manifest and the archive of a previous run, when the run is not resumed or its flowcharts
+    were generated with other settings. Otherwise, the stages run with other settings or another number
+    of flowcharts are run again (see Manifest.check_stage), and so are the files changed or removed since
+    they were recorded.
+    """
+    manifest = get_manifest()
+    changed = manifest.changed_settings(FLOWCHARTS_STAGE)
+    if not RESUME or changed:
+        if RESUME:
+            print(f"---Settings of the flowcharts changed ({', '.join(changed)}), the run starts from scratch---")
+        manifest.reset()
+        if os.path.exists(ARCHIVE_DIR):
+            shutil.rmtree(ARCHIVE_DIR)
+    for stage in STAGES:
+        manifest.check_stage(stage, chart_num)
+    manifest.verify(MMD_ARTIFACT, lambda i: os.path.join(MMD_DIR, f"{i}.mmd"))
+    if FLOWCHART_STORAGE == PKL_STORAGE:
+        # the flowcharts past the committed part of an archive are generated again, see iter_flowcharts
+        manifest.verify(PKL_ARTIFACT, lambda i: os.path.join(PKL_DIR, f"{i}.pkl"))
+    manifest.verify(PNG_ARTIFACT, get_img_path)
+    manifest.flush()
 
 def generate_flowcharts():
+    manifest = get_manifest()
+    reset_run()
+    # the serial samples draw from the global random state as the flowchart generation leaves it
+    replay = FLOWCHART_GENERATOR == SCALAR_GENERATOR and SAMPLE_WORKERS == 0 and not manifest.stage_done(SAMPLES_STAGE)
+    if RESUME and manifest.stage_done(FLOWCHARTS_STAGE) and (manifest.stage_done(IMGS_STAGE) or not GEN_IMGS_ON) \
+            and not replay:
+        print("---Flowcharts already generated, skipped---")
+        return
     gen_flowcharts_and_mmds(FLOWCHART_NUM)
     if GEN_IMGS_ON:
         gen_imgs(FLOWCHART_NUM)
@@ -62,3 +257,4 @@ def generate_flowcharts():
 
 if __name__ == "__main__":
     generate_flowcharts()
+    get_metrics().save()
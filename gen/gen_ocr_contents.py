@@ -1,35 +1,214 @@
-import easyocr
+import io
+import os
+import multiprocessing
 import pickle
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple, Union
 
-from constant import FLOWCHART_NUM, OCR_DIR, IMG_DIR, ALLOWED_CHARACTERS, MIN_CONFIDENCE
+import numpy as np
+from PIL import Image
 
-reader = easyocr.Reader(['en'], gpu=True)
+from constant import FLOWCHART_NUM, OCR_DIR, ALLOWED_CHARACTERS, MIN_CONFIDENCE, RESUME, \
+    OCR_GPU, OCR_WORKERS, OCR_BATCH_SIZE, OCR_PREFETCH_BATCHES, OCR_MODE, SIMULATED_OCR
+from gen.manifest import get_manifest, content_hash, Manifest, OCR_ARTIFACT, OCR_STAGE, SAMPLES_STAGE, DONE_STATUS
+from gen.metrics import get_metrics, SKIPPED_COUNTER
+from gen.ocr_store import OcrStore, RawResult, get_ocr_store_path, to_raw_result
+from gen.ocr_simulator import OcrErrorModel, get_flowchart_ocr_rng
+from utils import get_img_path
+
+_reader = None  # EasyOCR reader of this process
+
+
+def get_reader():
+    """EasyOCR reader of this process, the model is only loaded when OCR actually runs"""
+    global _reader
+    if _reader is None:
+        import easyocr
+        _reader = easyocr.Reader(['en'], gpu=OCR_GPU)
+    return _reader
+
+def filter_texts(result, min_confidence: float = MIN_CONFIDENCE) -> List[str]:
+    """Keep the confident texts of an EasyOCR result, except the Y/N labels of the edges"""
+    return [text for _, text, conf in result if conf >= min_confidence and text != 'y' and text != 'n']
 
 def extract_text_from_image(image):
     """
     Returns a list of node names extracted from the image using EasyOCR.
     """
-    result = reader.readtext(image, allowlist=ALLOWED_CHARACTERS)
-    extracted_texts = [text for _, text, conf in result if conf >= MIN_CONFIDENCE\
-                       and text != 'y' and text != 'n']
-    return extracted_texts
+    return filter_texts(get_reader().readtext(image, allowlist=ALLOWED_CHARACTERS))
+
+def load_batch(image_paths: List[Union[str, bytes]]) -> List[np.ndarray]:
+    """
+    Decode a batch of images and pad them (white, right and bottom) to the same size,
+    so they can be detected together without being rescaled.
+    :param image_paths: paths of the images, or their encoded bytes already in memory
+    """
+    images = []
+    for image_path in image_paths:
+        with Image.open(io.BytesIO(image_path) if isinstance(image_path, bytes) else image_path) as image:
+            images.append(np.asarray(image.convert("RGB")))
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+    padded = []
+    for image in images:
+        canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+        canvas[:image.shape[0], :image.shape[1]] = image
+        padded.append(canvas)
+    return padded
+
+def read_batch(images: List[np.ndarray]) -> List[RawResult]:
+    """Raw OCR results of a batch of images of the same size, in one readtext_batched call"""
+    results = get_reader().readtext_batched(images, allowlist=ALLOWED_CHARACTERS)
+    return [to_raw_result(result) for result in results]
+
+def read_shard(image_paths: List[str], batch_size: int = OCR_BATCH_SIZE) -> List[RawResult]:
+    """
+    Raw OCR results of a list of images, batch by batch.
+    The next batch is decoded in a background thread while the current one is recognized.
+    """
+    batches = [image_paths[k:k + batch_size] for k in range(0, len(image_paths), batch_size)]
+    results = []
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_batch = prefetcher.submit(load_batch, batches[0])
+        for k in range(len(batches)):
+            images = next_batch.result()
+            if k + 1 < len(batches):
+                next_batch = prefetcher.submit(load_batch, batches[k + 1])
+            results.extend(read_batch(images))
+    return results
+
+def read_image_batch(images: List[Union[str, bytes]]) -> List[RawResult]:
+    """Raw OCR results of one batch of images, given by path or as encoded bytes"""
+    return read_batch(load_batch(images))
+
+def _init_ocr_worker(threads: int):
+    """Load the model once per worker process, and share the CPU cores between the workers"""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    get_reader()
+
+def iter_ocr_results(image_paths: List[str], workers: int = OCR_WORKERS,
+                     batch_size: int = OCR_BATCH_SIZE) -> Iterator[RawResult]:
+    """
+    Raw OCR results of each image, yielded in order.
+    :param workers: number of worker processes, each with its own model, 0 for os.cpu_count()
+    :param batch_size: number of images detected and recognized together
+    """
+    if not image_paths:
+        return
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    # each worker gets a few whole batches at a time, so its prefetch thread has something to decode;
+    # batches never depend on the number of workers, nor does their padding
+    batch_num = -(-len(image_paths) // batch_size)
+    shard_size = batch_size * max(1, min(OCR_PREFETCH_BATCHES, batch_num // workers))
+    shards = [image_paths[k:k + shard_size] for k in range(0, len(image_paths), shard_size)]
+    if workers == 1:
+        for shard in shards:
+            yield from read_shard(shard, batch_size)
+        return
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with multiprocessing.Pool(workers, initializer=_init_ocr_worker, initargs=(threads,)) as pool:
+        for results in pool.imap(read_shard, shards):
+            yield from results
+
+def iter_simulated_ocr_results(flowchart_ids: List[int]) -> Iterator[RawResult]:
+    """Simulated raw OCR results of the flowcharts, from the calibrated error model and their node names"""
+    from utils import load_flowchart
+    model = OcrErrorModel.load()
+    for i in flowchart_ids:
+        yield model.simulate(load_flowchart(i), get_flowchart_ocr_rng(i))
 
 def generate_node_list_content(node_list):
     description = f"[OCR] Node List: {', '.join(node_list)}."
     return description
 
-def generate_ocr_contents():
-    # Generate OCR results for each flowchart image
-    # and save them in a list   
-    ocr_results = []
-    for i in range(FLOWCHART_NUM):
-        image_path = f"{IMG_DIR}/{i}.png"
-        node_list = extract_text_from_image(image_path)
-        print(f"Extracted node list from {image_path}: {node_list}")
-        ocr_results.append(generate_node_list_content(node_list))
-    # Save the OCR results to a binary file
-    with open(f"{OCR_DIR}/ocr_results.pkl", "wb") as f:
-        pickle.dump(ocr_results, f)
+def import_previous_ocr_results(store: OcrStore):
+    """
+    Import the ocr_results.pkl of a run made before the OCR store, only the results recorded
+    in the manifest are reused later. They have no raw result, so they cannot be refiltered.
+    """
+    ocr_path = f"{OCR_DIR}/ocr_results.pkl"
+    if len(store) > 0 or not os.path.exists(ocr_path):
+        return
+    with open(ocr_path, "rb") as f:
+        store.put_many((i, None, content) for i, content in enumerate(pickle.load(f)))
+
+def save_ocr_batch(store: OcrStore, manifest: Manifest, rows: List[Tuple[int, RawResult, str]]):
+    """Commit a batch of (flowchart id, raw result, content), recorded in the manifest only once committed"""
+    if not rows:
+        return
+    store.put_many(rows)
+    for i, _, content in rows:
+        manifest.record(i, OCR_ARTIFACT, DONE_STATUS, content)
+    manifest.flush()
+
+def is_stored(store: OcrStore, manifest: Manifest, flowchart_id: int, stored_ids) -> bool:
+    """Whether the stored result is the one recorded, the store may be older than the manifest"""
+    return flowchart_id in stored_ids and manifest.is_done(flowchart_id, OCR_ARTIFACT) and \
+        manifest.get_hash(flowchart_id, OCR_ARTIFACT) == content_hash(store.get_content(flowchart_id))
+
+def generate_ocr_contents(chart_num: int = FLOWCHART_NUM):
+    manifest = get_manifest()
+    manifest.check_stage(OCR_STAGE, chart_num)
+    if RESUME and manifest.stage_done(OCR_STAGE):
+        print("---OCR results already generated, skipped---")
+        return
+    manifest.start_stage(OCR_STAGE)
+    with OcrStore(get_ocr_store_path()) as store:
+        if RESUME:
+            import_previous_ocr_results(store)
+        else:
+            store.clear()
+        stored_ids = store.ids()
+        pending_ids = [i for i in range(chart_num) if not is_stored(store, manifest, i, stored_ids)]
+        skipped_num = chart_num - len(pending_ids)
+        if skipped_num > 0:
+            print(f"---Skipped {skipped_num} OCR results already generated---")
+        image_paths = [get_img_path(i) for i in pending_ids]
+        st_clk = time.time()
+        if OCR_MODE == SIMULATED_OCR:
+            results = iter_simulated_ocr_results(pending_ids)
+        else:
+            results = iter_ocr_results(image_paths)
+        rows = []
+        with get_metrics().stage(OCR_STAGE, total=len(pending_ids)) as stage:
+            stage.count(SKIPPED_COUNTER, skipped_num)
+            for i, image_path, raw in zip(pending_ids, image_paths, results):
+                node_list = filter_texts(raw)
+                print(f"Extracted node list from {image_path}: {node_list}")
+                content = generate_node_list_content(node_list)
+                rows.append((i, raw, content))
+                stage.tick(len(content.encode("utf-8")))
+                if len(rows) >= OCR_BATCH_SIZE:
+                    save_ocr_batch(store, manifest, rows)
+                    rows = []
+            save_ocr_batch(store, manifest, rows)
+        elapsed = time.time() - st_clk
+    print(f"---OCR: {len(pending_ids)} images in {elapsed:.2f} seconds, "
+          f"{len(pending_ids) / elapsed if elapsed > 0 else 0:.2f} images/sec---")
+    manifest.mark_stage(SAMPLES_STAGE, done=False)
+    manifest.mark_stage(OCR_STAGE, chart_num=chart_num)
+
+def refilter_ocr_contents(min_confidence: float):
+    """Rebuild the OCR contents from the stored raw results with another confidence threshold, without OCR"""
+    manifest = get_manifest()
+    with OcrStore(get_ocr_store_path()) as store:
+        rows = [(i, generate_node_list_content(filter_texts(raw, min_confidence))) for i, raw in store.iter_raw()]
+        store.update_contents(rows)
+    for i, content in rows:
+        manifest.record(i, OCR_ARTIFACT, DONE_STATUS, content)
+    manifest.mark_stage(SAMPLES_STAGE, done=False)
+    print(f"---Refiltered {len(rows)} OCR results with min confidence {min_confidence}---")
 
 if __name__ == "__main__":
-    generate_ocr_contents()
+    # python -m gen.gen_ocr_contents --refilter 0.5: rebuild the contents with another MIN_CONFIDENCE
+    if len(sys.argv) > 2 and sys.argv[1] == "--refilter":
+        refilter_ocr_contents(float(sys.argv[2]))
+    else:
+        generate_ocr_contents()
+        get_metrics().save()
@@ -0,0 +1,213 @@
+import io
+import json
+import os
+import tarfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from constant import SHARD_SIZE, SHARD_IMAGE_REFS, SHARD_DIR_NAME, SHARD_INDEX_FILE_NAME, CONV_FILE_NAME, \
+    CONV_QA_FILE_NAME, IMG_FORMAT, RESUME, FLOWCHART_NUM
+from gen.gen_conversations import Variant, get_variants
+from gen.manifest import get_manifest, SAMPLES_STAGE, SHARDS_STAGE
+from gen.metrics import get_metrics, SAMPLES_COUNTER
+from sample.writer import iter_samples
+from utils import get_img_path
+
+CONVERSATIONS_MEMBER = "conversations.json"  # {id}.conversations.json: conversations of the flowchart
+QA_MEMBER = "qa.json"  # {id}.qa.json: q&a conversations of the flowchart
+
+
+def get_shard_name(shard_id: int) -> str:
+    return f"shard-{shard_id:06d}.tar"
+
+def get_member_key(member_name: str) -> str:
+    """Key of a member, the part of its name before the first dot, e.g. 12 for 12.qa.json (WebDataset convention)"""
+    return member_name.split(".", 1)[0]
+
+
+class ShardWriter:
+    """
+    Writes the flowcharts of a dataset into tar shards of shard_size flowcharts, each flowchart as consecutive
+    members with the same key: {id}.png, {id}.conversations.json and {id}.qa.json. The members are written
+    without timestamps or owners, so the same dataset always gives the same shards.
+    The index (SHARD_INDEX_FILE_NAME) gives, for each shard, its flowcharts and the offset and size of every member.
+    """
+    def __init__(self, shard_dir: str, shard_size: int = SHARD_SIZE):
+        self.shard_dir = shard_dir
+        self.shard_size = shard_size
+        self.shards: List[Dict[str, Any]] = []
+        self._tar: Optional[tarfile.TarFile] = None
+        self.flowchart_num = 0
+        self.sample_num = 0
+        if not os.path.exists(shard_dir):
+            os.makedirs(shard_dir)
+
+    def _open_shard(self, flowchart_id: int):
+        name = get_shard_name(len(self.shards))
+        self.shards.append({"name": name, "first_id": flowchart_id, "flowchart_num": 0, "sample_num": 0,
+                            "bytes": 0, "members": []})
+        self._tar = tarfile.open(os.path.join(self.shard_dir, name), "w", format=tarfile.USTAR_FORMAT)
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        self.shards[-1]["bytes"] = os.path.getsize(os.path.join(self.shard_dir, self.shards[-1]["name"]))
+        self._tar = None
+
+    def _add_member(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(data))
+        # the content ends the shard so far, padded to whole blocks
+        offset = self._tar.offset - -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        self.shards[-1]["members"].append([name, offset, info.size])
+
+    def write(self, flowchart_id: int, image: bytes, conversations: List[dict], qas: List[dict]):
+        """Add a flowchart with its image and its samples, in flowchart order"""
+        if self._tar is None or self.shards[-1]["flowchart_num"] >= self.shard_size:
+            self._close_shard()
+            self._open_shard(flowchart_id)
+        self._add_member(os.path.basename(get_img_path(flowchart_id)), image)
+        self._add_member(f"{flowchart_id}.{CONVERSATIONS_MEMBER}", json.dumps(conversations).encode("utf-8"))
+        self._add_member(f"{flowchart_id}.{QA_MEMBER}", json.dumps(qas).encode("utf-8"))
+        self.shards[-1]["flowchart_num"] += 1
+        self.shards[-1]["sample_num"] += len(conversations)
+        self.flowchart_num += 1
+        self.sample_num += len(conversations)
+
+    def close(self):
+        self._close_shard()
+        with open(os.path.join(self.shard_dir, SHARD_INDEX_FILE_NAME), "w") as f:
+            json.dump({"shard_size": self.shard_size, "image_format": IMG_FORMAT,
+                       "flowchart_num": self.flowchart_num, "sample_num": self.sample_num,
+                       "shards": self.shards}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_shard(path: str) -> Iterator[Tuple[str, Dict[str, bytes]]]:
+    """
+    Read a shard sequentially, e.g. from a pipe or network storage, without seeking.
+    Yield (key, {member name without the key: content}) per flowchart, e.g. ("12", {"png": ..., "qa.json": ...}).
+    """
+    key, members = None, {}
+    with tarfile.open(path, "r|") as tar:
+        for info in tar:
+            if not info.isfile():
+                continue
+            member_key, _, suffix = info.name.partition(".")
+            if member_key != key and members:
+                yield key, members
+                members = {}
+            key = member_key
+            members[suffix] = tar.extractfile(info).read()
+    if members:
+        yield key, members
+
+
+class ShardIndex:
+    """Random access to the shards of a dataset and to the members of each flowchart, through the shard index"""
+    def __init__(self, shard_dir: str):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, SHARD_INDEX_FILE_NAME), "r") as f:
+            index = json.load(f)
+        self.shard_size = index["shard_size"]
+        self.flowchart_num = index["flowchart_num"]
+        self.sample_num = index["sample_num"]
+        self.shards = index["shards"]
+        # flowchart id -> (shard id, {member name: (offset, size)})
+        self.members: Dict[int, Tuple[int, Dict[str, Tuple[int, int]]]] = {}
+        for shard_id, shard in enumerate(self.shards):
+            for name, offset, size in shard["members"]:
+                flowchart_id = int(get_member_key(name))
+                if flowchart_id not in self.members:
+                    self.members[flowchart_id] = (shard_id, {})
+                self.members[flowchart_id][1][name] = (offset, size)
+
+    def __len__(self):
+        return len(self.shards)
+
+    def get_shard_path(self, shard_id: int) -> str:
+        return os.path.join(self.shard_dir, self.shards[shard_id]["name"])
+
+    def iter_shard(self, shard_id: int) -> Iterator[Tuple[str, Dict[str, bytes]]]:
+        """Read one shard sequentially, see iter_shard()"""
+        return iter_shard(self.get_shard_path(shard_id))
+
+    def read_member(self, flowchart_id: int, name: str) -> bytes:
+        """Content of one member of a flowchart, e.g. read_member(12, "12.png"), with one seek and one read"""
+        shard_id, members = self.members[flowchart_id]
+        offset, size = members[name]
+        with open(self.get_shard_path(shard_id), "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def get_flowchart(self, flowchart_id: int) -> Dict[str, bytes]:
+        """All the members of a flowchart, by name"""
+        return {name: self.read_member(flowchart_id, name) for name in self.members[flowchart_id][1]}
+
+
+def get_record_flowchart_id(record: dict) -> int:
+    """Flowchart id of a sample record, from its image path img/{id}.png"""
+    return int(get_member_key(os.path.basename(record["image"])))
+
+def iter_flowchart_records(variant: Variant) -> Iterator[Tuple[int, List[dict], List[dict]]]:
+    """(flowchart id, conversations, q&a conversations) of each flowchart of a dataset, streamed from its files"""
+    flowchart_id, conversations, qas = None, [], []
+    for conversation, qa in zip(iter_samples(os.path.join(variant.output_dir, CONV_FILE_NAME)),
+                                iter_samples(os.path.join(variant.qa_dir, CONV_QA_FILE_NAME))):
+        record_flowchart_id = get_record_flowchart_id(conversation)
+        if record_flowchart_id != flowchart_id and conversations:
+            yield flowchart_id, conversations, qas
+            conversations, qas = [], []
+        flowchart_id = record_flowchart_id
+        conversations.append(conversation)
+        qas.append(qa)
+    if conversations:
+        yield flowchart_id, conversations, qas
+
+def pack_shards(variant: Variant, shard_size: int = SHARD_SIZE, image_refs: bool = SHARD_IMAGE_REFS) -> str:
+    """
+    Pack the images and samples of a dataset into tar shards in its SHARD_DIR_NAME directory.
+    :param image_refs: whether the image field of the records is the name of the image member in the shard
+    :return: the shard directory
+    """
+    shard_dir = os.path.join(variant.output_dir, SHARD_DIR_NAME)
+    with ShardWriter(shard_dir, shard_size) as writer, \
+            get_metrics().stage(SHARDS_STAGE) as stage:
+        for flowchart_id, conversations, qas in iter_flowchart_records(variant):
+            with open(get_img_path(flowchart_id), "rb") as f:
+                image = f.read()
+            if image_refs:
+                image_name = os.path.basename(get_img_path(flowchart_id))
+                for record in conversations + qas:
+                    record["image"] = image_name
+            writer.write(flowchart_id, image, conversations, qas)
+            stage.count(SAMPLES_COUNTER, len(conversations))
+            stage.tick()
+    stage.add_bytes(sum(shard["bytes"] for shard in writer.shards))
+    print(f"---Packed {writer.flowchart_num} flowcharts into {len(writer.shards)} shards in {shard_dir}---")
+    return shard_dir
+
+def gen_shards(variants: List[Variant] = None):
+    manifest = get_manifest()
+    manifest.check_stage(SHARDS_STAGE, FLOWCHART_NUM)
+    if RESUME and manifest.stage_done(SHARDS_STAGE):
+        print("---Shards already packed, skipped---")
+        return
+    if not manifest.stage_done(SAMPLES_STAGE):
+        raise ValueError("The conversations must be generated before they are packed into shards")
+    manifest.start_stage(SHARDS_STAGE)
+    for variant in (variants if variants is not None else get_variants()):
+        pack_shards(variant)
+    manifest.mark_stage(SHARDS_STAGE, chart_num=FLOWCHART_NUM)
+
+
+if __name__ == "__main__":
+    gen_shards()
+    get_metrics().save()
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from constant import CONVS_DIR, MANIFEST_FILE_NAME, RESUME_CHECK_HASHES, SEED, FLOWCHART_STORAGE, FLOWCHART_GENERATOR, \
+    FLOWCHART_BATCH_SIZE, FLOWCHART_DEDUP_QUOTA, FLOWCHART_DEDUP_MAX_REDRAWS, MAX_NODE_NUM, NODE_NUM_MEAN, \
+    NODE_NUM_STD, ALLOWED_CHARACTERS, RENDER_BACKEND, RENDER_SCALE, PIL_RENDER_SCALE, IMG_FORMAT, IMG_MAX_SIDE, \
+    IMG_MAX_PIXELS, IMG_COLOR_MODE, IMG_PALETTE_SIZE, IMG_PNG_COMPRESS_LEVEL, OCR_MODE, MIN_CONFIDENCE, USE_COT, \
+    USE_OCR, VARIANTS, CONV_TEMPLATE_SET, MULTIHOP_QUESTIONS_ON, CONV_OUTPUT_FORMAT, CONV_INDEX_ON, SAMPLE_WORKERS, \
+    PIPELINE_MODE, STREAMING_PIPELINE, SHARD_SIZE, SHARD_IMAGE_REFS
+
+# artifacts generated for each flowchart
+MMD_ARTIFACT = "mmd"
+PKL_ARTIFACT = "pkl"
+PNG_ARTIFACT = "png"
+OCR_ARTIFACT = "ocr"
+
+# pipeline stages, in order
+FLOWCHARTS_STAGE = "flowcharts"
+IMGS_STAGE = "imgs"
+OCR_STAGE = "ocr"
+SAMPLES_STAGE = "samples"
+SHARDS_STAGE = "shards"
+STAGES = [FLOWCHARTS_STAGE, IMGS_STAGE, OCR_STAGE, SAMPLES_STAGE, SHARDS_STAGE]
+# per-flowchart artifacts generated by each stage
+STAGE_ARTIFACTS = {
+    FLOWCHARTS_STAGE: [MMD_ARTIFACT, PKL_ARTIFACT],
+    IMGS_STAGE: [PNG_ARTIFACT],
+    OCR_STAGE: [OCR_ARTIFACT],
+    SAMPLES_STAGE: [],
+    SHARDS_STAGE: [],
+}
+
+DONE_STATUS = "done"
+FAILED_STATUS = "failed"
+
+
+def content_hash(content: Union[str, bytes]) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha1(content).hexdigest()
+
+
+def get_stage_settings(stage: str) -> Dict[str, Any]:
+    """Settings the outputs of a stage depend on, as JSON values, see Manifest.check_stage"""
+    if stage == FLOWCHARTS_STAGE:
+        settings = {"SEED": SEED, "FLOWCHART_STORAGE": FLOWCHART_STORAGE, "FLOWCHART_GENERATOR": FLOWCHART_GENERATOR,
+                    "FLOWCHART_BATCH_SIZE": FLOWCHART_BATCH_SIZE, "FLOWCHART_DEDUP_QUOTA": FLOWCHART_DEDUP_QUOTA,
+                    "FLOWCHART_DEDUP_MAX_REDRAWS": FLOWCHART_DEDUP_MAX_REDRAWS, "MAX_NODE_NUM": MAX_NODE_NUM,
+                    "NODE_NUM_MEAN": NODE_NUM_MEAN, "NODE_NUM_STD": NODE_NUM_STD,
+                    "ALLOWED_CHARACTERS": ALLOWED_CHARACTERS}
+    elif stage == IMGS_STAGE:
+        settings = {"RENDER_BACKEND": RENDER_BACKEND, "RENDER_SCALE": RENDER_SCALE, "PIL_RENDER_SCALE": PIL_RENDER_SCALE,
+                    "IMG_FORMAT": IMG_FORMAT, "IMG_MAX_SIDE": IMG_MAX_SIDE, "IMG_MAX_PIXELS": IMG_MAX_PIXELS,
+                    "IMG_COLOR_MODE": IMG_COLOR_MODE, "IMG_PALETTE_SIZE": IMG_PALETTE_SIZE,
+                    "IMG_PNG_COMPRESS_LEVEL": IMG_PNG_COMPRESS_LEVEL}
+    elif stage == OCR_STAGE:
+        settings = {"OCR_MODE": OCR_MODE, "MIN_CONFIDENCE": MIN_CONFIDENCE}
+    elif stage == SAMPLES_STAGE:
+        settings = {"USE_COT": USE_COT, "USE_OCR": USE_OCR, "VARIANTS": VARIANTS, "CONV_TEMPLATE_SET": CONV_TEMPLATE_SET,
+                    "MULTIHOP_QUESTIONS_ON": MULTIHOP_QUESTIONS_ON, "CONV_OUTPUT_FORMAT": CONV_OUTPUT_FORMAT,
+                    "CONV_INDEX_ON": CONV_INDEX_ON,
+                    # the samples only depend on whether they are drawn from the per-flowchart random streams
+                    "PER_FLOWCHART_STREAMS": SAMPLE_WORKERS > 0 or PIPELINE_MODE == STREAMING_PIPELINE}
+    else:
+        settings = {"SHARD_SIZE": SHARD_SIZE, "SHARD_IMAGE_REFS": SHARD_IMAGE_REFS}
+    return json.loads(json.dumps(settings))
+
+
+class Manifest:
+    """
+    Per-run record of the status, size and content hash of every artifact of every flowchart,
+    and of the pipeline stages: the settings each stage was run with, and the completed stages
+    with their number of flowcharts.
+    It is stored as an append-only JSON lines log. Records are buffered and written in order, every
+    flush_every records and at the end of each stage, so a crash loses at most the records made since
+    the last flush: their artifacts are generated again by the resumed run, and verify() forgets
+    the recorded files that were changed or removed since.
+    Records can be added from several threads, e.g. by the stages of the streaming pipeline.
+    """
+    def __init__(self, path: str, flush_every: int = 100):
+        """
+        :param path: path of the manifest file, loaded if it exists
+        :param flush_every: number of records buffered before they are written to disk,
+                            at most this many records are lost on a crash
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.items: Dict[int, Dict[str, Dict[str, str]]] = {}  # flowchart id -> artifact -> record
+        self.stages: Dict[str, str] = {}
+        self.stage_chart_nums: Dict[str, int] = {}  # number of flowcharts of each completed stage
+        self.stage_settings: Dict[str, Dict[str, Any]] = {}  # settings each stage was last started with
+        self._pending: List[str] = []
+        self._lock = threading.RLock()
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:  # last line of a crashed run
+                    continue
+                self._apply(entry)
+
+    def _apply(self, entry: dict):
+        if "stage" in entry:
+            if "settings" in entry:
+                self.stage_settings[entry["stage"]] = entry["settings"]
+            elif entry["status"] is None:
+                self.stages.pop(entry["stage"], None)
+            else:
+                self.stages[entry["stage"]] = entry["status"]
+                self.stage_chart_nums[entry["stage"]] = entry.get("chart_num")
+        elif entry["status"] is None:
+            self.items.get(entry["id"], {}).pop(entry["artifact"], None)
+        else:
+            self.items.setdefault(entry["id"], {})[entry["artifact"]] = \
+                {"status": entry["status"], "hash": entry.get("hash"), "size": entry.get("size")}
+
+    def _append(self, entry: dict):
+        with self._lock:
+            self._apply(entry)
+            self._pending.append(json.dumps(entry))
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.path, "a") as f:
+                f.write("\n".join(self._pending) + "\n")
+            self._pending = []
+
+    def reset(self):
+        """Forget everything, used when a run starts from scratch."""
+        self.items, self.stages, self._pending = {}, {}, []
+        self.stage_chart_nums, self.stage_settings = {}, {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def record(self, flowchart_id: int, artifact: str, status: str, content: Union[str, bytes, None] = None):
+        """
+        Record the status of one artifact.
+        :param content: content of the artifact, only its hash and size are stored
+        """
+        entry = {"id": flowchart_id, "artifact": artifact, "status": status}
+        if content is not None:
+            entry["hash"] = content_hash(content)
+            entry["size"] = len(content.encode("utf-8") if isinstance(content, str) else content)
+        self._append(entry)
+
+    def invalidate(self, flowchart_id: int, artifacts: Iterable[str]):
+        """Forget artifacts that must be regenerated, e.g. the image of a regenerated flowchart."""
+        for artifact in artifacts:
+            if artifact in self.items.get(flowchart_id, {}):
+                self._append({"id": flowchart_id, "artifact": artifact, "status": None})
+
+    def is_done(self, flowchart_id: int, artifact: str) -> bool:
+        return self.items.get(flowchart_id, {}).get(artifact, {}).get("status") == DONE_STATUS
+
+    def get_hash(self, flowchart_id: int, artifact: str) -> Optional[str]:
+        return self.items.get(flowchart_id, {}).get(artifact, {}).get("hash")
+
+    def pending(self, flowchart_ids: Iterable[int], artifact: str) -> List[int]:
+        """Ids of the flowcharts whose artifact is failed or missing."""
+        return [i for i in flowchart_ids if not self.is_done(i, artifact)]
+
+    def verify(self, artifact: str, path_of: Callable[[int], str], check_hash: bool = RESUME_CHECK_HASHES) -> List[int]:
+        """
+        Forget the done artifacts whose file is missing or differs from the record, with the artifacts
+        generated from them by the following stages, so a resumed run generates them again.
+        :param artifact: artifact stored as one file per flowchart
+        :param path_of: path of the file of a flowchart id
+        :param check_hash: also compare the content hash of the files, which reads all of them
+        :return: ids of the forgotten artifacts
+        """
+        stage = next(stage for stage in STAGES if artifact in STAGE_ARTIFACTS[stage])
+        invalid_ids = []
+        for flowchart_id, records in self.items.items():
+            record = records.get(artifact)
+            if record is None or record["status"] != DONE_STATUS:
+                continue
+            path = path_of(flowchart_id)
+            if not os.path.exists(path) or \
+                    (record.get("size") is not None and os.path.getsize(path) != record["size"]):
+                invalid_ids.append(flowchart_id)
+            elif check_hash and record.get("hash") is not None:
+                with open(path, "rb") as f:
+                    if content_hash(f.read()) != record["hash"]:
+                        invalid_ids.append(flowchart_id)
+        if invalid_ids:
+            print(f"---{len(invalid_ids)} {artifact} files missing or changed, generated again---")
+            artifacts = [artifact for later in STAGES[STAGES.index(stage):] for artifact in STAGE_ARTIFACTS[later]]
+            for flowchart_id in invalid_ids:
+                self.invalidate(flowchart_id, artifacts)
+            self.mark_stage(stage, done=False)
+        return invalid_ids
+
+    def start_stage(self, stage: str):
+        """Record the settings a stage is run with, its outputs are generated with them from now on"""
+        self._append({"stage": stage, "settings": get_stage_settings(stage)})
+
+    def mark_stage(self, stage: str, done: bool = True, chart_num: Optional[int] = None):
+        """
+        Mark a stage as completed (or not). Marking a stage as not completed
+        also clears all the following stages, since they depend on its outputs.
+        :param chart_num: number of flowcharts the stage was completed for
+        """
+        if done:
+            self._append({"stage": stage, "status": DONE_STATUS, "chart_num": chart_num})
+        else:
+            for later in STAGES[STAGES.index(stage):]:
+                if later in self.stages:
+                    self._append({"stage": later, "status": None})
+        self.flush()
+
+    def stage_done(self, stage: str) -> bool:
+        return self.stages.get(stage) == DONE_STATUS
+
+    def has_outputs(self, stage: str) -> bool:
+        """Whether the stage is completed or some of its artifacts are generated"""
+        return self.stage_done(stage) or any(artifact in artifacts for artifacts in self.items.values()
+                                             for artifact in STAGE_ARTIFACTS[stage])
+
+    def changed_settings(self, stage: str) -> List[str]:
+        """
+        Names of the settings of a stage that differ from those its outputs were generated with,
+        all of them if they were generated with unknown settings (e.g. by an older version), none without outputs.
+        """
+        if not self.has_outputs(stage):
+            return []
+        current = get_stage_settings(stage)
+        recorded = self.stage_settings.get(stage, {})
+        return [name for name in current if name not in recorded or recorded[name] != current[name]]
+
+    def check_stage(self, stage: str, chart_num: int):
+        """
+        Make a stage run again if its outputs are stale: with other settings (get_stage_settings), the artifacts
+        of the stage and of the following ones are forgotten, so they are all generated again;
+        with another number of flowcharts, the stage and the following ones are cleared, so they go over
+        all the flowcharts again and only generate the missing artifacts.
+        """
+        changed = self.changed_settings(stage)
+        if changed:
+            print(f"---Settings of the {stage} stage changed ({', '.join(changed)}), generated again---")
+            artifacts = [artifact for later in STAGES[STAGES.index(stage):] for artifact in STAGE_ARTIFACTS[later]]
+            for flowchart_id in list(self.items):
+                self.invalidate(flowchart_id, artifacts)
+            self.mark_stage(stage, done=False)
+        elif self.stage_done(stage) and self.stage_chart_nums.get(stage) != chart_num:
+            print(f"---Number of flowcharts changed to {chart_num}, {stage} stage run again---")
+            self.mark_stage(stage, done=False)
+
+
+_manifest = None
+
+
+def get_manifest() -> Manifest:
+    """Manifest of the current run (GEN_IDENTIFIER)."""
+    global _manifest
+    if _manifest is None:
+        _manifest = Manifest(os.path.join(CONVS_DIR, MANIFEST_FILE_NAME))
+    return _manifest
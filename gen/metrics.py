@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from constant import GEN_IDENTIFIER, METRICS_ON, METRICS_REPORT_INTERVAL, METRICS_DIR
+
+# counters of a stage
+FAILURES_COUNTER = "failures"
+TIMEOUTS_COUNTER = "timeouts"
+RETRIES_COUNTER = "retries"
+SKIPPED_COUNTER = "skipped"  # items already done by a previous run
+SAMPLES_COUNTER = "samples"  # samples built, the items of the samples stage are flowcharts
+ABORTED_COUNTER = "aborted"  # 1 if the stage raised an exception
+REDRAWN_COUNTER = "redrawn"  # flowcharts discarded as duplicates over FLOWCHART_DEDUP_QUOTA
+
+
+def get_peak_rss() -> Dict[str, Optional[int]]:
+    """Peak resident memory in bytes, of this process and of its largest terminated child (e.g. a pool worker)"""
+    if resource is None:
+        return {"self": None, "children": None}
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit}
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in power-of-two buckets of microseconds: bucket k counts the latencies
+    in [2^(k-1), 2^k) us, bucket 0 those under 1 us. Adding a latency is one int.bit_length.
+    """
+    def __init__(self):
+        self.buckets: List[int] = []
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds: float):
+        k = int(seconds * 1e6).bit_length()
+        if k >= len(self.buckets):
+            self.buckets.extend([0] * (k + 1 - len(self.buckets)))
+        self.buckets[k] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound in seconds of the bucket holding the q-th quantile (0 < q <= 1)"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for k, num in enumerate(self.buckets):
+            seen += num
+            if seen >= rank:
+                return min((1 << k) / 1e6, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets_us": {f"<{1 << k}": num for k, num in enumerate(self.buckets) if num},
+        }
+
+
+class StageMetrics:
+    """
+    Timing and counters of one pipeline stage: per-item latencies, counters (failures, timeouts, retries...),
+    bytes written and peak memory. Progress (throughput and ETA) is printed and logged every
+    METRICS_REPORT_INTERVAL seconds while items are recorded.
+    """
+    def __init__(self, name: str, total: int = 0, enabled: bool = True, report_interval: float = METRICS_REPORT_INTERVAL):
+        """
+        :param name: name of the stage, e.g. "imgs"
+        :param total: number of items expected, used for the ETA, 0 if unknown
+        :param enabled: whether anything is recorded
+        :param report_interval: seconds between two progress reports, 0 to disable them
+        """
+        self.name = name
+        self.total = total
+        self.enabled = enabled
+        self.report_interval = report_interval
+        self.items = 0
+        self.counters: Dict[str, int] = {FAILURES_COUNTER: 0, TIMEOUTS_COUNTER: 0, RETRIES_COUNTER: 0}
+        self.bytes_written = 0
+        self.latency = LatencyHistogram()
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.peak_rss = None
+        self._last_tick = self.start_time
+        self._last_report = self.start_time
+
+    def tick(self, bytes_written: int = 0):
+        """Record one item, its latency is the time since the previous item (or the start of the stage)"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.record(now - self._last_tick, bytes_written, now)
+        self._last_tick = now
+
+    def record(self, latency: float, bytes_written: int = 0, now: float = None):
+        """Record one item with a latency measured by the caller, e.g. the render time of an image"""
+        if not self.enabled:
+            return
+        self.items += 1
+        self.bytes_written += bytes_written
+        self.latency.add(latency)
+        now = time.perf_counter() if now is None else now
+        if self.report_interval > 0 and now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.report(now)
+
+    def count(self, counter: str, num: int = 1):
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + num
+
+    def add_bytes(self, num: int):
+        if self.enabled:
+            self.bytes_written += num
+
+    def elapsed(self, now: float = None) -> float:
+        end = self.end_time if self.end_time is not None else (time.perf_counter() if now is None else now)
+        return end - self.start_time
+
+    def report(self, now: float = None):
+        elapsed = self.elapsed(now)
+        rate = self.items / elapsed if elapsed > 0 else 0
+        progress = f"{self.items}/{self.total}" if self.total else f"{self.items}"
+        eta = f", ETA {(self.total - self.items) / rate:.0f} seconds" if self.total and rate > 0 else ""
+        message = f"[{self.name}] {progress} items in {elapsed:.2f} seconds, {rate:.2f} items/sec{eta}"
+        logging.info(message)
+        print(message)
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+        self.peak_rss = get_peak_rss()
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = self.elapsed()
+        return {
+            "stage": self.name,
+            "total": self.total,
+            "items": self.items,
+            "elapsed": elapsed,
+            "items_per_sec": self.items / elapsed if elapsed > 0 else 0,
+            "counters": self.counters,
+            "bytes_written": self.bytes_written,
+            "peak_rss": self.peak_rss,
+            "latency": self.latency.to_dict(),
+        }
+
+
+class StageContext:
+    def __init__(self, run_metrics, stage: StageMetrics):
+        self.run_metrics = run_metrics
+        self.stage = stage
+
+    def __enter__(self) -> StageMetrics:
+        return self.stage
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stage.finish()
+        if exc_type is not None:
+            self.stage.count(ABORTED_COUNTER)
+        self.run_metrics.stages.append(self.stage)
+
+
+class RunMetrics:
+    """
+    Metrics of all the stages run by one process, saved as one JSON file per run
+    under METRICS_DIR (log/metrics-{GEN_IDENTIFIER}-{start time}.json).
+    """
+    def __init__(self, enabled: bool = METRICS_ON):
+        self.enabled = enabled
+        self.start_time = time.time()
+        self.stages: List[StageMetrics] = []
+
+    def stage(self, name: str, total: int = 0) -> StageContext:
+        """
+        Measure a stage: with get_metrics().stage(IMGS_STAGE, total=chart_num) as stage: ... stage.tick()
+        """
+        return StageContext(self, StageMetrics(name, total, self.enabled))
+
+    def get_path(self) -> str:
+        start = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.start_time))
+        return os.path.join(METRICS_DIR, f"metrics-{GEN_IDENTIFIER}-{start}.json")
+
+    def save(self) -> Optional[str]:
+        """Write the metrics of the stages run so far, return the path of the file (None if disabled)"""
+        if not self.enabled:
+            return None
+        path = self.get_path()
+        if not os.path.exists(METRICS_DIR):
+            os.makedirs(METRICS_DIR)
+        with open(path, "w") as f:
+            json.dump({
+                "gen_identifier": GEN_IDENTIFIER,
+                "start_time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start_time)),
+                "elapsed": time.time() - self.start_time,
+                "peak_rss": get_peak_rss(),
+                "stages": [stage.to_dict() for stage in self.stages],
+            }, f, indent=2)
+        return path
+
+
+_metrics = None
+
+
+def get_metrics() -> RunMetrics:
+    """Metrics of the current run"""
+    global _metrics
+    if _metrics is None:
+        _metrics = RunMetrics()
+    return _metrics
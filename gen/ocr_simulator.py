@@ -0,0 +1,366 @@
+"""
+Simulated OCR: an error model calibrated from real EasyOCR results, applied to the ground-truth node names.
+Usage: python -m gen.ocr_simulator
+calibrates the model from the OCR store of the current run (OCR_MODE = "easyocr"), saves it to
+OCR_ERROR_MODEL_PATH, and writes a report comparing the simulated errors with the real ones.
+Runs with OCR_MODE = "simulated" then use the saved model instead of EasyOCR.
+"""
+import bisect
+import json
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+from constant import ALLOWED_CHARACTERS, MIN_CONFIDENCE, OCR_ERROR_MODEL_PATH, OCR_CALIBRATION_NUM, SEED, \
+    STATS_DIR, OCR_SIMULATION_REPORT_FILE_NAME
+from flowchart.flowchart import Flowchart
+from gen.ocr_store import OcrStore, RawResult, get_ocr_store_path
+
+# classes of OCR tokens, each with its own confidence distribution
+EXACT_TOKEN = "exact"  # a node name read correctly
+ERROR_TOKEN = "error"  # a node name (or two merged names) read with character errors
+SPURIOUS_TOKEN = "spurious"  # anything else, mostly edge labels
+TOKEN_CLASSES = [EXACT_TOKEN, ERROR_TOKEN, SPURIOUS_TOKEN]
+
+CONFIDENCE_BINS = 20  # confidences are histogrammed in [0, 1] with this many bins
+SPURIOUS_TEXT_NUM = 200  # number of most frequent spurious texts kept in the model
+SMOOTHING = 10  # weight of the global character error rates in the per-character rates
+
+
+def edit_operations(source: str, target: str) -> List[Tuple[str, str, str]]:
+    """
+    Levenshtein alignment of two strings.
+    :return: list of (operation, source char, target char), operation is "match", "sub", "del" or "ins"
+    """
+    rows, cols = len(source) + 1, len(target) + 1
+    dist = [[0] * cols for _ in range(rows)]
+    for i in range(rows):
+        dist[i][0] = i
+    for j in range(cols):
+        dist[0][j] = j
+    for i in range(1, rows):
+        for j in range(1, cols):
+            dist[i][j] = min(dist[i - 1][j] + 1, dist[i][j - 1] + 1,
+                             dist[i - 1][j - 1] + (source[i - 1] != target[j - 1]))
+    operations = []
+    i, j = len(source), len(target)
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and dist[i][j] == dist[i - 1][j - 1] + (source[i - 1] != target[j - 1]):
+            operations.append(("match" if source[i - 1] == target[j - 1] else "sub", source[i - 1], target[j - 1]))
+            i, j = i - 1, j - 1
+        elif i > 0 and dist[i][j] == dist[i - 1][j] + 1:
+            operations.append(("del", source[i - 1], ""))
+            i -= 1
+        else:
+            operations.append(("ins", "", target[j - 1]))
+            j -= 1
+    return operations[::-1]
+
+
+def edit_distance(source: str, target: str) -> int:
+    return sum(1 for operation, _, _ in edit_operations(source, target) if operation != "match")
+
+
+def is_close(name: str, text: str) -> bool:
+    """Whether an OCR text can be a reading of a name"""
+    return edit_distance(name, text) <= max(1, int(0.4 * len(name)))
+
+
+class TokenAlignment:
+    """Alignment of the OCR texts of one image with the node names of its flowchart."""
+    def __init__(self, names: List[str], texts: List[str]):
+        """
+        :param names: ground-truth node names
+        :param texts: OCR texts, in reading order
+        """
+        self.names = names
+        self.texts = texts
+        self.matches: Dict[int, int] = {}  # text index -> name index
+        self.merges: Dict[int, Tuple[int, int]] = {}  # text index -> indices of the two merged names
+        # one-to-one matching, closest pairs first
+        candidates = sorted((edit_distance(name, text), t, n) for t, text in enumerate(texts)
+                            for n, name in enumerate(names) if abs(len(name) - len(text)) <= max(1, len(name) // 2))
+        matched_names = set()
+        for distance, t, n in candidates:
+            if t in self.matches or n in matched_names or distance > max(1, int(0.4 * len(names[n]))):
+                continue
+            self.matches[t] = n
+            matched_names.add(n)
+        # a remaining text may be two names read as one, e.g. two nodes side by side
+        for t, text in enumerate(texts):
+            if t in self.matches:
+                continue
+            for first in range(len(names)):
+                if first in matched_names or not is_close(names[first], text[:len(names[first])]):
+                    continue
+                rest = text[len(names[first]):]
+                second = next((n for n in range(len(names)) if n != first and n not in matched_names
+                               and rest and is_close(names[n], rest)), None)
+                if second is not None:
+                    self.merges[t] = (first, second)
+                    matched_names.update((first, second))
+                    break
+        self.dropped = [n for n in range(len(names)) if n not in matched_names]
+        self.spurious = [t for t in range(len(texts)) if t not in self.matches and t not in self.merges]
+
+    def token_class(self, t: int) -> str:
+        if t in self.matches:
+            return EXACT_TOKEN if self.texts[t] == self.names[self.matches[t]] else ERROR_TOKEN
+        return ERROR_TOKEN if t in self.merges else SPURIOUS_TOKEN
+
+    def swaps(self) -> Tuple[int, int]:
+        """(number of consecutive matched texts whose names are in decreasing node order, number of pairs)"""
+        order = [self.matches[t] for t in range(len(self.texts)) if t in self.matches]
+        return sum(1 for a, b in zip(order, order[1:]) if a > b), max(0, len(order) - 1)
+
+
+class OcrErrorModel:
+    """
+    Error model of the OCR of flowchart images:
+    - names are read in node order, with some adjacent names swapped
+    - a name can be missed, or read merged with the next one
+    - each character can be substituted or dropped, characters can be inserted
+    - edge labels (and noise) give spurious texts, like "y" and "n" which are filtered out later
+    - every text gets a confidence drawn from the distribution of its class, filtered with MIN_CONFIDENCE later
+    """
+    def __init__(self, params: dict):
+        self.params = params
+        self._cumulative = {}  # cached cumulative weights for the draws
+        self._confidence_weights = {token_class: {str(i): count for i, count in enumerate(histogram)}
+                                    for token_class, histogram in params["confidences"].items()}
+
+    def to_dict(self) -> dict:
+        return self.params
+
+    def save(self, path: str = OCR_ERROR_MODEL_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, "w") as f:
+            json.dump(self.params, f, indent=2)
+
+    @staticmethod
+    def load(path: str = OCR_ERROR_MODEL_PATH) -> "OcrErrorModel":
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No OCR error model at {path}, calibrate one with python -m gen.ocr_simulator")
+        with open(path, "r") as f:
+            return OcrErrorModel(json.load(f))
+
+    @staticmethod
+    def calibrate(pairs: List[Tuple[Flowchart, RawResult]]) -> "OcrErrorModel":
+        """
+        Build the model from real OCR results.
+        :param pairs: (flowchart, raw EasyOCR result of its image)
+        """
+        if not pairs:
+            raise ValueError("No raw OCR results to calibrate the OCR error model from")
+        char_counts = {c: 0 for c in ALLOWED_CHARACTERS}
+        substitutions = {c: {} for c in ALLOWED_CHARACTERS}
+        deletions = {c: 0 for c in ALLOWED_CHARACTERS}
+        insertions = {}
+        positions = 0
+        name_num = dropped_num = merged_num = swap_num = pair_num = 0
+        label_num = spurious_num = spurious_num_without_labels = images_without_labels = 0
+        spurious_texts = {}
+        confidences = {token_class: [0] * CONFIDENCE_BINS for token_class in TOKEN_CLASSES}
+        for flowchart, raw in pairs:
+            names = [name for name, _ in flowchart.nodes]
+            texts = [text for _, text, _ in raw]
+            alignment = TokenAlignment(names, texts)
+            name_num += len(names)
+            dropped_num += len(alignment.dropped)
+            merged_num += len(alignment.merges)
+            swaps, pairs_ = alignment.swaps()
+            swap_num += swaps
+            pair_num += pairs_
+            labels = sum(1 for edge in flowchart.edges if edge[2] != "")
+            label_num += labels
+            spurious_num += len(alignment.spurious)
+            if labels == 0:
+                images_without_labels += 1
+                spurious_num_without_labels += len(alignment.spurious)
+            for t in alignment.spurious:
+                spurious_texts[texts[t]] = spurious_texts.get(texts[t], 0) + 1
+            readings = [(names[n], texts[t]) for t, n in alignment.matches.items()] + \
+                       [(names[a] + names[b], texts[t]) for t, (a, b) in alignment.merges.items()]
+            for name, text in readings:
+                positions += len(name) + 1
+                for operation, source, target in edit_operations(name, text):
+                    if source in char_counts:
+                        char_counts[source] += 1
+                    if operation == "sub" and source in substitutions:
+                        substitutions[source][target] = substitutions[source].get(target, 0) + 1
+                    elif operation == "del" and source in deletions:
+                        deletions[source] += 1
+                    elif operation == "ins":
+                        insertions[target] = insertions.get(target, 0) + 1
+            for t, (_, _, conf) in enumerate(raw):
+                confidences[alignment.token_class(t)][min(CONFIDENCE_BINS - 1, int(conf * CONFIDENCE_BINS))] += 1
+        total_chars = max(1, sum(char_counts.values()))
+        global_sub_rate = sum(sum(s.values()) for s in substitutions.values()) / total_chars
+        global_del_rate = sum(deletions.values()) / total_chars
+        # per-character rates, smoothed toward the global rates for rare characters
+        char_errors = {}
+        for c in ALLOWED_CHARACTERS:
+            count = char_counts[c]
+            char_errors[c] = {
+                "sub_rate": (sum(substitutions[c].values()) + SMOOTHING * global_sub_rate) / (count + SMOOTHING),
+                "del_rate": (deletions[c] + SMOOTHING * global_del_rate) / (count + SMOOTHING),
+                "substitutions": substitutions[c],
+            }
+        top_spurious = sorted(spurious_texts.items(), key=lambda item: -item[1])[:SPURIOUS_TEXT_NUM]
+        noise_rate = spurious_num_without_labels / images_without_labels if images_without_labels else 0
+        return OcrErrorModel({
+            "image_num": len(pairs),
+            "drop_rate": dropped_num / max(1, name_num),
+            "merge_rate": merged_num / max(1, name_num - 1),
+            "swap_rate": swap_num / max(1, pair_num),
+            "insert_rate": sum(insertions.values()) / max(1, positions),
+            "insertions": insertions,
+            "char_errors": char_errors,
+            # spurious texts: noise_rate per image, plus label_rate per conditional edge
+            "noise_rate": noise_rate,
+            "label_rate": max(0.0, spurious_num - noise_rate * len(pairs)) / label_num if label_num else 0,
+            "spurious_texts": dict(top_spurious) or {"y": 1},
+            "confidences": confidences,
+        })
+
+    def _draw(self, key: str, weights: Dict[str, int], rng: random.Random) -> Optional[str]:
+        """Draw a key of weights with probability proportional to its weight"""
+        if key not in self._cumulative:
+            keys, cumulative, total = list(weights), [], 0
+            for k in keys:
+                total += weights[k]
+                cumulative.append(total)
+            self._cumulative[key] = (keys, cumulative, total)
+        keys, cumulative, total = self._cumulative[key]
+        if total == 0:
+            return None
+        return keys[bisect.bisect_right(cumulative, rng.random() * total)]
+
+    def _draw_confidence(self, token_class: str, rng: random.Random) -> float:
+        bin_ = self._draw(f"conf-{token_class}", self._confidence_weights[token_class], rng)
+        if bin_ is None:  # no text of this class in the calibration
+            return 1.0
+        return (int(bin_) + rng.random()) / CONFIDENCE_BINS
+
+    def corrupt(self, name: str, rng: random.Random) -> str:
+        """Read a name with character substitutions, drops and insertions"""
+        chars = []
+        insert_rate = self.params["insert_rate"]
+        for c in name:
+            if rng.random() < insert_rate:
+                chars.append(self._draw("insertions", self.params["insertions"], rng) or "")
+            errors = self.params["char_errors"].get(c)
+            if errors is not None:
+                draw = rng.random()
+                if draw < errors["del_rate"]:
+                    continue
+                if draw < errors["del_rate"] + errors["sub_rate"]:
+                    chars.append(self._draw(f"sub-{c}", errors["substitutions"], rng) or c)
+                    continue
+            chars.append(c)
+        if rng.random() < insert_rate:
+            chars.append(self._draw("insertions", self.params["insertions"], rng) or "")
+        return "".join(chars)
+
+    def simulate(self, flowchart: Flowchart, rng: random.Random) -> RawResult:
+        """
+        Simulated raw OCR result of the image of a flowchart, boxes are left empty.
+        Use gen_ocr_contents.filter_texts on it like on a real result.
+        """
+        order = list(range(flowchart.node_num))
+        for k in range(len(order) - 1):
+            if rng.random() < self.params["swap_rate"]:
+                order[k], order[k + 1] = order[k + 1], order[k]
+        readings = [flowchart.nodes[n][0] for n in order if rng.random() >= self.params["drop_rate"]]
+        result = []
+        k = 0
+        while k < len(readings):
+            merged = k + 1 < len(readings) and rng.random() < self.params["merge_rate"]
+            reading = readings[k] + readings[k + 1] if merged else readings[k]
+            k += 2 if merged else 1
+            text = self.corrupt(reading, rng)
+            token_class = EXACT_TOKEN if text == reading and not merged else ERROR_TOKEN
+            result.append(([], text, self._draw_confidence(token_class, rng)))
+        # spurious texts at random positions, mostly edge labels
+        labels = sum(1 for edge in flowchart.edges if edge[2] != "")
+        expected = self.params["noise_rate"] + self.params["label_rate"] * labels
+        spurious_num = int(expected) + (rng.random() < expected - int(expected))
+        for _ in range(spurious_num):
+            text = self._draw("spurious", self.params["spurious_texts"], rng)
+            result.insert(rng.randint(0, len(result)), ([], text, self._draw_confidence(SPURIOUS_TOKEN, rng)))
+        return result
+
+
+def get_flowchart_ocr_rng(flowchart_id: int) -> random.Random:
+    """Random stream of the simulated OCR of a flowchart, independent of the other stages"""
+    return random.Random((SEED << 32) + flowchart_id + (1 << 31))
+
+
+def error_statistics(pairs: List[Tuple[Flowchart, RawResult]], min_confidence: float = MIN_CONFIDENCE) -> Dict[str, float]:
+    """Error statistics of OCR results, after the confidence and y/n filtering of the OCR contents"""
+    from gen.gen_ocr_contents import filter_texts
+    stats = {"names": 0, "texts": 0, "exact": 0, "dropped": 0, "merged": 0, "spurious": 0, "char_errors": 0,
+             "chars": 0}
+    for flowchart, raw in pairs:
+        names = [name for name, _ in flowchart.nodes]
+        texts = filter_texts(raw, min_confidence)
+        alignment = TokenAlignment(names, texts)
+        stats["names"] += len(names)
+        stats["texts"] += len(texts)
+        stats["exact"] += sum(1 for t, n in alignment.matches.items() if texts[t] == names[n])
+        stats["dropped"] += len(alignment.dropped)
+        stats["merged"] += len(alignment.merges)
+        stats["spurious"] += len(alignment.spurious)
+        for t, n in alignment.matches.items():
+            stats["char_errors"] += edit_distance(names[n], texts[t])
+            stats["chars"] += len(names[n])
+    image_num = max(1, len(pairs))
+    return {
+        "texts per image": stats["texts"] / image_num,
+        "exact names": stats["exact"] / max(1, stats["names"]),
+        "dropped names": stats["dropped"] / max(1, stats["names"]),
+        "merged texts per image": stats["merged"] / image_num,
+        "spurious texts per image": stats["spurious"] / image_num,
+        "character error rate": stats["char_errors"] / max(1, stats["chars"]),
+    }
+
+
+def load_calibration_pairs(sample_num: int = OCR_CALIBRATION_NUM) -> List[Tuple[Flowchart, RawResult]]:
+    """(flowchart, raw OCR result) of the first real OCR results of the current run"""
+    from utils import load_flowchart
+    pairs = []
+    with OcrStore(get_ocr_store_path(), readonly=True) as store:
+        for flowchart_id, raw in store.iter_raw():
+            if len(pairs) >= sample_num:
+                break
+            if raw and all(len(box) == 0 for box, _, _ in raw):  # simulated results
+                continue
+            pairs.append((load_flowchart(flowchart_id), raw))
+    return pairs
+
+
+def ocr_simulation_report(model: OcrErrorModel, pairs: List[Tuple[Flowchart, RawResult]]) -> str:
+    """Compare the error statistics of the real OCR results with simulated ones on the same flowcharts"""
+    simulated = [(flowchart, model.simulate(flowchart, get_flowchart_ocr_rng(i)))
+                 for i, (flowchart, _) in enumerate(pairs)]
+    real_stats, simulated_stats = error_statistics(pairs), error_statistics(simulated)
+    lines = [f"--- Simulated OCR vs Real OCR ({len(pairs)} images, MIN_CONFIDENCE {MIN_CONFIDENCE}) ---",
+             f"{'':<26}{'real':>10}{'simulated':>12}"]
+    for key in real_stats:
+        lines.append(f"{key:<26}{real_stats[key]:>10.4f}{simulated_stats[key]:>12.4f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    calibration_pairs = load_calibration_pairs()
+    error_model = OcrErrorModel.calibrate(calibration_pairs)
+    error_model.save()
+    print(f"---OCR error model calibrated on {len(calibration_pairs)} images, saved to {OCR_ERROR_MODEL_PATH}---")
+    report = ocr_simulation_report(error_model, calibration_pairs)
+    print(report)
+    if not os.path.exists(STATS_DIR):
+        os.makedirs(STATS_DIR)
+    with open(os.path.join(STATS_DIR, OCR_SIMULATION_REPORT_FILE_NAME), "w") as f:
+        f.write(report)
@@ -0,0 +1,92 @@
+import json
+import os
+import sqlite3
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from constant import OCR_DIR, OCR_STORE_FILE_NAME
+
+# raw result of one image: EasyOCR's (box, text, confidence) triples, boxes as lists of [x, y]
+RawResult = List[Tuple[List[List[float]], str, float]]
+
+
+def to_raw_result(result) -> RawResult:
+    """Convert an EasyOCR result (numpy numbers in the boxes) to plain JSON-serializable values"""
+    return [([[float(x), float(y)] for x, y in box], str(text), float(conf)) for box, text, conf in result]
+
+
+class OcrStore:
+    """
+    Keyed store of the OCR results of a run, one SQLite row per flowchart with the formatted content
+    and the raw boxes and confidences, so the content can be rebuilt with another MIN_CONFIDENCE.
+    Rows are written one batch per transaction, so a crash only loses the batch in progress,
+    and readers load single results on demand.
+    """
+    def __init__(self, path: str, readonly: bool = False):
+        """
+        :param path: path of the SQLite database, created if needed (unless readonly)
+        :param readonly: open an existing store for reading only, e.g. while building samples
+        """
+        self.path = path
+        if readonly:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        else:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.connection = sqlite3.connect(path)
+            with self.connection:
+                self.connection.execute("CREATE TABLE IF NOT EXISTS ocr_results "
+                                        "(id INTEGER PRIMARY KEY, content TEXT NOT NULL, raw TEXT)")
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM ocr_results").fetchone()[0]
+
+    def put_many(self, rows: Iterable[Tuple[int, Optional[RawResult], str]]):
+        """
+        Write (flowchart id, raw result, content) rows in one transaction, replacing older rows.
+        The raw result is None for contents imported from an ocr_results.pkl.
+        """
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO ocr_results (id, content, raw) VALUES (?, ?, ?)",
+                                        ((i, content, json.dumps(raw) if raw is not None else None)
+                                         for i, raw, content in rows))
+
+    def update_contents(self, rows: Iterable[Tuple[int, str]]):
+        """Replace the contents of existing rows, in one transaction"""
+        with self.connection:
+            self.connection.executemany("UPDATE ocr_results SET content = ? WHERE id = ?",
+                                        ((content, i) for i, content in rows))
+
+    def get_content(self, flowchart_id: int) -> Optional[str]:
+        row = self.connection.execute("SELECT content FROM ocr_results WHERE id = ?", (flowchart_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def get_raw(self, flowchart_id: int) -> Optional[RawResult]:
+        row = self.connection.execute("SELECT raw FROM ocr_results WHERE id = ?", (flowchart_id,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+    def ids(self) -> Set[int]:
+        return {row[0] for row in self.connection.execute("SELECT id FROM ocr_results")}
+
+    def iter_raw(self) -> Iterator[Tuple[int, RawResult]]:
+        """(flowchart id, raw result) of every row with a raw result, in id order"""
+        for i, raw in self.connection.execute("SELECT id, raw FROM ocr_results WHERE raw IS NOT NULL ORDER BY id"):
+            yield i, json.loads(raw)
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM ocr_results")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_ocr_store_path() -> str:
+    """Path of the OCR store of the current run (GEN_IDENTIFIER)"""
+    return os.path.join(OCR_DIR, OCR_STORE_FILE_NAME)
@@ -0,0 +1,322 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from functools import partial
+from multiprocessing.pool import Pool
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from constant import FLOWCHART_NUM, PIPELINE_QUEUE_SIZE, GEN_IMGS_ON, RESUME, STATS_DIR, \
+    FLOWCHART_STATS_FILE_NAME, CONV_STATS_FILE_NAME, SAMPLE_WORKERS, OCR_WORKERS, OCR_BATCH_SIZE, \
+    OCR_PREFETCH_BATCHES, OCR_MODE, SIMULATED_OCR
+from flowchart.flowchart import Flowchart
+from gen.gen_flowcharts import iter_flowcharts, render_imgs, reset_run, count_images, flowchart_statistics
+from gen.gen_ocr_contents import filter_texts, generate_node_list_content, import_previous_ocr_results, \
+    save_ocr_batch, is_stored, read_image_batch, _init_ocr_worker
+from gen.gen_conversations import gen_samples, get_variants, build_flowchart_samples
+from gen.manifest import get_manifest, FLOWCHARTS_STAGE, IMGS_STAGE, OCR_STAGE, SAMPLES_STAGE, \
+    PNG_ARTIFACT, OCR_ARTIFACT
+from gen.metrics import get_metrics, SKIPPED_COUNTER
+from gen.ocr_simulator import OcrErrorModel, get_flowchart_ocr_rng
+from gen.ocr_store import OcrStore, RawResult, get_ocr_store_path
+from sample.collector import SampleCollector
+from utils import get_img_path
+
+
+class PipelineAborted(Exception):
+    """Raised in a stage waiting on a channel once another stage has failed"""
+
+
+class PipelineItem:
+    """A flowchart moving through the stages of the streaming pipeline"""
+    def __init__(self, flowchart_id: int, flowchart: Flowchart):
+        self.id = flowchart_id
+        self.flowchart = flowchart
+        # PNG bytes just rendered, or path of the image rendered by a previous run, None once OCRed
+        self.image: Union[bytes, str, None] = None
+
+
+class Channel:
+    """
+    Bounded queue between two stages: the producer blocks while it is full, so no stage runs more than
+    PIPELINE_QUEUE_SIZE flowcharts ahead of the next one. Both ends give up once the pipeline is aborted.
+    """
+    _CLOSED = object()  # sent by the producer after its last item
+
+    def __init__(self, abort: threading.Event, maxsize: int = PIPELINE_QUEUE_SIZE):
+        self.abort = abort
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item) -> bool:
+        """Send an item, return False if the pipeline was aborted before it could be queued"""
+        while not self.abort.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self):
+        self.put(self._CLOSED)
+
+    def __iter__(self) -> Iterator[PipelineItem]:
+        while True:
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.abort.is_set():
+                    raise PipelineAborted()
+                continue
+            if item is self._CLOSED:
+                return
+            yield item
+
+
+def iter_in_order(items: Iterable[PipelineItem]) -> Iterator[PipelineItem]:
+    """Yield the items by flowchart id, from 0, whatever their arrival order (renders complete out of order)"""
+    pending = {}
+    next_id = 0
+    for item in items:
+        pending[item.id] = item
+        while next_id in pending:
+            yield pending.pop(next_id)
+            next_id += 1
+    if pending:
+        raise ValueError(f"Flowcharts {sorted(pending)[:10]} received without flowchart {next_id}")
+
+
+def generate_stage(chart_num: int, out: Channel):
+    """Generate the flowcharts on the global random state, in order, as the staged pipeline does"""
+    for i, flowchart in iter_flowcharts(chart_num):
+        if not out.put(PipelineItem(i, flowchart)):
+            return
+
+
+def render_stage(chart_num: int, inp: Channel, out: Channel, keep_images: bool):
+    """
+    Render the flowcharts as they are generated, the images rendered by a previous run are passed on at once.
+    The flowchart statistics are saved once all the images are rendered.
+    :param keep_images: whether the PNG bytes are passed on, for the OCR stage
+    """
+    manifest = get_manifest()
+    rendering = {}  # flowchart id -> item waiting for its image
+
+    def iter_ids() -> Iterator[int]:
+        for item in inp:
+            if GEN_IMGS_ON and not manifest.is_done(item.id, PNG_ARTIFACT):
+                rendering[item.id] = item
+                yield item.id
+            else:
+                if GEN_IMGS_ON:
+                    count_images([item.id])
+                item.image = get_img_path(item.id) if keep_images else None
+                if not out.put(item):
+                    return
+
+    def on_image(flowchart_id: int, data: Optional[bytes]):
+        item = rendering.pop(flowchart_id)
+        item.image = data if keep_images else None
+        out.put(item)
+
+    if GEN_IMGS_ON:
+        # the archive storage commits its flowcharts in blocks, the renderers get them from the items
+        if render_imgs(iter_ids(), chart_num, on_image, lambda flowchart_id: rendering[flowchart_id].flowchart):
+            manifest.mark_stage(IMGS_STAGE, chart_num=chart_num)
+    else:
+        for _ in iter_ids():
+            pass
+    # the statistics are complete once the images are counted
+    flowchart_statistics.save(os.path.join(STATS_DIR, FLOWCHART_STATS_FILE_NAME))
+
+
+def iter_ocr_batches(items: Iterable[PipelineItem], out: Channel, store: OcrStore,
+                     store_ids: set) -> Iterator[List[PipelineItem]]:
+    """
+    Batches of OCR_BATCH_SIZE items to OCR, in flowchart order so they are the batches of the staged pipeline.
+    The items already OCRed by a previous run, or without image, are passed on at once.
+    """
+    manifest = get_manifest()
+    batch = []
+    for item in iter_in_order(items):
+        if is_stored(store, manifest, item.id, store_ids) or not manifest.is_done(item.id, PNG_ARTIFACT):
+            item.image = None
+            out.put(item)
+            continue
+        batch.append(item)
+        if len(batch) >= OCR_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_ocr_results(batches: Iterator[List[PipelineItem]], abort: threading.Event,
+                     pool: Optional[Pool], workers: int = 1) -> Iterator[Tuple[List[PipelineItem], List[RawResult]]]:
+    """
+    Raw OCR results of each batch, in order, read from the image bytes (or paths) of the items.
+    :param pool: OCR worker processes, the batches are read in this thread if None
+    :param workers: number of processes of the pool
+    """
+    if OCR_MODE == SIMULATED_OCR:
+        model = OcrErrorModel.load()
+        for batch in batches:
+            yield batch, [model.simulate(item.flowchart, get_flowchart_ocr_rng(item.id)) for item in batch]
+    elif pool is None:
+        for batch in batches:
+            yield batch, read_image_batch([item.image for item in batch])
+    else:
+        # the pool reads the batches from its own thread, they are bounded here like the other queues
+        sent = deque()
+        slots = threading.BoundedSemaphore(workers * OCR_PREFETCH_BATCHES)
+
+        def iter_images() -> Iterator[List[Union[bytes, str]]]:
+            for batch in batches:
+                while not slots.acquire(timeout=0.1):
+                    if abort.is_set():
+                        raise PipelineAborted()
+                sent.append(batch)
+                yield [item.image for item in batch]
+
+        for results in pool.imap(read_image_batch, iter_images()):
+            slots.release()
+            yield sent.popleft(), results
+
+
+def ocr_stage(chart_num: int, inp: Channel, out: Channel, abort: threading.Event):
+    """OCR the images from memory as they are rendered, each batch is committed before its items are passed on"""
+    manifest = get_manifest()
+    if RESUME and manifest.stage_done(OCR_STAGE):
+        for item in inp:
+            item.image = None
+            if not out.put(item):
+                return
+        return
+    manifest.start_stage(OCR_STAGE)
+    workers = OCR_WORKERS if OCR_WORKERS > 0 else (os.cpu_count() or 1)
+    pool = None
+    if OCR_MODE != SIMULATED_OCR and workers > 1:
+        pool = Pool(workers, initializer=_init_ocr_worker,
+                                    initargs=(max(1, (os.cpu_count() or 1) // workers),))
+    st_clk = time.time()
+    ocr_num = 0
+    try:
+        with OcrStore(get_ocr_store_path()) as store, \
+                get_metrics().stage(OCR_STAGE, total=chart_num) as stage:
+            if RESUME:
+                import_previous_ocr_results(store)
+            else:
+                store.clear()
+            store_ids = store.ids()
+            for batch, results in iter_ocr_results(iter_ocr_batches(inp, out, store, store_ids), abort,
+                                                  pool, workers):
+                rows = []
+                for item, raw in zip(batch, results):
+                    node_list = filter_texts(raw)
+                    print(f"Extracted node list from {get_img_path(item.id)}: {node_list}")
+                    content = generate_node_list_content(node_list)
+                    rows.append((item.id, raw, content))
+                    stage.tick(len(content.encode("utf-8")))
+                save_ocr_batch(store, manifest, rows)
+                ocr_num += len(batch)
+                for item in batch:
+                    item.image = None
+                    if not out.put(item):
+                        return
+            stage.count(SKIPPED_COUNTER, chart_num - ocr_num)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    elapsed = time.time() - st_clk
+    print(f"---OCR: {ocr_num} images in {elapsed:.2f} seconds, "
+          f"{ocr_num / elapsed if elapsed > 0 else 0:.2f} images/sec---")
+    manifest.mark_stage(OCR_STAGE, chart_num=chart_num)
+
+
+def build_item_samples(item: Tuple[int, Flowchart], flags: List[Tuple[bool, bool]]) -> List[SampleCollector]:
+    """Samples of a flowchart sent to a worker process with the flowchart itself, see build_flowchart_samples"""
+    return build_flowchart_samples(item[0], flags, item[1])
+
+
+def iter_streamed_flowcharts(inp: Channel) -> Iterator[Tuple[int, Flowchart]]:
+    """(id, flowchart) of the flowcharts leaving the last stage, in flowchart order"""
+    manifest = get_manifest()
+    for item in iter_in_order(inp):
+        # same check as check_integrity, the flowchart was just generated so its .mmd and .pkl are written
+        if not manifest.is_done(item.id, PNG_ARTIFACT):
+            raise ValueError(f"Invalid flowchart ID: {item.id}")
+        yield item.id, item.flowchart
+
+
+def run_streaming_pipeline(chart_num: int = FLOWCHART_NUM):
+    """
+    Generate, render, OCR and build the samples of the flowcharts concurrently: each stage runs in its own
+    thread (samples in the calling thread) with its own workers (RENDER_WORKERS, OCR_WORKERS, SAMPLE_WORKERS),
+    and passes each flowchart to the next stage through a bounded Channel as soon as it is done, with its
+    image bytes in memory, so the run takes about as long as its slowest stage.
+    The flowcharts, images and OCR results are those of the staged pipeline. The samples are built from
+    per-flowchart random streams (as with SAMPLE_WORKERS >= 1, even if it is 0), since the global random state
+    is drawn by the flowchart generation at the same time. The samples are rebuilt unless the whole run is done.
+    """
+    manifest = get_manifest()
+    reset_run(chart_num)
+    variants = get_variants()
+    use_ocr = any(variant.use_ocr for variant in variants)
+    if RESUME and manifest.stage_done(FLOWCHARTS_STAGE) and (manifest.stage_done(IMGS_STAGE) or not GEN_IMGS_ON) \
+            and (manifest.stage_done(OCR_STAGE) or not use_ocr) and manifest.stage_done(SAMPLES_STAGE):
+        print("---Run already completed, skipped---")
+        return
+    manifest.mark_stage(SAMPLES_STAGE, done=False)
+    manifest.start_stage(SAMPLES_STAGE)
+    abort = threading.Event()
+    errors = []
+
+    def run_stage(target: Callable, out: Channel, *args):
+        try:
+            target(*args)
+        except PipelineAborted:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            abort.set()
+        finally:
+            out.close()
+
+    generated = Channel(abort)
+    rendered = Channel(abort)
+    stages = [(generate_stage, generated, chart_num, generated),
+              (render_stage, rendered, chart_num, generated, rendered, use_ocr)]
+    last = rendered
+    if use_ocr:
+        last = Channel(abort)
+        stages.append((ocr_stage, last, chart_num, rendered, last, abort))
+    flags = [variant.flags for variant in variants]
+    # the sample workers are forked before the stage threads are started
+    pool = Pool(SAMPLE_WORKERS) if SAMPLE_WORKERS > 1 else None
+    threads = [threading.Thread(target=run_stage, args=stage, daemon=True) for stage in stages]
+    try:
+        for thread in threads:
+            thread.start()
+        if pool is not None:
+            # imap keeps the flowchart order whatever the worker finishing order
+            sample_collectors = pool.imap(partial(build_item_samples, flags=flags), iter_streamed_flowcharts(last))
+        else:
+            sample_collectors = (build_flowchart_samples(i, flags, flowchart)
+                                 for i, flowchart in iter_streamed_flowcharts(last))
+        gen_samples(chart_num, variants, sample_collectors)
+    except PipelineAborted:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        abort.set()
+    finally:
+        for thread in threads:
+            thread.join()
+        if pool is not None:
+            pool.terminate()
+    if errors:
+        raise errors[0]
+    for variant in variants:
+        variant.statistics.save(os.path.join(variant.stats_dir, CONV_STATS_FILE_NAME))
+    manifest.mark_stage(SAMPLES_STAGE, chart_num=chart_num)
@@ -3,13 +3,24 @@ import numpy as np
 
 from gen.gen_flowcharts import generate_flowcharts
 from gen.gen_ocr_contents import generate_ocr_contents
-from gen.gen_conversations import gen_samples_and_qas
-from constant import USE_OCR
+from gen.gen_conversations import gen_samples_and_qas, get_variants
+from gen.metrics import get_metrics
+from gen.gen_shards import gen_shards
+from gen.pipeline import run_streaming_pipeline
+from constant import SEED, PIPELINE_MODE, STREAMING_PIPELINE, SHARDS_ON
 
 if __name__ == "__main__":
-    random.seed(42)  # Set a fixed seed for reproducibility
-    np.random.seed(42)  # Set a fixed seed for reproducibility
-    generate_flowcharts()
-    if USE_OCR:
-        generate_ocr_contents()
-    gen_samples_and_qas()
+    random.seed(SEED)  # Set a fixed seed for reproducibility
+    np.random.seed(SEED)  # Set a fixed seed for reproducibility
+    if PIPELINE_MODE == STREAMING_PIPELINE:
+        run_streaming_pipeline()
+    else:
+        generate_flowcharts()
+        if any(variant.use_ocr for variant in get_variants()):  # OCR once for all the variants using it
+            generate_ocr_contents()
+        gen_samples_and_qas()
+    if SHARDS_ON:
+        gen_shards()
+    metrics_path = get_metrics().save()
+    if metrics_path is not None:
+        print(f"---Metrics saved to {metrics_path}---")
@@ -0,0 +1,43 @@
+from typing import Callable
+
+from constant import RENDER_BACKEND
+
+# available render backends
+MMDC_BACKEND = "mmdc"  # one mmdc process per image
+SERVER_BACKEND = "server"  # one long-lived Node renderer per worker
+PIL_BACKEND = "pil"  # in-process layered layout rasterized with Pillow, no Node or network needed
+
+RENDER_BACKENDS = [MMDC_BACKEND, SERVER_BACKEND, PIL_BACKEND]
+
+
+def get_renderer_factory(backend: str = RENDER_BACKEND) -> Callable:
+    """
+    Get a callable creating one renderer of the given backend, to be used by RenderPool.
+    The renderers encode their images with the settings of ImageEncoder (IMG_FORMAT, IMG_MAX_SIDE...).
+    :param backend: name of the backend, one of RENDER_BACKENDS
+    """
+    if backend == PIL_BACKEND:
+        # encodes its images itself, see PilRenderer.render
+        from render.pil_renderer import PilRenderer
+        return PilRenderer
+    if backend == MMDC_BACKEND:
+        from render.mmdc import MmdcRenderer
+        factory = MmdcRenderer
+    elif backend == SERVER_BACKEND:
+        from render.mmd_server import MermaidServerRenderer
+        factory = MermaidServerRenderer
+    else:
+        raise ValueError(f"Unknown render backend: {backend}")
+    from render.encode import ImageEncoder, EncodingRendererFactory
+    return factory if ImageEncoder().is_identity else EncodingRendererFactory(factory)
+
+
+def get_render_pool(backend: str = RENDER_BACKEND):
+    """
+    Get a pool running renderers of the given backend.
+    Backends driving external processes use threads, in-process backends use worker processes.
+    """
+    from render.pool import RenderPool, ProcessRenderPool
+    if backend == PIL_BACKEND:
+        return ProcessRenderPool(get_renderer_factory(backend))
+    return RenderPool(get_renderer_factory(backend))
@@ -0,0 +1,116 @@
+import os
+from typing import Callable, Optional, Tuple
+
+from PIL import Image, features
+
+from constant import IMG_FORMAT, IMG_MAX_SIDE, IMG_MAX_PIXELS, IMG_COLOR_MODE, IMG_PALETTE_SIZE, \
+    IMG_PNG_COMPRESS_LEVEL, PNG_FORMAT, WEBP_FORMAT, RGB_COLOR_MODE, GRAY_COLOR_MODE, PALETTE_COLOR_MODE
+from render.pool import RENDER_OK, RENDER_FAILED
+
+
+class ImageEncoder:
+    """
+    Output size and encoding of the rendered images, applied once in the render stage:
+    downscaling to IMG_MAX_SIDE/IMG_MAX_PIXELS, grayscale or palette colors, PNG compression level or lossless WebP.
+    With the default settings it is the identity and the files of the renderers are kept as they are.
+    """
+    def __init__(self, img_format: str = IMG_FORMAT, max_side: int = IMG_MAX_SIDE, max_pixels: int = IMG_MAX_PIXELS,
+                 color_mode: str = IMG_COLOR_MODE, palette_size: int = IMG_PALETTE_SIZE,
+                 compress_level: Optional[int] = IMG_PNG_COMPRESS_LEVEL):
+        """
+        :param img_format: PNG_FORMAT or WEBP_FORMAT
+        :param max_side: max number of pixels of the longest side, 0 for no limit
+        :param max_pixels: max width * height, 0 for no limit
+        :param color_mode: RGB_COLOR_MODE, GRAY_COLOR_MODE or PALETTE_COLOR_MODE
+        :param palette_size: number of colors of PALETTE_COLOR_MODE
+        :param compress_level: zlib level of the PNG images, None for the default of Pillow
+        """
+        if img_format not in (PNG_FORMAT, WEBP_FORMAT):
+            raise ValueError(f"Unknown image format: {img_format}")
+        if img_format == WEBP_FORMAT and not features.check("webp"):
+            raise ValueError("Pillow was built without WebP support")
+        if color_mode not in (RGB_COLOR_MODE, GRAY_COLOR_MODE, PALETTE_COLOR_MODE):
+            raise ValueError(f"Unknown image color mode: {color_mode}")
+        self.img_format = img_format
+        self.max_side = max_side
+        self.max_pixels = max_pixels
+        self.color_mode = color_mode
+        self.palette_size = palette_size
+        self.compress_level = compress_level
+
+    @property
+    def is_identity(self) -> bool:
+        """Whether the images are saved as rendered"""
+        return self.img_format == PNG_FORMAT and self.max_side <= 0 and self.max_pixels <= 0 \
+            and self.color_mode == RGB_COLOR_MODE and self.compress_level is None
+
+    def target_size(self, width: int, height: int) -> Tuple[int, int]:
+        """Size of an image of the given size once downscaled, never upscaled"""
+        ratio = 1.0
+        if self.max_side > 0:
+            ratio = min(ratio, self.max_side / max(width, height))
+        if self.max_pixels > 0:
+            ratio = min(ratio, (self.max_pixels / (width * height)) ** 0.5)
+        if ratio >= 1.0:
+            return width, height
+        return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+    def convert(self, image: Image.Image) -> Image.Image:
+        """Downscale the image and convert its colors"""
+        image = image.convert("RGB") if image.mode not in ("RGB", "L") else image
+        size = self.target_size(*image.size)
+        if size != image.size:
+            image = image.resize(size, Image.LANCZOS)
+        if self.color_mode == GRAY_COLOR_MODE:
+            return image.convert("L")
+        if self.color_mode == PALETTE_COLOR_MODE:
+            # flat diagrams have few colors, anti-aliased edges are mapped to the nearest one without dithering
+            return image.convert("RGB").quantize(colors=self.palette_size, dither=Image.NONE)
+        return image
+
+    def save(self, image: Image.Image, output_path: str):
+        image = self.convert(image)
+        if self.img_format == WEBP_FORMAT:
+            image.save(output_path, "WEBP", lossless=True, quality=100, method=4)
+        elif self.compress_level is not None:
+            image.save(output_path, "PNG", compress_level=self.compress_level)
+        else:
+            image.save(output_path, "PNG")
+
+    def encode_file(self, input_path: str, output_path: str):
+        """Encode the image rendered to input_path into output_path"""
+        with Image.open(input_path) as image:
+            image.load()
+            self.save(image, output_path)
+
+
+class EncodingRenderer:
+    """Renders to a temporary PNG file with another renderer, then encodes it to the output path"""
+    def __init__(self, renderer, encoder: ImageEncoder):
+        self.renderer = renderer
+        self.encoder = encoder
+
+    def render(self, input_path: str, output_path: str) -> str:
+        raw_path = f"{output_path}.raw.png"
+        status = self.renderer.render(input_path, raw_path)
+        try:
+            if status == RENDER_OK:
+                self.encoder.encode_file(raw_path, output_path)
+        except (OSError, ValueError):
+            status = RENDER_FAILED
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+        return status
+
+    def close(self):
+        self.renderer.close()
+
+
+class EncodingRendererFactory:
+    """Picklable factory of EncodingRenderer, see get_renderer_factory()"""
+    def __init__(self, make_renderer: Callable):
+        self.make_renderer = make_renderer
+
+    def __call__(self) -> EncodingRenderer:
+        return EncodingRenderer(self.make_renderer(), ImageEncoder())
@@ -0,0 +1,158 @@
+from typing import Dict, List, Tuple
+
+Point = Tuple[float, float]
+
+
+class Layout:
+    def __init__(self, centers: List[Point], edge_paths: List[Tuple[int, int, str, List[Point]]],
+                 width: float, height: float):
+        self.centers = centers  # center of each node, indexed by node id
+        self.edge_paths = edge_paths  # (first_id, second_id, condition, points from first to second)
+        self.width = width
+        self.height = height
+
+
+def assign_layers(node_num: int, edges: List[Tuple[int, int]]) -> List[int]:
+    """
+    Longest-path layering. Every edge must go from a lower to a higher node id,
+    so iterating over node ids in order visits nodes in topological order.
+    """
+    out_edges = [[] for _ in range(node_num)]
+    for first_id, second_id in edges:
+        out_edges[first_id].append(second_id)
+    layers = [0] * node_num
+    for node_id in range(node_num):
+        for next_id in out_edges[node_id]:
+            layers[next_id] = max(layers[next_id], layers[node_id] + 1)
+    return layers
+
+
+def order_layers(layer_members: List[List[int]], preds: Dict[int, List[int]], succs: Dict[int, List[int]],
+                 sweeps: int) -> List[List[int]]:
+    """Barycenter heuristic, alternating downward and upward sweeps to reduce edge crossings."""
+    for sweep in range(sweeps):
+        downward = sweep % 2 == 0
+        layer_ids = range(1, len(layer_members)) if downward else range(len(layer_members) - 2, -1, -1)
+        for layer_id in layer_ids:
+            fixed = layer_members[layer_id - 1] if downward else layer_members[layer_id + 1]
+            index = {v: i for i, v in enumerate(fixed)}
+            neighbors = preds if downward else succs
+            barycenters = {}
+            for i, v in enumerate(layer_members[layer_id]):
+                adjacent = [index[u] for u in neighbors.get(v, []) if u in index]
+                barycenters[v] = sum(adjacent) / len(adjacent) if adjacent else i
+            layer_members[layer_id] = sorted(layer_members[layer_id], key=lambda v: barycenters[v])
+    return layer_members
+
+
+def place_layer(members: List[int], sizes: Dict[int, float], desired: Dict[int, float], gap: float) -> Dict[int, float]:
+    """Place the members of one layer as close as possible to their desired positions, keeping order and gaps."""
+    positions = {}
+    prev = None
+    for v in members:
+        pos = desired[v]
+        if prev is not None:
+            pos = max(pos, positions[prev] + (sizes[prev] + sizes[v]) / 2 + gap)
+        positions[v] = pos
+        prev = v
+    # shift back so the layer stays centered on its desired positions
+    shift = (sum(desired[v] for v in members) - sum(positions.values())) / len(members)
+    return {v: pos + shift for v, pos in positions.items()}
+
+
+def layered_layout(node_num: int, edges: List[Tuple[int, int, str]], node_sizes: List[Tuple[float, float]],
+                   direction: str = "LR", layer_gap: float = 50, node_gap: float = 30, dummy_size: float = 10,
+                   margin: float = 10, sweeps: int = 4) -> Layout:
+    """
+    Sugiyama-style layered layout.
+    :param node_num: number of nodes
+    :param edges: list of (first_id, second_id, condition), as in Flowchart.edges
+    :param node_sizes: (width, height) of each node
+    :param direction: "LR" (layers from left to right) or "TB" (layers from top to bottom)
+    :param layer_gap: space between two layers
+    :param node_gap: space between two nodes of the same layer
+    :param dummy_size: space taken by an edge crossing a layer
+    :param margin: space around the drawing
+    :param sweeps: number of crossing reduction sweeps
+    """
+    horizontal = direction == "LR"
+    # size along the layer axis and along the order axis
+    rank_size = [w if horizontal else h for w, h in node_sizes]
+    order_size = {v: (h if horizontal else w) for v, (w, h) in enumerate(node_sizes)}
+
+    # 1. make the graph acyclic by orienting every edge from the lower to the higher node id
+    oriented = []
+    for first_id, second_id, condition in edges:
+        if first_id != second_id:
+            oriented.append((min(first_id, second_id), max(first_id, second_id)))
+    layers = assign_layers(node_num, oriented)
+
+    # 2. split long edges with dummy vertices so every segment joins two adjacent layers
+    layer_members = [[] for _ in range(max(layers) + 1 if layers else 0)]
+    for v in range(node_num):
+        layer_members[layers[v]].append(v)
+    preds, succs = {}, {}
+    chains = []  # vertex chain of each edge in `edges`, None for self loops
+    next_vertex = node_num
+    for first_id, second_id, condition in edges:
+        if first_id == second_id:
+            chains.append(None)
+            continue
+        low, high = min(first_id, second_id), max(first_id, second_id)
+        chain = [low]
+        for layer_id in range(layers[low] + 1, layers[high]):
+            layer_members[layer_id].append(next_vertex)
+            order_size[next_vertex] = dummy_size
+            chain.append(next_vertex)
+            next_vertex += 1
+        chain.append(high)
+        for u, v in zip(chain, chain[1:]):
+            succs.setdefault(u, []).append(v)
+            preds.setdefault(v, []).append(u)
+        chains.append(chain if first_id == low else chain[::-1])
+
+    # 3. reduce crossings
+    layer_members = order_layers(layer_members, preds, succs, sweeps)
+
+    # 4. assign coordinates along the order axis, then pull vertices towards their neighbors
+    order_pos = {}
+    for members in layer_members:
+        initial, offset = {}, 0.0
+        for v in members:
+            initial[v] = offset + order_size[v] / 2
+            offset += order_size[v] + node_gap
+        order_pos.update(place_layer(members, order_size, {v: p - offset / 2 for v, p in initial.items()}, node_gap))
+    for sweep in range(sweeps):
+        for members in (layer_members if sweep % 2 == 0 else layer_members[::-1]):
+            desired = {}
+            for v in members:
+                adjacent = preds.get(v, []) + succs.get(v, [])
+                desired[v] = sum(order_pos[u] for u in adjacent) / len(adjacent) if adjacent else order_pos[v]
+            order_pos.update(place_layer(members, order_size, desired, node_gap))
+
+    # 5. assign coordinates along the layer axis
+    layer_pos, offset = [], 0.0
+    for members in layer_members:
+        thickness = max((rank_size[v] for v in members if v < node_num), default=dummy_size)
+        layer_pos.append(offset + thickness / 2)
+        offset += thickness + layer_gap
+    rank_pos = {v: layer_pos[layer_id] for layer_id, members in enumerate(layer_members) for v in members}
+
+    # 6. translate everything into image coordinates
+    min_order = min((order_pos[v] - order_size[v] / 2 for v in order_pos), default=0)
+    max_order = max((order_pos[v] + order_size[v] / 2 for v in order_pos), default=0)
+    total_rank = offset - layer_gap if layer_members else 0
+
+    def to_point(v: int) -> Point:
+        r, o = rank_pos[v] + margin, order_pos[v] - min_order + margin
+        return (r, o) if horizontal else (o, r)
+
+    centers = [to_point(v) for v in range(node_num)]
+    edge_paths = []
+    for (first_id, second_id, condition), chain in zip(edges, chains):
+        if chain is not None:
+            edge_paths.append((first_id, second_id, condition, [to_point(v) for v in chain]))
+    extent_rank = total_rank + 2 * margin
+    extent_order = max_order - min_order + 2 * margin
+    width, height = (extent_rank, extent_order) if horizontal else (extent_order, extent_rank)
+    return Layout(centers, edge_paths, width, height)
@@ -0,0 +1,83 @@
+// Long-lived Mermaid renderer used by render/mmd_server.py.
+// One headless browser is launched at startup and reused for every diagram.
+//
+// Protocol (one JSON object per line):
+//   stdout on startup: {"ready": true}
+//   stdin:  {"id": 0, "definition": "flowchart LR\n...", "output": "/abs/path.png"}  ("output" is optional)
+//   stdout: {"id": 0, "ok": true}  or  {"id": 0, "ok": true, "png": "<base64>"} when no output is given
+//           {"id": 0, "ok": false, "error": "..."}
+//
+// Usage: node mmd_server.mjs [scale] [puppeteer-config.json]
+import { execSync } from "node:child_process";
+import { existsSync, readFileSync, writeFileSync } from "node:fs";
+import { dirname, join } from "node:path";
+import { pathToFileURL } from "node:url";
+import readline from "node:readline";
+
+function pickEntry(entry) {
+  if (typeof entry === "string") return entry;
+  for (const key of ["import", "default", "node"]) {
+    if (entry && entry[key]) return pickEntry(entry[key]);
+  }
+  return null;
+}
+
+// Find the ESM entry of a package in the given node_modules directories
+// (mmdc is usually installed with `npm install -g`, which plain `import` does not see).
+function resolvePackage(name, dirs) {
+  for (const dir of dirs) {
+    const pkgDir = join(dir, name);
+    const pkgJson = join(pkgDir, "package.json");
+    if (!existsSync(pkgJson)) continue;
+    const pkg = JSON.parse(readFileSync(pkgJson, "utf8"));
+    const exports = pkg.exports && (pkg.exports["."] || pkg.exports);
+    const entry = pickEntry(exports) || pkg.module || pkg.main || "index.js";
+    return { dir: pkgDir, url: pathToFileURL(join(pkgDir, entry)).href };
+  }
+  throw new Error(`Cannot find package ${name} in ${dirs.join(", ")}`);
+}
+
+function globalRoot() {
+  try {
+    return execSync("npm root -g").toString().trim();
+  } catch (err) {
+    return "";
+  }
+}
+
+const scale = Number(process.argv[2] || 4);
+const puppeteerConfig = process.argv[3] ? JSON.parse(readFileSync(process.argv[3], "utf8")) : {};
+
+const searchDirs = [join(process.cwd(), "node_modules"), join(dirname(process.argv[1]), "node_modules"), globalRoot()];
+const cli = resolvePackage("@mermaid-js/mermaid-cli", searchDirs);
+const { renderMermaid } = await import(cli.url);
+const puppeteerModule = await import(resolvePackage("puppeteer", [join(cli.dir, "node_modules"), ...searchDirs]).url);
+const puppeteer = puppeteerModule.default || puppeteerModule;
+
+const browser = await puppeteer.launch({ headless: true, ...puppeteerConfig });
+process.stdout.write(JSON.stringify({ ready: true }) + "\n");
+
+const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+for await (const line of rl) {
+  if (!line.trim()) continue;
+  let request = null;
+  try {
+    request = JSON.parse(line);
+    // same defaults as `mmdc -s {scale}`
+    const { data } = await renderMermaid(browser, request.definition, "png", {
+      viewport: { width: 800, height: 600, deviceScaleFactor: scale },
+      backgroundColor: "white",
+      mermaidConfig: { theme: "default" },
+    });
+    const response = { id: request.id, ok: true };
+    if (request.output) {
+      writeFileSync(request.output, data);
+    } else {
+      response.png = Buffer.from(data).toString("base64");
+    }
+    process.stdout.write(JSON.stringify(response) + "\n");
+  } catch (err) {
+    process.stdout.write(JSON.stringify({ id: request ? request.id : null, ok: false, error: String(err) }) + "\n");
+  }
+}
+await browser.close();
@@ -0,0 +1,145 @@
+import base64
+import json
+import os
+import queue
+import subprocess
+import threading
+from typing import Optional, Tuple
+
+import psutil
+
+from constant import NODE_BIN, RENDER_TIMEOUT, RENDER_SERVER_RECYCLE_JOBS, RENDER_SERVER_MAX_RSS_MB, \
+    RENDER_SERVER_STARTUP_TIMEOUT, RENDER_SCALE
+from render.mmdc import kill_process_tree
+from render.pool import RENDER_OK, RENDER_FAILED, RENDER_TIMEOUT_EXPIRED
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mmd_server.mjs")
+
+
+class MermaidServerRenderer:
+    """
+    Renders many Mermaid scripts with one long-lived Node process (render/mmd_server.mjs),
+    so the headless browser is started once instead of once per image.
+    The process is recycled after a number of jobs or when its memory grows above a limit.
+    """
+    def __init__(self, timeout: float = RENDER_TIMEOUT, recycle_jobs: int = RENDER_SERVER_RECYCLE_JOBS,
+                 max_rss_mb: float = RENDER_SERVER_MAX_RSS_MB, node: str = NODE_BIN, scale: int = RENDER_SCALE,
+                 puppeteer_config: Optional[str] = None):
+        """
+        :param timeout: per-image timeout in seconds, the server is killed and restarted when it expires
+        :param recycle_jobs: restart the server after this many images, 0 to disable
+        :param max_rss_mb: restart the server when the RSS of its process tree exceeds this, 0 to disable
+        :param node: node executable
+        :param scale: device scale factor, same as `mmdc -s`
+        :param puppeteer_config: optional puppeteer config json file, same as `mmdc -p`
+        """
+        self.timeout = timeout
+        self.recycle_jobs = recycle_jobs
+        self.max_rss_mb = max_rss_mb
+        self.node = node
+        self.scale = scale
+        self.puppeteer_config = puppeteer_config
+        self.proc = None
+        self._lines = None
+        self._job_id = 0
+        self._served = 0  # jobs served by the current process
+
+    def start(self):
+        cmd = [self.node, SERVER_SCRIPT, str(self.scale)]
+        if self.puppeteer_config:
+            cmd.append(self.puppeteer_config)
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, start_new_session=True)
+        self._lines = queue.Queue()
+        self._served = 0
+        threading.Thread(target=self._read_lines, args=(self.proc.stdout, self._lines), daemon=True).start()
+        ready = self._next_response(RENDER_SERVER_STARTUP_TIMEOUT)
+        if ready is None or not ready.get("ready"):
+            self.close()
+            raise RuntimeError("Failed to start the Mermaid render server")
+
+    @staticmethod
+    def _read_lines(stream, lines: queue.Queue):
+        for line in iter(stream.readline, b""):
+            lines.put(line)
+        lines.put(None)  # EOF, the server exited
+
+    def _next_response(self, timeout: float) -> Optional[dict]:
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if line is None:
+            return None
+        return json.loads(line)
+
+    def rss_mb(self) -> float:
+        """Resident memory of the server and all its children (the browser processes) in MB."""
+        try:
+            root = psutil.Process(self.proc.pid)
+            procs = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0.0
+        rss = 0
+        for proc in procs:
+            try:
+                rss += proc.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return rss / (1024 * 1024)
+
+    def _maybe_recycle(self):
+        if self.recycle_jobs > 0 and self._served >= self.recycle_jobs:
+            self.close()
+        elif self.max_rss_mb > 0 and self.rss_mb() > self.max_rss_mb:
+            self.close()
+
+    def request(self, definition: str, output_path: Optional[str] = None) -> Tuple[str, Optional[bytes]]:
+        """
+        Render one Mermaid script.
+        :param definition: Mermaid script, e.g. Flowchart.to_mmd()
+        :param output_path: where to write the png, if None the png bytes are returned instead
+        :return: (status, png bytes or None)
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            try:
+                self.start()
+            except (OSError, RuntimeError):
+                # node missing or the server never ready, the next request tries again
+                return RENDER_FAILED, None
+        self._job_id += 1
+        message = {"id": self._job_id, "definition": definition}
+        if output_path is not None:
+            message["output"] = os.path.abspath(output_path)
+        try:
+            self.proc.stdin.write((json.dumps(message) + "\n").encode("utf-8"))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            return RENDER_FAILED, None
+        response = self._next_response(self.timeout)
+        if response is None:
+            # timed out or crashed, the next request starts a fresh server
+            self.close()
+            return RENDER_TIMEOUT_EXPIRED, None
+        self._served += 1
+        self._maybe_recycle()
+        if not response.get("ok"):
+            return RENDER_FAILED, None
+        png = base64.b64decode(response["png"]) if "png" in response else None
+        return RENDER_OK, png
+
+    def render(self, input_path: str, output_path: str) -> str:
+        with open(input_path, "r") as f:
+            definition = f.read()
+        status, _ = self.request(definition, output_path)
+        if status == RENDER_OK and not os.path.exists(output_path):
+            return RENDER_FAILED
+        return status
+
+    def close(self):
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            kill_process_tree(self.proc)
+        self.proc = None
@@ -0,0 +1,62 @@
+import os
+import signal
+import subprocess
+from typing import List, Optional
+
+from constant import MMDC_BIN, RENDER_TIMEOUT, RENDER_SCALE
+from render.pool import RENDER_OK, RENDER_FAILED, RENDER_TIMEOUT_EXPIRED
+
+
+def kill_process_tree(proc: subprocess.Popen):
+    """Kill a process started with start_new_session=True together with all its children (e.g. Chromium)."""
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+    proc.wait()
+
+
+def run_mmdc(input_path: str, output_path: str, timeout: float, mmdc: str = MMDC_BIN,
+             extra_args: Optional[List[str]] = None) -> str:
+    """
+    Render a single .mmd file with mmdc.
+    :param input_path: path of the Mermaid script
+    :param output_path: path of the image to generate
+    :param timeout: seconds before the whole mmdc process group is killed
+    :param mmdc: mmdc executable, can be replaced by a fake script for testing
+    :param extra_args: extra mmdc arguments, defaults to ["-s", str(RENDER_SCALE), "-q"]
+    :return: RENDER_OK, RENDER_FAILED or RENDER_TIMEOUT_EXPIRED
+    """
+    args = extra_args if extra_args is not None else ["-s", str(RENDER_SCALE), "-q"]
+    try:
+        # an image left by a previous attempt or run must not pass for the output of this one
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        proc = subprocess.Popen([mmdc, "-i", input_path, "-o", output_path] + args,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                start_new_session=True)
+    except OSError:
+        return RENDER_FAILED
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(proc)
+        return RENDER_TIMEOUT_EXPIRED
+    return RENDER_OK if proc.returncode == 0 and os.path.exists(output_path) else RENDER_FAILED
+
+
+class MmdcRenderer:
+    """Starts one mmdc process (and one headless browser) per image."""
+    def __init__(self, timeout: float = RENDER_TIMEOUT, mmdc: str = MMDC_BIN, extra_args: Optional[List[str]] = None):
+        self.timeout = timeout
+        self.mmdc = mmdc
+        self.extra_args = extra_args
+
+    def render(self, input_path: str, output_path: str) -> str:
+        return run_mmdc(input_path, output_path, self.timeout, self.mmdc, self.extra_args)
+
+    def close(self):
+        pass
@@ -0,0 +1,159 @@
+import math
+import os
+from typing import List, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from constant import NORMAL_TYPE, PIL_RENDER_SCALE
+from flowchart.flowchart import Flowchart
+from render.encode import ImageEncoder
+from render.layout import Layout, Point, layered_layout
+from render.pool import RENDER_OK, RENDER_FAILED
+
+# colors of the default Mermaid theme
+BACKGROUND_COLOR = "white"
+NODE_FILL_COLOR = "#ECECFF"
+NODE_STROKE_COLOR = "#9370DB"
+TEXT_COLOR = "#333333"
+EDGE_COLOR = "#333333"
+LABEL_FILL_COLOR = "#E8E8E8"
+
+FONT_SIZE = 16
+NODE_PADDING = (15, 10)  # horizontal and vertical padding around node names
+
+
+def load_font(size: int) -> ImageFont.ImageFont:
+    for name in ("DejaVuSans.ttf", "Arial.ttf", "LiberationSans-Regular.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:  # Pillow < 10.1
+        return ImageFont.load_default()
+
+
+def read_direction(mmd_path: str) -> str:
+    """Read the direction ("LR" or "TB") from the first line of a Mermaid script."""
+    with open(mmd_path, "r") as f:
+        header = f.readline().split()
+    return header[1] if len(header) > 1 else "LR"
+
+
+class PilRenderer:
+    """
+    Renders a Flowchart in-process: layered layout in pure Python and rasterization with Pillow.
+    Round boxes are used for normal nodes and diamonds for decision nodes, like the Mermaid scripts.
+    """
+    def __init__(self, scale: float = PIL_RENDER_SCALE, encoder: ImageEncoder = None):
+        """
+        :param scale: scale of the drawing, 1 draws 16px fonts like Mermaid
+        :param encoder: output size and encoding of the images, see ImageEncoder
+        """
+        self.scale = scale
+        self.font = load_font(round(FONT_SIZE * scale))
+        self.encoder = encoder if encoder is not None else ImageEncoder()
+
+    def text_size(self, text: str) -> Tuple[float, float]:
+        left, top, right, bottom = self.font.getbbox(text)
+        return right - left, bottom - top
+
+    def node_size(self, name: str, node_type: int) -> Tuple[float, float]:
+        text_w, text_h = self.text_size(name)
+        pad_x, pad_y = NODE_PADDING[0] * self.scale, NODE_PADDING[1] * self.scale
+        if node_type == NORMAL_TYPE:
+            return text_w + 2 * pad_x, text_h + 2 * pad_y
+        # the diamond must contain the text box
+        return 2 * (text_w / 2 + pad_x) + text_h + 2 * pad_y, 2 * (text_h / 2 + pad_y) + text_w / 2 + pad_x
+
+    @staticmethod
+    def clip(center: Point, size: Tuple[float, float], node_type: int, toward: Point) -> Point:
+        """Intersection of the segment center->toward with the border of the node shape."""
+        dx, dy = toward[0] - center[0], toward[1] - center[1]
+        if dx == 0 and dy == 0:
+            return center
+        half_w, half_h = size[0] / 2, size[1] / 2
+        if node_type == NORMAL_TYPE:
+            t = min(half_w / abs(dx) if dx else math.inf, half_h / abs(dy) if dy else math.inf)
+        else:
+            t = 1 / (abs(dx) / half_w + abs(dy) / half_h)
+        t = min(t, 1.0)
+        return center[0] + dx * t, center[1] + dy * t
+
+    def draw_arrow(self, draw: ImageDraw.ImageDraw, start: Point, end: Point):
+        length = 8 * self.scale
+        angle = math.atan2(end[1] - start[1], end[0] - start[0])
+        left = (end[0] - length * math.cos(angle - math.pi / 7), end[1] - length * math.sin(angle - math.pi / 7))
+        right = (end[0] - length * math.cos(angle + math.pi / 7), end[1] - length * math.sin(angle + math.pi / 7))
+        draw.polygon([end, left, right], fill=EDGE_COLOR)
+
+    def draw_edge(self, draw: ImageDraw.ImageDraw, points: List[Point], condition: str):
+        draw.line(points, fill=EDGE_COLOR, width=max(1, round(1.5 * self.scale)), joint="curve")
+        self.draw_arrow(draw, points[-2], points[-1])
+        if condition != "":
+            # label in the middle of the edge
+            mid = len(points) // 2
+            x, y = (points[mid - 1][0] + points[mid][0]) / 2, (points[mid - 1][1] + points[mid][1]) / 2
+            text_w, text_h = self.text_size(condition)
+            pad = 2 * self.scale
+            draw.rectangle([x - text_w / 2 - pad, y - text_h / 2 - pad, x + text_w / 2 + pad, y + text_h / 2 + pad],
+                           fill=LABEL_FILL_COLOR)
+            draw.text((x, y), condition, fill=TEXT_COLOR, font=self.font, anchor="mm")
+
+    def draw_node(self, draw: ImageDraw.ImageDraw, center: Point, size: Tuple[float, float], name: str, node_type: int):
+        x, y = center
+        half_w, half_h = size[0] / 2, size[1] / 2
+        stroke = max(1, round(self.scale))
+        if node_type == NORMAL_TYPE:
+            draw.rounded_rectangle([x - half_w, y - half_h, x + half_w, y + half_h], radius=5 * self.scale,
+                                   fill=NODE_FILL_COLOR, outline=NODE_STROKE_COLOR, width=stroke)
+        else:
+            draw.polygon([(x, y - half_h), (x + half_w, y), (x, y + half_h), (x - half_w, y)],
+                         fill=NODE_FILL_COLOR, outline=NODE_STROKE_COLOR, width=stroke)
+        draw.text((x, y), name, fill=TEXT_COLOR, font=self.font, anchor="mm")
+
+    def layout(self, flowchart: Flowchart, direction: str) -> Tuple[Layout, List[Tuple[float, float]]]:
+        sizes = [self.node_size(name, node_type) for name, node_type in flowchart.nodes]
+        layout = layered_layout(flowchart.node_num, flowchart.edges, sizes, direction,
+                                layer_gap=50 * self.scale, node_gap=30 * self.scale,
+                                dummy_size=10 * self.scale, margin=10 * self.scale)
+        return layout, sizes
+
+    def draw(self, flowchart: Flowchart, direction: str = "LR") -> Image.Image:
+        """Draw the flowchart, direction is "LR" or "TB" like in Flowchart.to_mmd()"""
+        layout, sizes = self.layout(flowchart, direction)
+        image = Image.new("RGB", (max(1, math.ceil(layout.width)), max(1, math.ceil(layout.height))),
+                          BACKGROUND_COLOR)
+        draw = ImageDraw.Draw(image)
+        for first_id, second_id, condition, points in layout.edge_paths:
+            points = list(points)
+            points[0] = self.clip(points[0], sizes[first_id], flowchart.nodes[first_id][1], points[1])
+            points[-1] = self.clip(points[-1], sizes[second_id], flowchart.nodes[second_id][1], points[-2])
+            self.draw_edge(draw, points, condition)
+        for node_id, (name, node_type) in enumerate(flowchart.nodes):
+            self.draw_node(draw, layout.centers[node_id], sizes[node_id], name, node_type)
+        return image
+
+    def render(self, input_path: str, output_path: str, flowchart: Flowchart = None) -> str:
+        """
+        Render the flowchart of a .mmd file of the current run, loaded from the run storage if not given.
+        The direction is read from the Mermaid script so the image matches it.
+        The image is encoded in memory, without intermediate file.
+        A flowchart missing from the run storage fails its render.
+        """
+        from utils import load_flowchart
+        try:
+            if flowchart is None:
+                flowchart = load_flowchart(int(os.path.basename(input_path)[:-len(".mmd")]))
+            image = self.draw(flowchart, read_direction(input_path))
+            if self.encoder.is_identity:
+                image.save(output_path)
+            else:
+                self.encoder.save(image, output_path)
+        except (OSError, ValueError, IndexError):
+            return RENDER_FAILED
+        return RENDER_OK if os.path.exists(output_path) else RENDER_FAILED
+
+    def close(self):
+        pass
@@ -0,0 +1,166 @@
+import logging
+import os
+import multiprocessing
+import threading
+import queue
+import time
+from typing import Callable, Iterable, List, Tuple
+
+from constant import RENDER_WORKERS, RENDER_QUEUE_SIZE, RENDER_RETRIES
+
+# render result status
+RENDER_OK = "ok"
+RENDER_FAILED = "failed"
+RENDER_TIMEOUT_EXPIRED = "timeout"
+
+
+class RenderResult:
+    def __init__(self, name: str, output_path: str, status: str, attempts: int, elapsed: float = 0.0):
+        self.name = name  # file name of the .mmd script, used in log lines
+        self.output_path = output_path
+        self.status = status  # RENDER_OK, RENDER_FAILED or RENDER_TIMEOUT_EXPIRED
+        self.attempts = attempts  # number of render attempts, including the last one
+        self.elapsed = elapsed  # seconds spent rendering, all attempts included
+
+
+def render_with_retries(renderer, retries: int, name: str, input_path: str, output_path: str,
+                        *args) -> RenderResult:
+    """
+    Render one job, retrying up to `retries` times. Extra job fields are passed on to the renderer.
+    An exception of the renderer fails the attempt, so a broken renderer cannot stop its worker
+    and leave the job queue full.
+    """
+    status = RENDER_FAILED
+    attempts = 0
+    st_clk = time.perf_counter()
+    while attempts <= retries:
+        attempts += 1
+        try:
+            status = renderer.render(input_path, output_path, *args)
+        except Exception:
+            logging.exception(f"Renderer error for {name}")
+            status = RENDER_FAILED
+        if status == RENDER_OK:
+            break
+    return RenderResult(name, output_path, status, attempts, time.perf_counter() - st_clk)
+
+
+class RenderPool:
+    """
+    A pool of threads, each owning one renderer (see render/backends.py).
+    Jobs are fed through a bounded queue, so the producer never runs far ahead of the renderers.
+    """
+    def __init__(self, make_renderer: Callable, workers: int = RENDER_WORKERS,
+                 queue_size: int = RENDER_QUEUE_SIZE, retries: int = RENDER_RETRIES):
+        """
+        :param make_renderer: called once per worker thread, returns an object with
+                              render(input_path, output_path) -> status and close()
+        :param workers: number of concurrent renderers, 0 for os.cpu_count()
+        :param queue_size: max number of pending jobs
+        :param retries: number of extra attempts after a failure or timeout
+        """
+        self.make_renderer = make_renderer
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.queue_size = queue_size
+        self.retries = retries
+        self._lock = threading.Lock()
+
+    def _worker(self, jobs: queue.Queue, on_result: Callable[[RenderResult], None], errors: List[Exception]):
+        try:
+            renderer = self.make_renderer()
+        except Exception:
+            # the worker still takes its jobs, failing them, so the producer is never blocked on a full queue
+            logging.exception("Failed to create a renderer")
+            renderer = None
+        try:
+            while True:
+                job = jobs.get()
+                if job is None:
+                    break
+                if errors:
+                    continue  # on_result failed, drain the queue without rendering
+                if renderer is None:
+                    result = RenderResult(job[0], job[2], RENDER_FAILED, 0)
+                else:
+                    result = render_with_retries(renderer, self.retries, *job)
+                with self._lock:
+                    if errors:
+                        continue
+                    try:
+                        on_result(result)
+                    except Exception as e:
+                        errors.append(e)
+        finally:
+            if renderer is not None:
+                renderer.close()
+
+    def run(self, jobs: Iterable[Tuple[str, str, str]], on_result: Callable[[RenderResult], None]):
+        """
+        Render all jobs.
+        :param jobs: iterable of (name, input_path, output_path), followed by the extra arguments of the renderer
+        :param on_result: called once per job with its RenderResult, serialized by a lock.
+                          If it raises, the jobs left are skipped and its exception is raised once the workers stop
+        """
+        job_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        threads = [threading.Thread(target=self._worker, args=(job_queue, on_result, errors), daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            for job in jobs:
+                if errors:
+                    break
+                job_queue.put(job)
+        finally:
+            # the jobs may be produced by another stage (see gen/pipeline.py) and stop with an exception:
+            # the renderers still finish the queued jobs and are closed
+            for _ in threads:
+                job_queue.put(None)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+
+_process_renderer = None  # renderer owned by a ProcessRenderPool worker process
+
+
+def _init_process_renderer(make_renderer: Callable):
+    global _process_renderer
+    _process_renderer = make_renderer()
+
+
+def _render_in_process(job: Tuple[int, str, str, str]) -> RenderResult:
+    return render_with_retries(_process_renderer, *job)
+
+
+class ProcessRenderPool:
+    """
+    Same interface as RenderPool, but each renderer lives in its own worker process.
+    Used for in-process renderers that are CPU-bound and would hold the GIL.
+    """
+    def __init__(self, make_renderer: Callable, workers: int = RENDER_WORKERS,
+                 queue_size: int = RENDER_QUEUE_SIZE, retries: int = RENDER_RETRIES):
+        """
+        :param make_renderer: picklable callable, called once per worker process
+        :param workers: number of worker processes, 0 for os.cpu_count()
+        :param queue_size: number of jobs sent to a worker at once
+        :param retries: number of extra attempts after a failure
+        """
+        self.make_renderer = make_renderer
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.chunksize = max(1, queue_size // self.workers)
+        self.retries = retries
+
+    def run(self, jobs: Iterable[Tuple[str, str, str]], on_result: Callable[[RenderResult], None]):
+        """
+        Render all jobs.
+        :param jobs: iterable of (name, input_path, output_path), followed by the extra arguments of the renderer
+        :param on_result: called once per job with its RenderResult, in the calling process
+        """
+        with multiprocessing.Pool(self.workers, initializer=_init_process_renderer,
+                                  initargs=(self.make_renderer,)) as pool:
+            for result in pool.imap_unordered(_render_in_process, ((self.retries,) + tuple(job) for job in jobs),
+                                              chunksize=self.chunksize):
+                on_result(result)
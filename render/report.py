@@ -0,0 +1,52 @@
+"""
+Compare the throughput of the render backends on the Mermaid scripts of the current run.
+Usage: python -m render.report [backend ...]
+"""
+import os
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+from constant import MMD_DIR, STATS_DIR, RENDER_REPORT_FILE_NAME, RENDER_REPORT_SAMPLE_NUM
+from render.backends import RENDER_BACKENDS, get_render_pool
+from render.pool import RENDER_OK
+
+
+def measure_backend(backend: str, mmd_files: List[str]) -> Tuple[int, int, float]:
+    """
+    Render the given .mmd files into a temporary directory with one backend.
+    :return: (number of images generated, number of failures, elapsed seconds)
+    """
+    counter = {"success": 0, "failure": 0}
+
+    def on_result(result):
+        counter["success" if result.status == RENDER_OK else "failure"] += 1
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        jobs = ((filename, os.path.join(MMD_DIR, filename), os.path.join(out_dir, filename.replace(".mmd", ".png")))
+                for filename in mmd_files)
+        st_clk = time.time()
+        get_render_pool(backend).run(jobs, on_result)
+        elapsed = time.time() - st_clk
+    return counter["success"], counter["failure"], elapsed
+
+
+def render_report(backends: List[str] = RENDER_BACKENDS, sample_num: int = RENDER_REPORT_SAMPLE_NUM) -> str:
+    mmd_files = sorted((f for f in os.listdir(MMD_DIR) if f.endswith(".mmd")),
+                       key=lambda f: int(f[:-len(".mmd")]))[:sample_num]
+    lines = [f"--- Render Backends ({len(mmd_files)} flowcharts) ---"]
+    for backend in backends:
+        success, failure, elapsed = measure_backend(backend, mmd_files)
+        rate = success / elapsed if elapsed > 0 else 0
+        lines.append(f"{backend}: {rate:.2f} images/sec ({success} generated, {failure} failed, {elapsed:.2f} seconds)")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    report = render_report(sys.argv[1:] or RENDER_BACKENDS)
+    print(report)
+    if not os.path.exists(STATS_DIR):
+        os.makedirs(STATS_DIR)
+    with open(os.path.join(STATS_DIR, RENDER_REPORT_FILE_NAME), "w") as f:
+        f.write(report)
@@ -1,31 +1,47 @@
 import random
 
-from sample.sample import Sample
-from conv.question_builder import NextOkQuestionBuilder, AllNextQuestionBuilder, AllPrevQuestionBuilder, \
-    CondQuestionBuilder, ValidQuestionBuilder
+from flowchart.flowchart import Flowchart
+from sample.sample import Sample, SampleContext
 from conv.question_solver import QuestionSolver
-from conv.inference_builder import InferenceBuilder
-from utils import check_integrity, load_pickle, is_valid_transition, is_conditionally_valid_transition, \
-    get_img_relative_path, get_ocr_content, conv_builder, simple_answer_builder, get_normal_random_int
-from constant import USE_COT, USE_OCR, YES_ANSWER, NO_ANSWER, YES_ID, NO_ID, DECISION_TYPE, \
-    NEXTOK_TYPE, ALLNEXT_TYPE, ALLPREV_TYPE, COND_TYPE, VALID_TYPE
+from conv.templates import get_conv_templates
+from utils import check_integrity, load_flowchart, get_img_relative_path, get_ocr_content, get_normal_random_int
+from constant import USE_COT, USE_OCR, YES_ID, NO_ID, DECISION_TYPE, \
+    NEXTOK_TYPE, ALLNEXT_TYPE, ALLPREV_TYPE, COND_TYPE, VALID_TYPE, REACH_TYPE, DISTANCE_TYPE, UNREACHABLE_TYPE, \
+    MULTIHOP_QUESTIONS_ON
 from sample.collector import SampleCollector
 
 class SampleBuilder:
     """
     SampleBuilder is responsible for building samples for a given flowchart.
     """
-    def __init__(self, flowchart_id: int, base_id: int):
+    def __init__(self, flowchart_id: int, base_id: int, rng: random.Random = None,
+                 use_cot: bool = USE_COT, use_ocr: bool = USE_OCR, flowchart: Flowchart = None):
+        """
+        :param flowchart_id: id of the flowchart
+        :param base_id: id of the first sample
+        :param rng: random stream of this flowchart, the global random states are used if not given
+        :param use_cot: whether the answers give the chain-of-thought reasoning
+        :param use_ocr: whether the questions end with the OCR content of the image
+        :param flowchart: the flowchart if already in memory, its files are then neither checked nor loaded
+        """
         self.flowchart_id = flowchart_id
-        if not check_integrity(self.flowchart_id):
+        self.flowchart_rng = rng
+        self.rng = rng if rng is not None else random  # random and Random share the methods used here
+        if flowchart is None and not check_integrity(self.flowchart_id):
             raise ValueError(f"Invalid flowchart ID: {self.flowchart_id}")
-        self.sample_collector = SampleCollector(base_id=base_id)
-        self.flowchart = load_pickle(self.flowchart_id)
-        self.matrix = self.flowchart.build_matrix()
-        self.node_num = len(self.matrix)
+        self.flowchart = flowchart if flowchart is not None else load_flowchart(self.flowchart_id)
+        self.graph_index = self.flowchart.build_graph_index()
+        self.node_num = self.flowchart.node_num
         self.node_data = self.flowchart.build_node_data()
-        self.question_solver = QuestionSolver(self.matrix)
-        self.ocr_content = get_ocr_content(self.flowchart_id) if USE_OCR else ""
+        # built only for the multi-hop questions, in O(node_num^2) bits
+        self.reach_index = self.flowchart.get_reach_index(self.graph_index) if MULTIHOP_QUESTIONS_ON else None
+        self.question_solver = QuestionSolver(self.graph_index, self.reach_index)
+        self.ocr_content = get_ocr_content(self.flowchart_id) if use_ocr else ""
+        # only used to draw the template variants, the texts are rendered when the samples are written
+        self.templates = get_conv_templates(use_cot, use_ocr)
+        self.context = SampleContext(self.flowchart_id, get_img_relative_path(self.flowchart_id),
+                                     tuple(node.name for node in self.node_data), self.ocr_content, use_cot, use_ocr)
+        self.sample_collector = SampleCollector(base_id=base_id, context=self.context)
 
     def build_samples_for_flowchart(self):
         self.build_nextok_samples()
@@ -34,150 +50,141 @@ class SampleBuilder:
         self.build_valid_samples()
         if self.flowchart.type == DECISION_TYPE:
             self.build_cond_samples()
+        if MULTIHOP_QUESTIONS_ON:
+            self.build_reach_samples()
+            self.build_distance_samples()
+            self.build_unreachable_samples()
         return self.sample_collector
 
+    def add_sample(self, question_type: int, variant: int, node_ids, answer_ids=(), extra_ids=(),
+                   value: int = 0, answer: int = 0):
+        """Add a sample from its structured fields, see Sample for their meaning by question type"""
+        self.sample_collector.append(Sample(self.sample_collector.get_id(), self.context, question_type, variant,
+                                            node_ids, answer_ids, extra_ids, value, answer))
+
     def build_nextok_samples(self):
         # nextok, yes
-        cur_id = random.randint(0, self.node_num - 2)
-        next_id = random.choice([i for i in range(self.node_num) if is_valid_transition(self.matrix, cur_id, i)])
+        cur_id = self.rng.randint(0, self.node_num - 2)
+        next_ids = self.graph_index.get_next_ids(cur_id)
+        next_id = self.rng.choice(next_ids)
         if self.question_solver.nextok_answer(cur_id, next_id):
-            cur_state = self.node_data[cur_id].name
-            next_state = self.node_data[next_id].name
-            all_next_states = [self.node_data[i].name for i in range(self.node_num) if is_valid_transition(self.matrix, cur_id, i)]
-            answer = InferenceBuilder.build_nextok_inference(cur_state, next_state, all_next_states, reachable=True) \
-                if USE_COT else YES_ANSWER
-            question_builder = NextOkQuestionBuilder(cur_state, next_state)
-            sample = Sample(
-                id_=self.sample_collector.get_id(),
-                image=get_img_relative_path(self.flowchart_id),
-                conversations=conv_builder(question_builder.build(self.ocr_content), answer),
-                question_type=NEXTOK_TYPE,
-                ground_truth=[YES_ANSWER]
-            )
-            self.sample_collector.append(sample)
+            variant = self.templates.choose_variant(NEXTOK_TYPE, self.rng)
+            self.add_sample(NEXTOK_TYPE, variant, (cur_id, next_id), next_ids, answer=1)
         # nextok, no
-        cur_id = random.randint(0, self.node_num - 1)
-        next_ids = [i for i in range(self.node_num) if i != cur_id and not is_valid_transition(self.matrix, cur_id, i)]
-        next_id = random.choice(next_ids) if next_ids else random.randint(0, self.node_num - 1)
+        cur_id = self.rng.randint(0, self.node_num - 1)
+        next_set = self.graph_index.next_sets[cur_id]
+        next_ids = [i for i in range(self.node_num) if i != cur_id and i not in next_set]
+        next_id = self.rng.choice(next_ids) if next_ids else self.rng.randint(0, self.node_num - 1)
         if not self.question_solver.nextok_answer(cur_id, next_id):
-            cur_state = self.node_data[cur_id].name
-            next_state = self.node_data[next_id].name
-            all_next_states = [self.node_data[i].name for i in range(self.node_num) if is_valid_transition(self.matrix, cur_id, i)]
-            answer = InferenceBuilder.build_nextok_inference(cur_state, next_state, all_next_states, reachable=False) \
-                if USE_COT else NO_ANSWER
-            question_builder = NextOkQuestionBuilder(cur_state, next_state)
-            sample = Sample(
-                id_=self.sample_collector.get_id(),
-                image=get_img_relative_path(self.flowchart_id),
-                conversations=conv_builder(question_builder.build(self.ocr_content), answer),
-                question_type=NEXTOK_TYPE,
-                ground_truth=[NO_ANSWER]
-            )
-            self.sample_collector.append(sample)
+            variant = self.templates.choose_variant(NEXTOK_TYPE, self.rng)
+            self.add_sample(NEXTOK_TYPE, variant, (cur_id, next_id), self.graph_index.get_next_ids(cur_id), answer=0)
         
     def build_allnext_samples(self):
-        cur_ids = random.sample(range(self.node_num), 2)
+        cur_ids = self.rng.sample(range(self.node_num), 2)
         for cur_id in cur_ids:
-            cur_state = self.node_data[cur_id].name
             next_ids = self.question_solver.allnext_answer(cur_id)
-            next_states = [self.node_data[i].name for i in next_ids]
-            answer = InferenceBuilder.build_allnext_inference(cur_state, next_states) \
-                if USE_COT else simple_answer_builder(next_states)
-            question_builder = AllNextQuestionBuilder(cur_state)
-            sample = Sample(
-                id_=self.sample_collector.get_id(),
-                image=get_img_relative_path(self.flowchart_id),
-                conversations=conv_builder(question_builder.build(self.ocr_content), answer),
-                question_type=ALLNEXT_TYPE,
-                ground_truth=next_states
-            )
-            self.sample_collector.append(sample)
+            variant = self.templates.choose_variant(ALLNEXT_TYPE, self.rng)
+            self.add_sample(ALLNEXT_TYPE, variant, (cur_id,), next_ids)
 
     def build_allprev_samples(self):
-        cur_ids = random.sample(range(1, self.node_num), 2)
+        cur_ids = self.rng.sample(range(1, self.node_num), 2)
         for cur_id in cur_ids:
-            cur_state = self.node_data[cur_id].name
             prev_ids = self.question_solver.allprev_answer(cur_id)
-            prev_states = [self.node_data[i].name for i in prev_ids]
-            answer = InferenceBuilder.build_allprev_inference(cur_state, prev_states) \
-                if USE_COT else simple_answer_builder(prev_states)
-            question_builder = AllPrevQuestionBuilder(cur_state)
-            sample = Sample(
-                id_=self.sample_collector.get_id(),
-                image=get_img_relative_path(self.flowchart_id),
-                conversations=conv_builder(question_builder.build(self.ocr_content), answer),
-                question_type=ALLPREV_TYPE,
-                ground_truth=prev_states
-            )
-            self.sample_collector.append(sample)
+            variant = self.templates.choose_variant(ALLPREV_TYPE, self.rng)
+            self.add_sample(ALLPREV_TYPE, variant, (cur_id,), prev_ids)
 
     def build_cond_samples(self):
         for cur_id in range(self.node_num):
             if self.node_data[cur_id].type == DECISION_TYPE:
-                cur_state = self.node_data[cur_id].name
-                value_id = random.choice([YES_ID, NO_ID])
-                value = "true" if value_id == YES_ID else "false"
-                branches = []
-                for i in range(self.node_num):
-                    if is_conditionally_valid_transition(self.matrix, cur_id, i, YES_ID):
-                        branches.append(("true", self.node_data[i].name))
-                    elif is_conditionally_valid_transition(self.matrix, cur_id, i, NO_ID):
-                        branches.append(("false", self.node_data[i].name))
+                value_id = self.rng.choice([YES_ID, NO_ID])
+                branches = []  # (edge id, node id) pairs
+                for i in self.graph_index.get_next_ids(cur_id):
+                    edge_id = self.graph_index.edge_id(cur_id, i)
+                    if edge_id in (YES_ID, NO_ID):
+                        branches.extend((edge_id, i))
                 cond_ids = self.question_solver.cond_answer(cur_id, value_id)
-                cond_states = [self.node_data[i].name for i in cond_ids]
-                answer = InferenceBuilder.build_cond_inference(cur_state, value, branches) \
-                    if USE_COT else simple_answer_builder(cond_states)
-                question_builder = CondQuestionBuilder(cur_state, value)
-                sample = Sample(
-                    id_=self.sample_collector.get_id(),
-                    image=get_img_relative_path(self.flowchart_id),
-                    conversations=conv_builder(question_builder.build(self.ocr_content), answer),
-                    question_type=COND_TYPE,
-                    ground_truth=cond_states
-                )
-                self.sample_collector.append(sample)
+                variant = self.templates.choose_variant(COND_TYPE, self.rng)
+                self.add_sample(COND_TYPE, variant, (cur_id,), cond_ids, branches, value=value_id)
 
     def build_valid_samples(self):
         # valid, yes
-        cur_id = random.choice(range(0, self.node_num//2))
+        cur_id = self.rng.choice(range(0, self.node_num//2))
         sequence = [cur_id]
+        visited = {cur_id}
         stop_prob = 0.1
-        while random.random() > stop_prob or len(sequence) < 3:
-            next_ids = [i for i in range(self.node_num) if is_valid_transition(self.matrix, cur_id, i) and i not in sequence]
+        while self.rng.random() > stop_prob or len(sequence) < 3:
+            next_ids = [i for i in self.graph_index.get_next_ids(cur_id) if i not in visited]
             if len(next_ids) != 0:
-                next_id = random.choice(next_ids)
+                next_id = self.rng.choice(next_ids)
                 sequence.append(next_id)
+                visited.add(next_id)
                 cur_id = next_id
                 stop_prob *= 1.6
             else:
                 break
         if len(sequence) >= 3 and self.question_solver.valid_answer(sequence):
-            sequence_states = [self.node_data[node_id].name for node_id in sequence]
-            answer = InferenceBuilder.build_valid_reasoning(self.matrix, self.node_data, sequence) \
-                if USE_COT else YES_ANSWER
-            question_builder = ValidQuestionBuilder("->".join(sequence_states))
-            sample = Sample(
-                id_=self.sample_collector.get_id(),
-                image=get_img_relative_path(self.flowchart_id),
-                conversations=conv_builder(question_builder.build(self.ocr_content), answer),
-                question_type=VALID_TYPE,
-                ground_truth=[YES_ANSWER],
-                sequence_len=len(sequence)
-            )
-            self.sample_collector.append(sample)
+            self.add_valid_sample(sequence, 1, True)
         # valid, (possibly) no
-        sequence = random.sample(range(self.node_num), get_normal_random_int(mean=3, std=0.8, low=3, high=self.node_num))
-        is_valid = self.question_solver.valid_answer(sequence)
-        sequence_states = [self.node_data[node_id].name for node_id in sequence]
-        answer = InferenceBuilder.build_valid_reasoning(self.matrix, self.node_data, sequence) \
-            if USE_COT else NO_ANSWER
-        question_builder = ValidQuestionBuilder("->".join(sequence_states))
-        sample = Sample(
-            id_=self.sample_collector.get_id(),
-            image=get_img_relative_path(self.flowchart_id),
-            conversations=conv_builder(question_builder.build(self.ocr_content), answer),
-            question_type=VALID_TYPE,
-            ground_truth=[NO_ANSWER] if not is_valid else [YES_ANSWER],
-            sequence_len=len(sequence)
-        )
-        self.sample_collector.append(sample)
+        sequence_len = get_normal_random_int(mean=3, std=0.8, low=3, high=self.node_num, rng=self.flowchart_rng)
+        sequence = self.rng.sample(range(self.node_num), sequence_len)
+        self.add_valid_sample(sequence, 0, self.question_solver.valid_answer(sequence))
+
+    def choose_target_id(self, cur_id: int, target_ids):
+        """A random target among the reachable target_ids, those at least two steps away from cur_id are preferred"""
+        far_ids = [i for i in target_ids if self.reach_index.distance(cur_id, i) >= 2]
+        return self.rng.choice(far_ids if far_ids else target_ids)
+
+    def build_reach_samples(self):
+        # reach, yes
+        cur_id = self.rng.randrange(self.node_num)
+        reachable_ids = self.reach_index.get_reachable_ids(cur_id)
+        if reachable_ids:
+            target_id = self.choose_target_id(cur_id, reachable_ids)
+            if self.question_solver.reach_answer(cur_id, target_id):
+                self.append_reach_sample(cur_id, target_id, True)
+        # reach, no
+        cur_id = self.rng.randrange(self.node_num)
+        unreachable_ids = self.reach_index.get_unreachable_ids(cur_id)
+        if unreachable_ids:
+            target_id = self.rng.choice(unreachable_ids)
+            if not self.question_solver.reach_answer(cur_id, target_id):
+                self.append_reach_sample(cur_id, target_id, False)
+
+    def append_reach_sample(self, cur_id: int, target_id: int, reachable: bool):
+        path = self.reach_index.shortest_path(cur_id, target_id)
+        reachable_ids = self.reach_index.get_reachable_ids(cur_id) if not path else ()
+        variant = self.templates.choose_variant(REACH_TYPE, self.rng)
+        self.add_sample(REACH_TYPE, variant, (cur_id, target_id), path, reachable_ids, answer=int(reachable))
+
+    def build_distance_samples(self):
+        cur_id = self.rng.randrange(self.node_num)
+        reachable_ids = self.reach_index.get_reachable_ids(cur_id)
+        if reachable_ids:
+            target_id = self.choose_target_id(cur_id, reachable_ids)
+        else:  # nothing can be reached, the answer is none
+            target_id = self.rng.choice([i for i in range(self.node_num) if i != cur_id])
+        distance = self.question_solver.distance_answer(cur_id, target_id)
+        path = self.reach_index.shortest_path(cur_id, target_id)
+        variant = self.templates.choose_variant(DISTANCE_TYPE, self.rng)
+        self.add_sample(DISTANCE_TYPE, variant, (cur_id, target_id), path, value=distance)
+
+    def build_unreachable_samples(self):
+        start_id = self.graph_index.get_start_id()
+        if start_id is None:  # every node has an incoming edge, there is no start state
+            return
+        reachable_ids = self.reach_index.get_reachable_ids(start_id)
+        unreachable_ids = self.question_solver.unreachable_answer(start_id)
+        variant = self.templates.choose_variant(UNREACHABLE_TYPE, self.rng)
+        self.add_sample(UNREACHABLE_TYPE, variant, (start_id,), unreachable_ids, reachable_ids)
+
+    def add_valid_sample(self, sequence, plain_answer: int, is_valid: bool):
+        """
+        Add a valid question
+        :param sequence: node ids of the sequence
+        :param plain_answer: 1 if the answer without chain-of-thought reasoning is yes
+        :param is_valid: whether the sequence is valid, the ground truth
+        """
+        valid_transitions = [self.graph_index.has_edge(sequence[i], sequence[i + 1]) for i in range(len(sequence) - 1)]
+        variant = self.templates.choose_variant(VALID_TYPE, self.rng)
+        self.add_sample(VALID_TYPE, variant, sequence, extra_ids=valid_transitions, value=plain_answer,
+                        answer=int(is_valid))
@@ -1,40 +1,96 @@
-from typing import List
+from array import array
+from typing import Iterator, List
 
-from sample.sample import Sample
+from sample.sample import Sample, SampleContext
 
 class SampleCollector:
-    def __init__(self, base_id: int=0):
+    """
+    The samples of a flowchart, stored as columns of typed arrays: a few bytes per sample for the
+    question type, template variant and values, and the node ids of all the samples in one flat array.
+    Sample records are only created when the samples are read back (see iter_samples).
+    """
+    def __init__(self, base_id: int=0, context: SampleContext=None):
         """
         Initialize the SampleCollector with a list of samples.
         :param base_id: The base ID for the samples, used to calculate the sample IDs.
+        :param context: The flowchart shared by the samples.
         """
         self.base_id = base_id
-        self._data = []
+        self.context = context
+        self._question_types = array("B")
+        self._variants = array("B")
+        self._values = array("i")
+        self._answers = array("B")
+        self._ids = array("i")  # node_ids, answer_ids then extra_ids of each sample
+        self._bounds = array("I", [0])  # ends of the three id ranges of each sample in _ids
+
+    def __len__(self) -> int:
+        return len(self._question_types)
 
     def get_id(self) -> int:
         """
         Get the current number (also next sample id) of samples.
         :return: The number of samples in the collector.
         """
-        return self.base_id + len(self._data)
-    
+        return self.base_id + len(self)
+
+    def rebase(self, base_id: int):
+        """
+        Renumber the samples from a new base ID, used when samples are built apart and merged in order.
+        :param base_id: The new base ID for the samples.
+        """
+        self.base_id = base_id
+
+    def get_sample(self, index: int) -> Sample:
+        """
+        Get the sample at an index of the collector.
+        :param index: The index of the sample, from 0.
+        :return: Sample object, numbered from the base ID.
+        """
+        bounds = self._bounds[3 * index:3 * index + 4]
+        return Sample(
+            id_=self.base_id + index,
+            context=self.context,
+            question_type=self._question_types[index],
+            variant=self._variants[index],
+            node_ids=self._ids[bounds[0]:bounds[1]],
+            answer_ids=self._ids[bounds[1]:bounds[2]],
+            extra_ids=self._ids[bounds[2]:bounds[3]],
+            value=self._values[index],
+            answer=self._answers[index]
+        )
+
+    def iter_samples(self) -> Iterator[Sample]:
+        """
+        Iterate over the samples in the collector, one record at a time.
+        :return: Iterator of Sample objects.
+        """
+        return map(self.get_sample, range(len(self)))
+
     def get_samples(self) -> List[Sample]:
         """
         Get the list of samples in the collector.
         :return: List of Sample objects.
         """
-        return self._data
-    
+        return list(self.iter_samples())
+
     def append(self, sample: Sample):
         """
-        Append a single sample to the collector.
+        Append a single sample to the collector, its ID is given by its position.
         :param sample: Sample object to be added.
         """
-        self._data.append(sample)
+        self._question_types.append(sample.question_type)
+        self._variants.append(sample.variant)
+        self._values.append(sample.value)
+        self._answers.append(sample.answer)
+        for ids in (sample.node_ids, sample.answer_ids, sample.extra_ids):
+            self._ids.extend(ids)
+            self._bounds.append(len(self._ids))
 
     def extend(self, samples: List[Sample]):
         """
         Extend the collector with a list of samples.
         :param samples: List of Sample objects to be added.
         """
-        self._data.extend(samples)
+        for sample in samples:
+            self.append(sample)
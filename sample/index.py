@@ -0,0 +1,127 @@
+import json
+import os
+from typing import Any, List, Optional
+
+import numpy as np
+
+from sample.writer import get_partial_path
+
+INDEX_MAGIC = b"FCQAIDX1"
+INDEX_HEADER_SIZE = 16  # magic, then the number of samples as a little-endian uint64
+# one record per sample, the sample id is the record number
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),  # byte offset of the JSON text of the sample in the conversation file
+    ("length", "<u8"),  # byte length of the JSON text
+    ("flowchart_id", "<u4"),
+    ("question_type", "<u4"),
+])
+
+
+def get_index_path(path: str) -> str:
+    """Path of the offset index of a conversation file, e.g. conversations.json -> conversations.idx"""
+    return os.path.splitext(path)[0] + ".idx"
+
+
+class SampleIndexWriter:
+    """
+    Writes the offset index of a conversation file, one fixed-size INDEX_DTYPE record per sample,
+    as the samples are written. The number of samples is written in the header when it is closed.
+    Like the conversation files, the index is written under its partial path until it is closed,
+    and left there if the with block exits with an exception (see sample/writer.py).
+    """
+    def __init__(self, path: str, buffer_size: int = 4096):
+        """
+        :param path: path of the index, see get_index_path()
+        :param buffer_size: number of records buffered before they are written
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        if os.path.exists(path):
+            os.remove(path)
+        self._file = open(get_partial_path(path), "wb")
+        self._file.write(INDEX_MAGIC + (0).to_bytes(8, "little"))
+        self._buffer: List[tuple] = []
+        self._count = 0
+
+    def add(self, offset: int, length: int, flowchart_id: int, question_type: int):
+        self._buffer.append((offset, length, flowchart_id, question_type))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(np.array(self._buffer, dtype=INDEX_DTYPE).tobytes())
+            self._count += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._file.seek(len(INDEX_MAGIC))
+        self._file.write(self._count.to_bytes(8, "little"))
+        self._file.close()
+        os.replace(get_partial_path(self.path), self.path)
+
+    def abort(self):
+        """Close the partial index without completing it"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SampleIndex:
+    """
+    Random access to the samples of a conversation file through its offset index: the index is memory-mapped,
+    and reading a sample is one seek and one read of its JSON text. Samples can be selected by flowchart
+    or question type on the index columns, without reading the conversation file.
+    """
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        """
+        :param path: path of the conversation file (.json or .jsonl)
+        :param index_path: path of its index, see get_index_path() if not given
+        """
+        self.path = path
+        self.index_path = index_path if index_path is not None else get_index_path(path)
+        with open(self.index_path, "rb") as f:
+            header = f.read(INDEX_HEADER_SIZE)
+        if len(header) < INDEX_HEADER_SIZE or header[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f"{self.index_path} is not a sample index")
+        count = int(np.frombuffer(header, dtype="<u8", offset=len(INDEX_MAGIC))[0])
+        self.records = np.memmap(self.index_path, dtype=INDEX_DTYPE, mode="r", offset=INDEX_HEADER_SIZE,
+                                 shape=(count,)) if count > 0 else np.zeros(0, dtype=INDEX_DTYPE)
+        self._file = open(path, "rb")
+
+    def __len__(self):
+        return len(self.records)
+
+    def read_bytes(self, sample_id: int) -> bytes:
+        record = self.records[sample_id]
+        self._file.seek(int(record["offset"]))
+        return self._file.read(int(record["length"]))
+
+    def get(self, sample_id: int) -> Any:
+        """Sample of the given id, as written (see Sample.to_dict)"""
+        return json.loads(self.read_bytes(sample_id))
+
+    def get_ids_of_type(self, question_type: int) -> np.ndarray:
+        """Ids of the samples of a question type"""
+        return np.flatnonzero(self.records["question_type"] == question_type)
+
+    def get_ids_of_flowchart(self, flowchart_id: int) -> np.ndarray:
+        """Ids of the samples of a flowchart"""
+        return np.flatnonzero(self.records["flowchart_id"] == flowchart_id)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,27 +1,203 @@
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Sequence, Tuple
 
+from constant import IMG_PLACEHOLDER, USE_COT, USE_OCR, YES_ANSWER, NO_ANSWER, NONE_ANSWER, YES_ID, NEXTOK_TYPE, \
+    ALLNEXT_TYPE, ALLPREV_TYPE, COND_TYPE, VALID_TYPE, REACH_TYPE, DISTANCE_TYPE, UNREACHABLE_TYPE
+from conv.templates import get_conv_templates
+from utils import conv_builder, simple_answer_builder
 
-class Sample:
-    def __init__(self, id_: int, image: str, conversations: List[Dict[str, str]], question_type: int, ground_truth: List[str], sequence_len: int=0):
-        self.id = id_
+
+class SampleContext:
+    """
+    What the samples of a flowchart share and need to render their texts: the names of the nodes,
+    the image path, the OCR content and the template flags. One per flowchart and variant.
+    """
+    __slots__ = ("flowchart_id", "image", "node_names", "ocr_content", "use_cot", "use_ocr")
+
+    def __init__(self, flowchart_id: int, image: str, node_names: Tuple[str, ...], ocr_content: str = "",
+                 use_cot: bool = USE_COT, use_ocr: bool = USE_OCR):
+        self.flowchart_id = flowchart_id
         self.image = image
-        self.conversations = conversations
+        self.node_names = node_names
+        self.ocr_content = ocr_content
+        self.use_cot = use_cot
+        self.use_ocr = use_ocr
+
+    def names(self, node_ids: Sequence[int]) -> List[str]:
+        return [self.node_names[i] for i in node_ids]
+
+
+def yes_no(value: int) -> str:
+    return YES_ANSWER if value else NO_ANSWER
+
+def distance_answer(distance: int) -> str:
+    return str(distance) if distance > 0 else NONE_ANSWER
+
+
+# question type -> (question fields, plain answer, reasoning fields) of a sample, from its structured fields
+def nextok_fields(sample: "Sample", names: Callable) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+    cur_state, next_state = names(sample.node_ids)
+    return dict(cur_state=cur_state, next_state=next_state), yes_no(sample.answer), \
+        dict(cur_state=cur_state, next_state=next_state, states=names(sample.answer_ids), reachable=bool(sample.answer))
+
+def edges_fields(sample: "Sample", names: Callable) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+    cur_state = names(sample.node_ids)[0]
+    states = names(sample.answer_ids)
+    return dict(cur_state=cur_state), simple_answer_builder(states), dict(cur_state=cur_state, states=states)
+
+def cond_fields(sample: "Sample", names: Callable) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+    cur_state = names(sample.node_ids)[0]
+    value = "true" if sample.value == YES_ID else "false"
+    branch_values, branch_ids = sample.extra_ids[0::2], sample.extra_ids[1::2]
+    branches = [("true" if edge_id == YES_ID else "false", state)
+                for edge_id, state in zip(branch_values, names(branch_ids))]
+    return dict(cur_state=cur_state, value=value), simple_answer_builder(names(sample.answer_ids)), \
+        dict(cur_state=cur_state, value=value, branches=branches)
+
+def valid_fields(sample: "Sample", names: Callable) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+    states = names(sample.node_ids)
+    return dict(sequence="->".join(states)), yes_no(sample.value), \
+        dict(states=states, valid_transitions=[bool(valid) for valid in sample.extra_ids])
+
+def reach_fields(sample: "Sample", names: Callable) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+    cur_state, target_state = names(sample.node_ids)
+    return dict(cur_state=cur_state, target_state=target_state), yes_no(sample.answer), \
+        dict(cur_state=cur_state, target_state=target_state, path=names(sample.answer_ids),
+             states=names(sample.extra_ids))
+
+def distance_fields(sample: "Sample", names: Callable) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+    cur_state, target_state = names(sample.node_ids)
+    return dict(cur_state=cur_state, target_state=target_state), distance_answer(sample.value), \
+        dict(cur_state=cur_state, target_state=target_state, path=names(sample.answer_ids))
+
+def unreachable_fields(sample: "Sample", names: Callable) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+    start_state = names(sample.node_ids)[0]
+    unreachable_states = names(sample.answer_ids)
+    return dict(start_state=start_state), simple_answer_builder(unreachable_states), \
+        dict(start_state=start_state, states=names(sample.extra_ids), unreachable_states=unreachable_states)
 
+
+TEXT_FIELDS = {
+    NEXTOK_TYPE: nextok_fields,
+    ALLNEXT_TYPE: edges_fields,
+    ALLPREV_TYPE: edges_fields,
+    COND_TYPE: cond_fields,
+    VALID_TYPE: valid_fields,
+    REACH_TYPE: reach_fields,
+    DISTANCE_TYPE: distance_fields,
+    UNREACHABLE_TYPE: unreachable_fields,
+}
+
+
+class Sample:
+    """
+    A sample as the structured fields it is drawn from. Its texts are fully determined by them,
+    so they are only rendered with the templates when the sample is serialized (see to_dict).
+    Fields by question type:
+    - nextok: node_ids (cur, next), answer_ids the next nodes of cur, answer 1 for yes
+    - allnext/allprev: node_ids (cur,), answer_ids the next/previous nodes
+    - cond: node_ids (cur,), value the condition (YES_ID/NO_ID), answer_ids the matching next nodes,
+            extra_ids the branches of cur as (edge id, node id) pairs
+    - valid: node_ids the sequence, extra_ids 1 for each valid transition, value 1 if the plain answer is yes,
+             answer 1 if the sequence is valid
+    - reach: node_ids (cur, target), answer_ids a shortest path, extra_ids the reachable nodes when there is
+             no path, answer 1 for yes
+    - distance: node_ids (cur, target), answer_ids a shortest path, value the distance
+    - unreachable: node_ids (start,), answer_ids the unreachable nodes, extra_ids the reachable ones
+    """
+    __slots__ = ("id", "context", "question_type", "variant", "node_ids", "answer_ids", "extra_ids", "value", "answer")
+
+    def __init__(self, id_: int, context: SampleContext, question_type: int, variant: int, node_ids: Sequence[int],
+                 answer_ids: Sequence[int] = (), extra_ids: Sequence[int] = (), value: int = 0, answer: int = 0):
+        """
+        :param context: the flowchart of the sample
+        :param variant: template variant of the question type, see ConvTemplates.choose_variant
+        """
+        self.id = id_
+        self.context = context
         self.question_type = question_type
-        self.ground_truth = ground_truth
-        self.sequence_len = sequence_len
+        self.variant = variant
+        self.node_ids = node_ids
+        self.answer_ids = answer_ids
+        self.extra_ids = extra_ids
+        self.value = value
+        self.answer = answer
+
+    @property
+    def image(self) -> str:
+        return self.context.image
+
+    @property
+    def flowchart_id(self) -> int:
+        """Not serialized, written to the offset index, see sample/index.py"""
+        return self.context.flowchart_id
 
-    def to_dict(self, qa_mode: bool = False) -> Dict[str, Any]:
+    @property
+    def conversations(self) -> List[Dict[str, str]]:
+        """Question and answer, rendered on each access"""
+        templates = get_conv_templates(self.context.use_cot, self.context.use_ocr)
+        question_fields, plain_answer, answer_fields = TEXT_FIELDS[self.question_type](self, self.context.names)
+        return conv_builder(
+            templates.question(self.question_type, self.variant, self.context.ocr_content, **question_fields),
+            templates.answer(self.question_type, self.variant, plain_answer, **answer_fields))
+
+    @property
+    def ground_truth(self) -> List[str]:
+        if self.question_type in (NEXTOK_TYPE, VALID_TYPE, REACH_TYPE):
+            return [yes_no(self.answer)]
+        if self.question_type == DISTANCE_TYPE:
+            return [distance_answer(self.value)]
+        return self.context.names(self.answer_ids)
+
+    @property
+    def sequence_len(self) -> int:
+        """Length of the sequence of a valid question or of the shortest path of a distance question"""
+        if self.question_type == VALID_TYPE:
+            return len(self.node_ids)
+        if self.question_type == DISTANCE_TYPE:
+            return len(self.answer_ids)
+        return 0
+
+    def to_dict(self, qa_mode: bool = False, conversations: List[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        :param conversations: the conversations if already rendered, e.g. when the sample is written in both formats
+        """
+        conversations = conversations if conversations is not None else self.conversations
         if qa_mode:  # used in q&a dataset
             return {
                 "id": self.id,
                 "image": self.image,
-                "conversations": self.conversations,
+                "conversations": conversations,
                 "type": self.question_type,
                 "ground_truth": self.ground_truth
             }   
         return {
             "id": self.id,
             "image": self.image,
-            "conversations": self.conversations
+            "conversations": conversations
+        }
+
+    @staticmethod
+    def qa_to_questions(qa: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Project a sample in q&a format (to_dict(qa_mode=True)) into the records of questions.jsonl.
+        :param qa: sample in q&a format, either built in memory or read back from conversations_qa.json
+        """
+        questions = []
+        for message in qa["conversations"]:
+            if message["from"] == "human":
+                questions.append({
+                    "question_id": qa["id"],
+                    "image": qa["image"],
+                    # remove "<image>\n" from the question
+                    "text": message["value"].replace(IMG_PLACEHOLDER, ""),
+                    "type": qa["type"]
+                })
+        return questions
+
+    @staticmethod
+    def qa_to_ground_truth(qa: Dict[str, Any]) -> Dict[str, Any]:
+        """Project a sample in q&a format into its record of ground_truths.jsonl."""
+        return {
+            "question_id": qa["id"],
+            "ground_truth": qa["ground_truth"]
         }
@@ -1,15 +1,40 @@
-from constant import MAX_NODE_NUM, NEXTOK_TYPE, ALLNEXT_TYPE, ALLPREV_TYPE, COND_TYPE, VALID_TYPE
+from typing import List
+
+from constant import NEXTOK_TYPE, ALLNEXT_TYPE, ALLPREV_TYPE, COND_TYPE, VALID_TYPE, REACH_TYPE, DISTANCE_TYPE, \
+    UNREACHABLE_TYPE, NONE_ANSWER
 from sample.sample import Sample
 
 
+def count_at(histogram: List[int], index: int):
+    """Count one occurrence of index in a histogram list, which grows as needed"""
+    if index >= len(histogram):
+        histogram.extend([0] * (index + 1 - len(histogram)))
+    histogram[index] += 1
+
+
+def trim_zeros(histogram: List[int]) -> List[int]:
+    """Histogram up to its last non-zero count (at least one count)"""
+    last_non_zero = 0
+    for i in range(len(histogram)):
+        if histogram[i] != 0:
+            last_non_zero = i
+    return histogram[:last_non_zero + 1]
+
+
 class SampleStatistics:
     def __init__(self):
         self.nextok = {"yes": 0, "no": 0}
-        self.allnext = [0 for _ in range(MAX_NODE_NUM)]
-        self.prev = [0 for _ in range(MAX_NODE_NUM)]
+        # histograms indexed by the number of answer states or the sequence length, grown with the data
+        self.allnext = [0]
+        self.prev = [0]
         self.cond = 0
         self.valid = {"yes": 0, "no": 0}
-        self.valid_len = [0 for _ in range(MAX_NODE_NUM)]
+        self.valid_len = [0]
+        # multi-hop questions, only shown when there are some
+        self.reach = {"yes": 0, "no": 0}
+        self.distance = [0]  # indexed by the answer distance
+        self.distance_none = 0
+        self.unreachable = [0]  # indexed by the number of unreachable states
 
     def add_sample(self, sample: Sample):
         if sample.question_type == NEXTOK_TYPE:
@@ -18,9 +43,9 @@ class SampleStatistics:
             else:
                 self.nextok["no"] += 1
         elif sample.question_type == ALLNEXT_TYPE:
-            self.allnext[len(sample.ground_truth)] += 1
+            count_at(self.allnext, len(sample.ground_truth))
         elif sample.question_type == ALLPREV_TYPE:
-            self.prev[len(sample.ground_truth)] += 1
+            count_at(self.prev, len(sample.ground_truth))
         elif sample.question_type == COND_TYPE:
             self.cond += 1
         elif sample.question_type == VALID_TYPE:
@@ -28,7 +53,19 @@ class SampleStatistics:
                 self.valid["yes"] += 1
             else:
                 self.valid["no"] += 1
-            self.valid_len[sample.sequence_len] += 1
+            count_at(self.valid_len, sample.sequence_len)
+        elif sample.question_type == REACH_TYPE:
+            if sample.ground_truth[0] == "yes":
+                self.reach["yes"] += 1
+            else:
+                self.reach["no"] += 1
+        elif sample.question_type == DISTANCE_TYPE:
+            if sample.ground_truth[0] == NONE_ANSWER:
+                self.distance_none += 1
+            else:
+                count_at(self.distance, int(sample.ground_truth[0]))
+        elif sample.question_type == UNREACHABLE_TYPE:
+            count_at(self.unreachable, len(sample.ground_truth))
         else:
             raise ValueError(f"Unknown sample type: {sample.question_type}")
 
@@ -47,9 +84,21 @@ class SampleStatistics:
     def valid_num(self):
         return sum(self.valid.values())
 
+    def reach_num(self):
+        return sum(self.reach.values())
+
+    def distance_num(self):
+        return sum(self.distance) + self.distance_none
+
+    def unreachable_num(self):
+        return sum(self.unreachable)
+
+    def multihop_num(self):
+        return self.reach_num() + self.distance_num() + self.unreachable_num()
+
     def all_num(self):
         return (self.nextok_num() + self.allnext_num() + self.prev_num() +
-                self.cond_num() + self.valid_num())
+                self.cond_num() + self.valid_num() + self.multihop_num())
 
     def show_nextok(self):
         return (f"--- nextok ---"
@@ -58,21 +107,13 @@ class SampleStatistics:
                 f"\nall: {self.nextok_num()}")
 
     def show_allnext(self):
-        last_non_zero = 0
-        for i in range(MAX_NODE_NUM):
-            if self.allnext[i] != 0:
-                last_non_zero = i
         return (f"--- allnext ---"
-                f"\n{self.allnext[:last_non_zero + 1]}"
+                f"\n{trim_zeros(self.allnext)}"
                 f"\nall: {self.allnext_num()}")
 
     def show_prev(self):
-        last_non_zero = 0
-        for i in range(MAX_NODE_NUM):
-            if self.prev[i] != 0:
-                last_non_zero = i
         return (f"--- prev ---"
-                f"\n{self.prev[:last_non_zero + 1]}"
+                f"\n{trim_zeros(self.prev)}"
                 f"\nall: {self.prev_num()}")
 
     def show_cond(self):
@@ -80,23 +121,38 @@ class SampleStatistics:
                 f"\nall: {self.cond_num()}")
 
     def show_valid(self):
-        last_non_zero = 0
-        for i in range(MAX_NODE_NUM):
-            if self.valid_len[i] != 0:
-                last_non_zero = i
         return (f"--- valid ---"
-                f"\n{self.valid_len[:last_non_zero + 1]}"
+                f"\n{trim_zeros(self.valid_len)}"
                 f"\nyes: {self.valid['yes']}"
                 f"\nno: {self.valid['no']}"
                 f"\nall: {self.valid_num()}")
 
+    def show_reach(self):
+        return (f"--- reach ---"
+                f"\nyes: {self.reach['yes']}"
+                f"\nno: {self.reach['no']}"
+                f"\nall: {self.reach_num()}")
+
+    def show_distance(self):
+        return (f"--- distance ---"
+                f"\n{trim_zeros(self.distance)}"
+                f"\nnone: {self.distance_none}"
+                f"\nall: {self.distance_num()}")
+
+    def show_unreachable(self):
+        return (f"--- unreachable ---"
+                f"\n{trim_zeros(self.unreachable)}"
+                f"\nall: {self.unreachable_num()}")
+
     def show_all(self):
-        return ("\n".join([self.show_nextok(),
-                           self.show_allnext(),
-                           self.show_prev(),
-                           self.show_cond(),
-                           self.show_valid()])
-                + f"\n--- all ---\n{self.all_num()}")
+        sections = [self.show_nextok(),
+                    self.show_allnext(),
+                    self.show_prev(),
+                    self.show_cond(),
+                    self.show_valid()]
+        if self.multihop_num() > 0:
+            sections.extend([self.show_reach(), self.show_distance(), self.show_unreachable()])
+        return "\n".join(sections) + f"\n--- all ---\n{self.all_num()}"
 
     def save(self, file):
         with open(file, "w") as f:
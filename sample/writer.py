@@ -0,0 +1,171 @@
+import json
+import os
+from typing import Any, Iterator, Tuple
+
+from constant import CONV_OUTPUT_FORMAT
+
+JSON_FORMAT = "json"
+JSONL_FORMAT = "jsonl"
+
+
+def get_partial_path(path: str) -> str:
+    """Path a file is written to until its writer is closed, e.g. conversations.json -> conversations.json.part"""
+    return path + ".part"
+
+
+class PartialFileWriter:
+    """
+    Writes a file under its partial path (see get_partial_path), and moves it to its path once it is closed.
+    If the with block exits with an exception, the partial file is left as it is, so an interrupted run
+    never leaves a complete-looking output.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        # the output of a previous run must not pass for the output of this one
+        if os.path.exists(path):
+            os.remove(path)
+        # no newline translation, so the byte offsets of the items are known
+        self._file = open(get_partial_path(path), "w", newline="\n")
+
+    def finish(self):
+        """Write the end of the file before it is closed"""
+        pass
+
+    def close(self):
+        self.finish()
+        self._file.close()
+        os.replace(get_partial_path(self.path), self.path)
+
+    def abort(self):
+        """Close the partial file without completing it"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonArrayWriter(PartialFileWriter):
+    """
+    Writes a JSON array one item at a time, so only the current item is kept in memory.
+    The output is byte-identical to json.dump(items, f, indent=indent) (with "\n" line ends on every OS).
+    """
+    def __init__(self, path: str, indent: int = 2):
+        super().__init__(path)
+        self.indent = indent
+        self._count = 0
+        self._offset = 0
+
+    def write(self, item: Any) -> Tuple[int, int]:
+        """Write an item, return the byte offset and length of its JSON text, see sample/index.py"""
+        prefix = ("[\n" if self._count == 0 else ",\n") + " " * self.indent
+        # nested lines are one level deeper than in a standalone dump, ASCII only (ensure_ascii)
+        text = json.dumps(item, indent=self.indent).replace("\n", "\n" + " " * self.indent)
+        self._file.write(prefix + text)
+        self._count += 1
+        offset = self._offset + len(prefix)
+        self._offset = offset + len(text)
+        return offset, len(text)
+
+    def finish(self):
+        self._file.write("[]" if self._count == 0 else "\n]")
+
+
+class JsonLinesWriter(PartialFileWriter):
+    """Writes one JSON object per line."""
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._offset = 0
+
+    def write(self, item: Any) -> Tuple[int, int]:
+        """Write an item, return the byte offset and length of its line, without the line end"""
+        text = json.dumps(item)
+        self._file.write(text + "\n")
+        offset = self._offset
+        self._offset += len(text) + 1
+        return offset, len(text)
+
+
+def get_output_path(path: str, output_format: str = CONV_OUTPUT_FORMAT) -> str:
+    """Path of a conversation file in the given format, e.g. conversations.json -> conversations.jsonl"""
+    if output_format == JSONL_FORMAT:
+        return os.path.splitext(path)[0] + ".jsonl"
+    return path
+
+
+def open_sample_writer(path: str, output_format: str = CONV_OUTPUT_FORMAT):
+    """
+    Open a streaming writer for a conversation file.
+    :param path: path of the file in the JSON format, the extension is changed for JSONL
+    :param output_format: JSON_FORMAT (LLaVA format, one JSON array) or JSONL_FORMAT
+    """
+    if output_format == JSONL_FORMAT:
+        return JsonLinesWriter(get_output_path(path, output_format))
+    if output_format == JSON_FORMAT:
+        return JsonArrayWriter(path)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """Iterate over the items of a JSON array file without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf, pos, eof = "", 0, False
+
+        def skip_whitespace():
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                buf, pos = f.read(chunk_size), 0
+                eof = buf == ""
+
+        skip_whitespace()
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError(f"{path} is not a JSON array")
+        pos += 1
+        first = True
+        while True:
+            skip_whitespace()
+            if pos >= len(buf):
+                raise ValueError(f"Unexpected end of {path}")
+            if buf[pos] == "]":
+                return
+            if not first:
+                if buf[pos] != ",":
+                    raise ValueError(f"Expected ',' in {path}")
+                pos += 1
+                skip_whitespace()
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                    # an item ending with the buffer may be truncated (e.g. a number)
+                    if end < len(buf) or eof:
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = f.read(chunk_size)
+                eof = chunk == ""
+                buf, pos = buf[pos:] + chunk, 0
+            yield item
+            pos = end
+            first = False
+
+
+def iter_samples(path: str, output_format: str = CONV_OUTPUT_FORMAT) -> Iterator[dict]:
+    """Iterate over the samples of a conversation file written by open_sample_writer, one at a time."""
+    path = get_output_path(path, output_format)
+    if output_format == JSONL_FORMAT:
+        with open(path, "r") as f:
+            for line in f:
+                yield json.loads(line)
+    else:
+        yield from iter_json_array(path)
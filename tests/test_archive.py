@@ -0,0 +1,105 @@
+"""
+Tests of the packed flowchart archive, run from the repository root:
+    python -m pytest tests
+"""
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+import utils
+from constant import ARCHIVE_STORAGE, PKL_STORAGE
+from flowchart.archive import FlowchartArchive, FlowchartArchiveWriter, COLUMNS, META_FILE_NAME
+from flowchart.builder import FlowchartBuilder
+
+
+def build_flowcharts(num: int, seed: int = 0):
+    random.seed(seed)
+    return [FlowchartBuilder().build() for _ in range(num)]
+
+
+def assert_same(first, second):
+    assert (first.type, first.node_num, first.nodes, first.edges) == \
+           (second.type, second.node_num, second.nodes, second.edges)
+
+
+def test_round_trip(tmp_path):
+    flowcharts = build_flowcharts(25)
+    with FlowchartArchiveWriter(str(tmp_path), commit_every=10) as writer:
+        for flowchart in flowcharts:
+            writer.append(flowchart)
+    archive = FlowchartArchive(str(tmp_path))
+    assert len(archive) == len(flowcharts)
+    for i, flowchart in enumerate(flowcharts):
+        assert_same(archive.get(i), flowchart)
+    assert archive.node_nums().tolist() == [flowchart.node_num for flowchart in flowcharts]
+    assert archive.edge_nums().tolist() == [len(flowchart.edges) for flowchart in flowcharts]
+    with pytest.raises(IndexError):
+        archive.get(len(flowcharts))
+
+
+def test_load_flowchart_matches_pickle(tmp_path, monkeypatch):
+    flowcharts = build_flowcharts(5)
+    pkl_dir, archive_dir = tmp_path / "pkl", tmp_path / "archive"
+    pkl_dir.mkdir()
+    with FlowchartArchiveWriter(str(archive_dir)) as writer:
+        for i, flowchart in enumerate(flowcharts):
+            writer.append(flowchart)
+            flowchart.save_pickle(str(pkl_dir / f"{i}.pkl"))
+    monkeypatch.setattr(utils, "PKL_DIR", str(pkl_dir))
+    monkeypatch.setattr(utils, "ARCHIVE_DIR", str(archive_dir))
+    monkeypatch.setattr(utils, "_archive", None)
+    monkeypatch.setattr(utils, "FLOWCHART_STORAGE", PKL_STORAGE)
+    pickled = [utils.load_flowchart(i) for i in range(len(flowcharts))]
+    monkeypatch.setattr(utils, "FLOWCHART_STORAGE", ARCHIVE_STORAGE)
+    for i, flowchart in enumerate(pickled):
+        assert_same(utils.load_flowchart(i), flowchart)
+
+
+def test_append_on_resume(tmp_path):
+    flowcharts = build_flowcharts(8)
+    with FlowchartArchiveWriter(str(tmp_path)) as writer:
+        for flowchart in flowcharts[:5]:
+            writer.append(flowchart)
+    with FlowchartArchiveWriter(str(tmp_path)) as writer:
+        assert len(writer) == 5
+        for flowchart in flowcharts[5:]:
+            writer.append(flowchart)
+    archive = FlowchartArchive(str(tmp_path))
+    assert len(archive) == len(flowcharts)
+    for i, flowchart in enumerate(flowcharts):
+        assert_same(archive.get(i), flowchart)
+
+
+def test_interrupted_append_keeps_committed_flowcharts(tmp_path):
+    flowcharts = build_flowcharts(6)
+    writer = FlowchartArchiveWriter(str(tmp_path), commit_every=2)
+    for flowchart in flowcharts[:3]:
+        writer.append(flowchart)
+    # crash while the next commit writes its columns: the data is on disk, but the meta file is not updated
+    for f in writer._files.values():
+        f.write(b"\x01" * 7)
+        f.flush()
+        f.close()
+    with open(os.path.join(str(tmp_path), META_FILE_NAME)) as f:
+        meta = json.load(f)
+    assert meta["count"] == 2
+    archive = FlowchartArchive(str(tmp_path))
+    assert len(archive) == 2
+    for i in range(2):
+        assert_same(archive.get(i), flowcharts[i])
+
+    # reopening drops the uncommitted data, the appends go on from the last commit
+    with FlowchartArchiveWriter(str(tmp_path), commit_every=2) as writer:
+        assert len(writer) == 2
+        for column, size in writer.sizes.items():
+            assert os.path.getsize(os.path.join(str(tmp_path), f"{column}.bin")) == \
+                   size * np.dtype(COLUMNS[column]).itemsize
+        for flowchart in flowcharts[2:]:
+            writer.append(flowchart)
+    archive = FlowchartArchive(str(tmp_path))
+    assert len(archive) == len(flowcharts)
+    for i, flowchart in enumerate(flowcharts):
+        assert_same(archive.get(i), flowchart)
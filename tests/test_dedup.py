@@ -0,0 +1,96 @@
+"""
+Tests of the structural hash and of the deduplication of the flowcharts, run from the repository root:
+    python -m pytest tests
+"""
+import random
+
+import pytest
+
+import gen.gen_flowcharts as gen_flowcharts
+from constant import NORMAL_TYPE, DECISION_TYPE
+from flowchart.batch_builder import SeededFlowchartBatches
+from flowchart.builder import FlowchartBuilder
+from flowchart.flowchart import Flowchart
+
+NODES = [("start", NORMAL_TYPE), ("check", DECISION_TYPE), ("left", NORMAL_TYPE), ("right", NORMAL_TYPE),
+         ("end", NORMAL_TYPE)]
+EDGES = [(0, 1, ""), (1, 2, "Y"), (1, 3, "N"), (2, 4, ""), (3, 4, ""), (4, 1, "")]
+
+
+def relabel(flowchart: Flowchart, order) -> Flowchart:
+    """Same flowchart with node i moved to order[i], renamed, and the edges shuffled"""
+    nodes = [None] * flowchart.node_num
+    for i, (name, node_type) in enumerate(flowchart.nodes):
+        nodes[order[i]] = (f"renamed {name}", node_type)
+    edges = [(order[first_id], order[second_id], condition) for first_id, second_id, condition in flowchart.edges]
+    random.Random(0).shuffle(edges)
+    return Flowchart(flowchart.type, flowchart.node_num, nodes, edges)
+
+
+def test_isomorphic_flowcharts_hash_equal():
+    flowchart = Flowchart(DECISION_TYPE, len(NODES), NODES, EDGES)
+    assert relabel(flowchart, [3, 0, 4, 1, 2]).structural_hash() == flowchart.structural_hash()
+    random.seed(0)
+    rng = random.Random(1)
+    for _ in range(20):
+        flowchart = FlowchartBuilder().build()
+        order = list(range(flowchart.node_num))
+        rng.shuffle(order)
+        assert relabel(flowchart, order).structural_hash() == flowchart.structural_hash()
+
+
+@pytest.mark.parametrize("nodes, edges", [
+    (NODES, [(0, 1, ""), (1, 2, "Y"), (1, 3, "Y"), (2, 4, ""), (3, 4, ""), (4, 1, "")]),  # condition changed
+    (NODES, [(0, 1, ""), (1, 2, "N"), (1, 3, "Y"), (2, 4, ""), (3, 4, ""), (4, 2, "")]),  # conditions swapped
+    (NODES, EDGES[:-1] + [(1, 4, "")]),  # edge reversed
+    (NODES, EDGES[:-1]),  # edge removed
+    (NODES[:2] + [("left", DECISION_TYPE)] + NODES[3:], EDGES),  # node type changed
+])
+def test_non_isomorphic_flowcharts_hash_differ(nodes, edges):
+    flowchart = Flowchart(DECISION_TYPE, len(NODES), NODES, EDGES)
+    assert Flowchart(DECISION_TYPE, len(nodes), nodes, edges).structural_hash() != flowchart.structural_hash()
+
+
+def test_draw_flowchart_redraws_over_quota(monkeypatch):
+    monkeypatch.setattr(gen_flowcharts, "FLOWCHART_DEDUP_QUOTA", 2)
+    monkeypatch.setattr(gen_flowcharts, "FLOWCHART_DEDUP_MAX_REDRAWS", 100)
+    batches = SeededFlowchartBatches(batch_size=4, seed=0)
+    first, _ = batches.get(0)
+    # under quota: kept
+    structure_counts = {first.structural_hash(): 1}
+    flowchart, _, structure, redrawn_num = gen_flowcharts.draw_flowchart(0, batches, structure_counts)
+    assert (flowchart.edges, structure, redrawn_num) == (first.edges, first.structural_hash(), 0)
+    # at quota: redrawn, reproducibly, until a structure under quota comes
+    structure_counts = {first.structural_hash(): 2}
+    flowchart, direction, structure, redrawn_num = gen_flowcharts.draw_flowchart(0, batches, structure_counts)
+    assert redrawn_num >= 1 and structure_counts.get(structure, 0) < 2
+    assert (flowchart.edges, direction) == (batches.redraw(0, redrawn_num)[0].edges, batches.redraw(0, redrawn_num)[1])
+    assert flowchart.structural_hash() == structure
+
+
+class SameFlowchartBatches:
+    """Batches drawing the same flowchart again and again"""
+    def __init__(self, flowchart: Flowchart):
+        self.flowchart = flowchart
+
+    def get(self, flowchart_id: int):
+        return self.flowchart, "LR"
+
+    def redraw(self, flowchart_id: int, attempt: int):
+        return self.flowchart, "LR"
+
+
+def test_draw_flowchart_keeps_duplicate_after_max_redraws(monkeypatch):
+    monkeypatch.setattr(gen_flowcharts, "FLOWCHART_DEDUP_QUOTA", 1)
+    monkeypatch.setattr(gen_flowcharts, "FLOWCHART_DEDUP_MAX_REDRAWS", 5)
+    flowchart = Flowchart(DECISION_TYPE, len(NODES), NODES, EDGES)
+    structure_counts = {flowchart.structural_hash(): 1}
+    _, _, structure, redrawn_num = gen_flowcharts.draw_flowchart(0, SameFlowchartBatches(flowchart), structure_counts)
+    assert (structure, redrawn_num) == (flowchart.structural_hash(), 5)
+
+
+def test_draw_flowchart_keeps_all_without_quota(monkeypatch):
+    monkeypatch.setattr(gen_flowcharts, "FLOWCHART_DEDUP_QUOTA", 0)
+    flowchart = Flowchart(DECISION_TYPE, len(NODES), NODES, EDGES)
+    structure_counts = {flowchart.structural_hash(): 1000}
+    assert gen_flowcharts.draw_flowchart(0, SameFlowchartBatches(flowchart), structure_counts)[3] == 0
@@ -0,0 +1,75 @@
+"""
+Tests of the layered layout and the Pillow renderer on small known graphs, run from the repository root:
+    python -m pytest tests
+"""
+import io
+
+import pytest
+
+from constant import NORMAL_TYPE, DECISION_TYPE
+from flowchart.flowchart import Flowchart
+from render.layout import assign_layers, layered_layout
+from render.pil_renderer import PilRenderer
+
+# 0 -> 1 -> 3, 0 -> 2 -> 3, 0 -> 3 (long edge) and 3 -> 0 (back edge)
+DIAMOND_EDGES = [(0, 1, "Y"), (0, 2, "N"), (1, 3, ""), (2, 3, ""), (0, 3, ""), (3, 0, "")]
+SIZES = [(40, 20), (60, 20), (30, 40), (50, 30)]
+
+
+def test_assign_layers():
+    assert assign_layers(4, [(0, 1), (0, 2), (1, 3), (2, 3)]) == [0, 1, 1, 2]
+    # longest path: 0 -> 2 puts 2 after 1, not next to it
+    assert assign_layers(3, [(0, 1), (1, 2), (0, 2)]) == [0, 1, 2]
+    # nodes without edges stay in the first layer
+    assert assign_layers(3, [(1, 2)]) == [0, 0, 1]
+
+
+@pytest.mark.parametrize("direction", ["LR", "TB"])
+def test_edges_join_adjacent_layers(direction):
+    layout = layered_layout(4, DIAMOND_EDGES, SIZES, direction)
+    rank_axis = 0 if direction == "LR" else 1
+    layer_pos = sorted({center[rank_axis] for center in layout.centers})
+    assert len(layer_pos) == 3
+    layer_of = {pos: i for i, pos in enumerate(layer_pos)}
+    assert [layer_of[center[rank_axis]] for center in layout.centers] == [0, 1, 1, 2]
+    assert len(layout.edge_paths) == len(DIAMOND_EDGES)
+    for first_id, second_id, condition, points in layout.edge_paths:
+        assert points[0] == layout.centers[first_id] and points[-1] == layout.centers[second_id]
+        # after the dummy vertices are inserted, every segment crosses exactly one layer gap
+        layers = [layer_of[point[rank_axis]] for point in points]
+        assert all(abs(second - first) == 1 for first, second in zip(layers, layers[1:]))
+    # the long edges 0 -> 3 and 3 -> 0 go through a dummy vertex of the middle layer
+    assert [len(points) for _, _, _, points in layout.edge_paths[4:]] == [3, 3]
+
+
+def test_same_layer_nodes_do_not_overlap():
+    layout = layered_layout(4, DIAMOND_EDGES, SIZES, "LR", node_gap=30)
+    (_, y1), (_, y2) = layout.centers[1], layout.centers[2]
+    assert abs(y1 - y2) >= (SIZES[1][1] + SIZES[2][1]) / 2 + 30 - 1e-6
+    for (x, y), (w, h) in zip(layout.centers, SIZES):
+        assert 0 <= x - w / 2 and x + w / 2 <= layout.width
+        assert 0 <= y - h / 2 and y + h / 2 <= layout.height
+
+
+def test_self_loops_are_skipped():
+    layout = layered_layout(2, [(0, 1, ""), (1, 1, "")], SIZES[:2])
+    assert [(first_id, second_id) for first_id, second_id, _, _ in layout.edge_paths] == [(0, 1)]
+
+
+def test_layout_is_deterministic():
+    first = layered_layout(4, DIAMOND_EDGES, SIZES, "TB")
+    second = layered_layout(4, DIAMOND_EDGES, SIZES, "TB")
+    assert first.centers == second.centers
+    assert first.edge_paths == second.edge_paths
+    assert (first.width, first.height) == (second.width, second.height)
+
+
+def test_pil_renderer_is_deterministic():
+    nodes = [("start", NORMAL_TYPE), ("check", DECISION_TYPE), ("left", NORMAL_TYPE), ("end", NORMAL_TYPE)]
+    flowchart = Flowchart(DECISION_TYPE, 4, nodes, [(0, 1, ""), (1, 2, "Y"), (1, 3, "N"), (2, 3, "")])
+    images = []
+    for _ in range(2):
+        buffer = io.BytesIO()
+        PilRenderer(scale=1).draw(flowchart, "LR").save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    assert images[0] == images[1]
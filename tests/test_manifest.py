@@ -0,0 +1,91 @@
+"""
+Tests of the run manifest, run from the repository root:
+    python -m pytest tests
+"""
+import json
+
+import gen.manifest as manifest
+from gen.manifest import Manifest, MMD_ARTIFACT, PKL_ARTIFACT, PNG_ARTIFACT, OCR_ARTIFACT, \
+    FLOWCHARTS_STAGE, IMGS_STAGE, OCR_STAGE, SAMPLES_STAGE, DONE_STATUS
+
+
+def write(path, content: bytes) -> bytes:
+    with open(path, "wb") as f:
+        f.write(content)
+    return content
+
+
+def test_records_survive_reload(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    m = Manifest(path)
+    m.record(0, MMD_ARTIFACT, DONE_STATUS, "flowchart LR")
+    m.mark_stage(FLOWCHARTS_STAGE, chart_num=1)
+    reloaded = Manifest(path)
+    assert reloaded.is_done(0, MMD_ARTIFACT)
+    assert reloaded.get_hash(0, MMD_ARTIFACT) == m.get_hash(0, MMD_ARTIFACT)
+    assert reloaded.stage_done(FLOWCHARTS_STAGE) and reloaded.stage_chart_nums[FLOWCHARTS_STAGE] == 1
+
+
+def test_crash_loses_only_unflushed_records(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    m = Manifest(path, flush_every=2)
+    for i in range(3):
+        m.record(i, MMD_ARTIFACT, DONE_STATUS, f"{i}")
+    # the third record is still buffered, and the last line of a crashed run may be cut
+    with open(path, "a") as f:
+        f.write('{"id": 2, "artif')
+    reloaded = Manifest(path)
+    assert reloaded.pending(range(3), MMD_ARTIFACT) == [2]
+
+
+def test_verify_forgets_missing_and_changed_files(tmp_path):
+    m = Manifest(str(tmp_path / "manifest.jsonl"))
+    for i in range(4):
+        m.record(i, PNG_ARTIFACT, DONE_STATUS, write(tmp_path / f"{i}.png", b"PNG %d" % i))
+        m.record(i, OCR_ARTIFACT, DONE_STATUS, f"ocr {i}")
+    m.mark_stage(IMGS_STAGE, chart_num=4)
+    m.mark_stage(OCR_STAGE, chart_num=4)
+    (tmp_path / "1.png").unlink()
+    write(tmp_path / "2.png", b"PNG 2 rendered again")
+    write(tmp_path / "3.png", b"PNG 9")  # same size, only seen by the hash
+
+    assert m.verify(PNG_ARTIFACT, lambda i: str(tmp_path / f"{i}.png"), check_hash=False) == [1, 2]
+    assert m.pending(range(4), PNG_ARTIFACT) == [1, 2]
+    # the OCR results of the forgotten images are forgotten too
+    assert m.pending(range(4), OCR_ARTIFACT) == [1, 2]
+    assert not m.stage_done(IMGS_STAGE) and not m.stage_done(OCR_STAGE)
+    assert m.verify(PNG_ARTIFACT, lambda i: str(tmp_path / f"{i}.png"), check_hash=True) == [3]
+    assert m.verify(PNG_ARTIFACT, lambda i: str(tmp_path / f"{i}.png"), check_hash=True) == []
+
+
+def test_changed_settings_invalidate_later_stages(tmp_path, monkeypatch):
+    m = Manifest(str(tmp_path / "manifest.jsonl"))
+    for stage in (FLOWCHARTS_STAGE, IMGS_STAGE, OCR_STAGE, SAMPLES_STAGE):
+        m.start_stage(stage)
+    m.record(0, MMD_ARTIFACT, DONE_STATUS, "flowchart LR")
+    m.record(0, PKL_ARTIFACT, DONE_STATUS, b"pickle")
+    m.record(0, PNG_ARTIFACT, DONE_STATUS, b"PNG")
+    m.record(0, OCR_ARTIFACT, DONE_STATUS, "ocr")
+    for stage in (FLOWCHARTS_STAGE, IMGS_STAGE, OCR_STAGE, SAMPLES_STAGE):
+        m.mark_stage(stage, chart_num=1)
+    for stage in (FLOWCHARTS_STAGE, IMGS_STAGE, OCR_STAGE, SAMPLES_STAGE):
+        m.check_stage(stage, 1)
+    assert all(m.stage_done(stage) for stage in (FLOWCHARTS_STAGE, IMGS_STAGE, OCR_STAGE, SAMPLES_STAGE))
+
+    monkeypatch.setattr(manifest, "MIN_CONFIDENCE", manifest.MIN_CONFIDENCE + 0.1)
+    assert m.changed_settings(OCR_STAGE) == ["MIN_CONFIDENCE"]
+    m.check_stage(OCR_STAGE, 1)
+    assert m.is_done(0, PNG_ARTIFACT) and not m.is_done(0, OCR_ARTIFACT)
+    assert m.stage_done(IMGS_STAGE) and not m.stage_done(OCR_STAGE) and not m.stage_done(SAMPLES_STAGE)
+
+
+def test_changed_chart_num_runs_stage_again(tmp_path):
+    m = Manifest(str(tmp_path / "manifest.jsonl"))
+    m.start_stage(FLOWCHARTS_STAGE)
+    m.mark_stage(FLOWCHARTS_STAGE, chart_num=5)
+    m.check_stage(FLOWCHARTS_STAGE, 5)
+    assert m.stage_done(FLOWCHARTS_STAGE)
+    m.check_stage(FLOWCHARTS_STAGE, 8)
+    assert not m.stage_done(FLOWCHARTS_STAGE)
+    with open(m.path) as f:
+        assert json.loads(f.readlines()[-1]) == {"stage": FLOWCHARTS_STAGE, "status": None}
@@ -0,0 +1,90 @@
+"""
+Tests of the reachability index against a plain breadth-first search, run from the repository root:
+    python -m pytest tests
+"""
+import random
+from collections import deque
+
+import pytest
+
+from constant import NORMAL_TYPE
+from flowchart.builder import FlowchartBuilder
+from flowchart.graph_index import GraphIndex
+from flowchart.reach_index import ReachIndex, UNREACHABLE
+
+
+def bfs_distances(graph_index: GraphIndex, source: int):
+    distances = [UNREACHABLE] * graph_index.node_num
+    distances[source] = 0
+    queue = deque([source])
+    while queue:
+        cur_id = queue.popleft()
+        for next_id in graph_index.next_ids[cur_id]:
+            if distances[next_id] == UNREACHABLE:
+                distances[next_id] = distances[cur_id] + 1
+                queue.append(next_id)
+    return distances
+
+
+def check_index(graph_index: GraphIndex):
+    reach_index = ReachIndex(graph_index)
+    for source in range(graph_index.node_num):
+        distances = bfs_distances(graph_index, source)
+        reachable_ids = [i for i, distance in enumerate(distances) if distance > 0]
+        assert reach_index.get_reachable_ids(source) == reachable_ids
+        assert reach_index.get_unreachable_ids(source) == \
+               [i for i, distance in enumerate(distances) if distance == UNREACHABLE]
+        for target in range(graph_index.node_num):
+            assert reach_index.can_reach(source, target) == (target in reachable_ids)
+            assert reach_index.distance(source, target) == distances[target]
+            path = reach_index.shortest_path(source, target)
+            assert len(path) == distances[target] + 1
+            if path:
+                assert path[0] == source and path[-1] == target
+                assert all(graph_index.is_valid_transition(first, second) for first, second in zip(path, path[1:]))
+
+
+def test_known_graph():
+    # 0 -> 1 -> 2 -> 1 (cycle), 2 -> 3, 4 isolated, 5 -> 5 (self loop)
+    edges = [(0, 1, ""), (1, 2, ""), (2, 1, ""), (2, 3, ""), (5, 5, "")]
+    graph_index = GraphIndex(NORMAL_TYPE, 6, edges)
+    reach_index = ReachIndex(graph_index)
+    assert reach_index.get_reachable_ids(0) == [1, 2, 3]
+    assert reach_index.get_reachable_ids(1) == [2, 3]  # a node on a cycle is not counted among its reachable nodes
+    assert not reach_index.can_reach(1, 1) and not reach_index.can_reach(5, 5)
+    assert reach_index.get_unreachable_ids(3) == [0, 1, 2, 4, 5]
+    assert reach_index.shortest_path(0, 3) == [0, 1, 2, 3]
+    assert reach_index.distance(3, 0) == UNREACHABLE and reach_index.shortest_path(3, 0) == []
+    assert reach_index.distance(4, 4) == 0 and reach_index.shortest_path(4, 4) == [4]
+    check_index(graph_index)
+
+
+def test_start_id():
+    assert GraphIndex(NORMAL_TYPE, 3, [(1, 0, ""), (0, 2, "")]).get_start_id() == 1
+    # self loops are not previous nodes
+    assert GraphIndex(NORMAL_TYPE, 2, [(0, 0, ""), (0, 1, "")]).get_start_id() == 0
+    assert GraphIndex(NORMAL_TYPE, 2, [(0, 1, ""), (1, 0, "")]).get_start_id() is None
+
+
+def test_long_chain():
+    # longer than the recursion limit of a recursive search
+    node_num = 3000
+    edges = [(i, i + 1, "") for i in range(node_num - 1)] + [(node_num - 1, node_num // 2, "")]
+    reach_index = ReachIndex(GraphIndex(NORMAL_TYPE, node_num, edges))
+    assert reach_index.get_reachable_ids(0) == list(range(1, node_num))
+    assert reach_index.get_reachable_ids(node_num - 1) == list(range(node_num // 2, node_num - 1))
+    assert reach_index.distance(0, node_num - 1) == node_num - 1
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_graphs(seed):
+    rng = random.Random(seed)
+    node_num = rng.randint(2, 30)
+    edges = [(rng.randrange(node_num), rng.randrange(node_num), "") for _ in range(rng.randint(0, 2 * node_num))]
+    check_index(GraphIndex(NORMAL_TYPE, node_num, edges))
+
+
+def test_flowcharts():
+    random.seed(0)
+    for _ in range(20):
+        check_index(FlowchartBuilder().build().build_graph_index())
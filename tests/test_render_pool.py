@@ -0,0 +1,198 @@
+"""
+Tests of the render pool and the mmdc renderer with a fake mmdc shell script, run from the repository root:
+    python -m pytest tests
+"""
+import logging
+import os
+import stat
+import time
+
+import psutil
+import pytest
+
+import gen.gen_flowcharts as gen_flowcharts
+import gen.manifest as manifest
+from render.mmd_server import MermaidServerRenderer
+from render.mmdc import MmdcRenderer, run_mmdc
+from render.pool import RenderPool, RENDER_OK, RENDER_FAILED, RENDER_TIMEOUT_EXPIRED
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the fake mmdc is a shell script")
+
+# fake mmdc: behaves according to the first word of its input script, called like `mmdc -i <input> -o <output>`
+FAKE_MMDC = """#!/bin/sh
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -i) input="$2"; shift 2;;
+    -o) output="$2"; shift 2;;
+    *) shift;;
+  esac
+done
+echo x >> "$input.attempts"
+case "$(head -n 1 "$input")" in
+  hang*) sleep 30 & echo $! > "$input.child"; wait;;
+  fail*) exit 1;;
+  no_output*) exit 0;;
+  flaky*) [ "$(wc -l < "$input.attempts")" -ge 3 ] || exit 1;;
+esac
+printf 'PNG' > "$output"
+"""
+
+
+@pytest.fixture
+def fake_mmdc(tmp_path) -> str:
+    path = tmp_path / "mmdc"
+    path.write_text(FAKE_MMDC)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(path)
+
+
+def make_job(tmp_path, name: str, behaviour: str = None):
+    """Job rendering a script named `name`, its behaviour is the name without its _suffix by default"""
+    input_path = tmp_path / f"{name}.mmd"
+    input_path.write_text(f"{behaviour or name.split('_')[0]}\n")
+    return f"{name}.mmd", str(input_path), str(tmp_path / f"{name}.png")
+
+
+def mmdc_pool(fake_mmdc: str, timeout: float = 5, **kwargs) -> RenderPool:
+    return RenderPool(lambda: MmdcRenderer(timeout=timeout, mmdc=fake_mmdc), **kwargs)
+
+
+def attempts(tmp_path, name: str) -> int:
+    with open(tmp_path / f"{name}.mmd.attempts") as f:
+        return len(f.readlines())
+
+
+def test_run_mmdc(tmp_path, fake_mmdc):
+    _, input_path, output_path = make_job(tmp_path, "ok")
+    assert run_mmdc(input_path, output_path, 5, fake_mmdc) == RENDER_OK
+    assert os.path.exists(output_path)
+
+
+def test_run_mmdc_fails_on_exit_code(tmp_path, fake_mmdc):
+    _, input_path, output_path = make_job(tmp_path, "fail")
+    with open(output_path, "w") as f:
+        f.write("image of a previous run")
+    assert run_mmdc(input_path, output_path, 5, fake_mmdc) == RENDER_FAILED
+    assert not os.path.exists(output_path)
+
+
+def test_run_mmdc_fails_without_output(tmp_path, fake_mmdc):
+    _, input_path, output_path = make_job(tmp_path, "no_output", "no_output")
+    assert run_mmdc(input_path, output_path, 5, fake_mmdc) == RENDER_FAILED
+
+
+def test_run_mmdc_missing_executable(tmp_path):
+    _, input_path, output_path = make_job(tmp_path, "ok")
+    assert run_mmdc(input_path, output_path, 5, str(tmp_path / "missing")) == RENDER_FAILED
+
+
+def test_timeout_kills_process_tree(tmp_path, fake_mmdc):
+    _, input_path, output_path = make_job(tmp_path, "hang")
+    st_clk = time.perf_counter()
+    assert run_mmdc(input_path, output_path, 0.5, fake_mmdc) == RENDER_TIMEOUT_EXPIRED
+    assert time.perf_counter() - st_clk < 10
+    with open(f"{input_path}.child") as f:
+        child_pid = int(f.read())
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        try:
+            if psutil.Process(child_pid).status() == psutil.STATUS_ZOMBIE:
+                break
+        except psutil.NoSuchProcess:
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail(f"child {child_pid} of the timed out mmdc is still running")
+
+
+def test_pool_retries(tmp_path, fake_mmdc):
+    jobs = [make_job(tmp_path, name) for name in ("ok", "flaky", "fail", "hang")]
+    results = []
+    pool = mmdc_pool(fake_mmdc, timeout=0.5, workers=2, queue_size=1, retries=2)
+    pool.run(jobs, results.append)
+    results = {result.name: result for result in results}
+    assert (results["ok.mmd"].status, results["ok.mmd"].attempts) == (RENDER_OK, 1)
+    assert (results["flaky.mmd"].status, results["flaky.mmd"].attempts) == (RENDER_OK, 3)
+    assert (results["fail.mmd"].status, results["fail.mmd"].attempts) == (RENDER_FAILED, 3)
+    assert (results["hang.mmd"].status, results["hang.mmd"].attempts) == (RENDER_TIMEOUT_EXPIRED, 3)
+    for name in ("ok", "flaky", "fail", "hang"):
+        assert attempts(tmp_path, name) == results[f"{name}.mmd"].attempts
+
+
+def test_pool_renders_all_jobs(tmp_path, fake_mmdc):
+    jobs = [make_job(tmp_path, f"ok_{i}") for i in range(20)]
+    results = []
+    mmdc_pool(fake_mmdc, workers=4, queue_size=2).run(jobs, results.append)
+    assert sorted(result.name for result in results) == sorted(name for name, _, _ in jobs)
+    assert all(result.status == RENDER_OK for result in results)
+
+
+def test_pool_raises_result_callback_error(tmp_path, fake_mmdc):
+    jobs = [make_job(tmp_path, f"ok_{i}") for i in range(20)]
+    results = []
+
+    def on_result(result):
+        results.append(result)
+        if len(results) == 3:
+            raise OSError("disk full")
+
+    with pytest.raises(OSError, match="disk full"):
+        mmdc_pool(fake_mmdc, workers=2, queue_size=1).run(jobs, on_result)
+    # the jobs after the failure are dropped instead of rendered
+    assert len(results) < len(jobs)
+
+
+class BrokenRenderer:
+    def render(self, input_path: str, output_path: str) -> str:
+        raise RuntimeError("broken renderer")
+
+    def close(self):
+        pass
+
+
+def test_pool_fails_jobs_of_broken_renderers(tmp_path):
+    jobs = [make_job(tmp_path, f"ok_{i}") for i in range(10)]
+    results = []
+    RenderPool(BrokenRenderer, workers=2, queue_size=1, retries=1).run(jobs, results.append)
+    assert len(results) == len(jobs)
+    assert all((result.status, result.attempts) == (RENDER_FAILED, 2) for result in results)
+
+    def make_renderer():
+        raise OSError("cannot create a renderer")
+
+    results = []
+    RenderPool(make_renderer, workers=2, queue_size=1).run(jobs, results.append)
+    assert len(results) == len(jobs)
+    assert all(result.status == RENDER_FAILED for result in results)
+
+
+def test_server_without_node_fails_jobs(tmp_path):
+    jobs = [make_job(tmp_path, f"ok_{i}") for i in range(4)]
+    results = []
+    pool = RenderPool(lambda: MermaidServerRenderer(node=str(tmp_path / "missing")), workers=2, queue_size=1)
+    pool.run(jobs, results.append)
+    assert sorted(result.status for result in results) == [RENDER_FAILED] * len(jobs)
+
+
+def test_gen_imgs_log_lines(tmp_path, fake_mmdc, monkeypatch, caplog, capsys):
+    mmd_dir, img_dir = tmp_path / "mmd", tmp_path / "img"
+    mmd_dir.mkdir()
+    img_dir.mkdir()
+    for i, behaviour in enumerate(("ok", "hang", "fail")):
+        make_job(mmd_dir, str(i), behaviour)
+    monkeypatch.setattr(gen_flowcharts, "MMD_DIR", str(mmd_dir))
+    monkeypatch.setattr(gen_flowcharts, "get_img_path", lambda i: str(img_dir / f"{i}.png"))
+    monkeypatch.setattr(gen_flowcharts, "get_render_pool",
+                        lambda backend: mmdc_pool(fake_mmdc, timeout=0.5, workers=3, retries=1))
+    monkeypatch.setattr(manifest, "_manifest", manifest.Manifest(str(tmp_path / "manifest.jsonl")))
+
+    with caplog.at_level(logging.INFO):
+        gen_flowcharts.gen_imgs(3)
+    out = capsys.readouterr().out
+    for line in ("1 images generated in", "Timeout expired for 1.mmd", "Failed to generate image for 2.mmd",
+                 "---Generated 1 images successfully, 2 images failed---"):
+        assert line in out
+        assert line in caplog.text
+    assert sorted(os.listdir(img_dir)) == ["0.png"]
+    assert manifest.get_manifest().is_done(0, manifest.PNG_ARTIFACT)
+    assert not manifest.get_manifest().is_done(1, manifest.PNG_ARTIFACT)
@@ -0,0 +1,88 @@
+"""
+Tests of the streaming conversation writers and of their offset index, run from the repository root:
+    python -m pytest tests
+"""
+import json
+import os
+
+import pytest
+
+from sample.index import SampleIndex, SampleIndexWriter, get_index_path
+from sample.writer import JsonArrayWriter, JsonLinesWriter, open_sample_writer, iter_samples, get_partial_path, \
+    get_output_path, JSON_FORMAT, JSONL_FORMAT
+
+SAMPLES = [
+    {"id": "0_1", "image": "0.png", "conversations": [{"from": "human", "value": "<image>\nQ"},
+                                                      {"from": "gpt", "value": "A"}]},
+    {"id": "1_2", "image": "1.png", "conversations": []},
+]
+
+
+@pytest.mark.parametrize("samples", [SAMPLES, []])
+def test_json_array_matches_json_dump(tmp_path, samples):
+    path = str(tmp_path / "conversations.json")
+    with JsonArrayWriter(path) as writer:
+        for sample in samples:
+            writer.write(sample)
+    with open(path) as f:
+        assert f.read() == json.dumps(samples, indent=2)
+    assert not os.path.exists(get_partial_path(path))
+
+
+@pytest.mark.parametrize("output_format", [JSON_FORMAT, JSONL_FORMAT])
+def test_samples_round_trip(tmp_path, output_format):
+    path = str(tmp_path / "conversations.json")
+    with open_sample_writer(path, output_format) as writer:
+        for sample in SAMPLES:
+            writer.write(sample)
+    assert list(iter_samples(path, output_format)) == SAMPLES
+
+
+@pytest.mark.parametrize("writer_class", [JsonArrayWriter, JsonLinesWriter])
+def test_interrupted_write_leaves_no_output(tmp_path, writer_class):
+    path = str(tmp_path / "conversations.json")
+    with open(path, "w") as f:
+        f.write("[]")  # output of a previous run
+    with pytest.raises(RuntimeError):
+        with writer_class(path) as writer:
+            writer.write(SAMPLES[0])
+            raise RuntimeError("interrupted")
+    assert not os.path.exists(path)
+    # the partial output is kept, without the end of the array
+    with open(get_partial_path(path)) as f:
+        assert f.read().rstrip().endswith("}")
+
+
+@pytest.mark.parametrize("output_format", [JSON_FORMAT, JSONL_FORMAT])
+def test_index_seeks_samples(tmp_path, output_format):
+    path = get_output_path(str(tmp_path / "conversations.json"), output_format)
+    samples = SAMPLES * 3
+    with open_sample_writer(path, output_format) as writer, SampleIndexWriter(get_index_path(path), 2) as index:
+        for i, sample in enumerate(samples):
+            index.add(*writer.write(sample), i // 2, i % 2)
+    with SampleIndex(path) as index:
+        assert len(index) == len(samples)
+        # read backwards, each sample is one seek and one read
+        for i in reversed(range(len(samples))):
+            assert index.get(i) == samples[i]
+        assert index.get_ids_of_type(1).tolist() == [1, 3, 5]
+        assert index.get_ids_of_flowchart(2).tolist() == [4, 5]
+
+
+@pytest.mark.parametrize("output_format", [JSON_FORMAT, JSONL_FORMAT])
+def test_empty_index(tmp_path, output_format):
+    path = get_output_path(str(tmp_path / "conversations.json"), output_format)
+    with open_sample_writer(path, output_format), SampleIndexWriter(get_index_path(path)):
+        pass
+    with SampleIndex(path) as index:
+        assert len(index) == 0
+
+
+def test_interrupted_index_leaves_no_index(tmp_path):
+    path = str(tmp_path / "conversations.json")
+    with pytest.raises(RuntimeError):
+        with JsonArrayWriter(path) as writer, SampleIndexWriter(get_index_path(path)) as index:
+            index.add(*writer.write(SAMPLES[0]), 0, 0)
+            raise RuntimeError("interrupted")
+    assert not os.path.exists(get_index_path(path))
+    assert os.path.exists(get_partial_path(get_index_path(path)))
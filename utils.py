@@ -2,14 +2,20 @@ import numpy as np
 import random
 import os
 from typing import List, Dict
-import pickle
 
-from constant import ALLOWED_CHARACTERS, MMD_DIR, PKL_DIR, IMG_DIR, IMG_REF_DIR, OCR_DIR, NONE_ANSWER
+from constant import ALLOWED_CHARACTERS, MMD_DIR, PKL_DIR, IMG_DIR, IMG_REF_DIR, NONE_ANSWER, \
+    FLOWCHART_STORAGE, ARCHIVE_DIR, ARCHIVE_STORAGE, IMG_FORMAT
 from flowchart.flowchart import Flowchart
+from flowchart.archive import FlowchartArchive
+from gen.manifest import get_manifest, MMD_ARTIFACT, PKL_ARTIFACT, PNG_ARTIFACT
+from gen.ocr_store import OcrStore, get_ocr_store_path
 
-def get_normal_random_int(mean: float, std: float, low: int, high: int) -> int:
-    """Get a random integer from an Integer truncated normal distribution"""
-    ret = round(np.random.normal(mean, std))
+def get_normal_random_int(mean: float, std: float, low: int, high: int, rng: random.Random = None) -> int:
+    """
+    Get a random integer from an Integer truncated normal distribution
+    :param rng: random stream to draw from, numpy's global random state if not given
+    """
+    ret = round(rng.gauss(mean, std) if rng is not None else np.random.normal(mean, std))
     if ret < low:
         ret = low
     elif ret > high:
@@ -22,14 +28,40 @@ def gen_random_str() -> str:
     return ''.join(random.choices(ALLOWED_CHARACTERS, k=length))
 
 def check_integrity(flowchart_id) -> bool:
-    """check whether all the files (.mmd, .pkl, .png) are generated"""
-    return os.path.exists(os.path.join(MMD_DIR, f"{flowchart_id}.mmd")) and \
-           os.path.exists(os.path.join(PKL_DIR, f"{flowchart_id}.pkl")) and \
-           os.path.exists(os.path.join(IMG_DIR, f"{flowchart_id}.png"))
+    """
+    check whether all the files (.mmd, .pkl, image) are generated,
+    according to the manifest of the run, or to the file system for runs without manifest
+    """
+    manifest = get_manifest()
+    if manifest.items:
+        return manifest.is_done(flowchart_id, MMD_ARTIFACT) and \
+               manifest.is_done(flowchart_id, PKL_ARTIFACT) and \
+               manifest.is_done(flowchart_id, PNG_ARTIFACT)
+    if FLOWCHART_STORAGE == ARCHIVE_STORAGE:
+        stored = flowchart_id < len(get_archive())
+    else:
+        stored = os.path.exists(os.path.join(PKL_DIR, f"{flowchart_id}.pkl"))
+    return os.path.exists(os.path.join(MMD_DIR, f"{flowchart_id}.mmd")) and stored and \
+           os.path.exists(get_img_path(flowchart_id))
 
 def load_pickle(flowchart_id) -> Flowchart:
     return Flowchart.load_pickle(os.path.join(PKL_DIR, f"{flowchart_id}.pkl"))
 
+_archive = None
+
+def get_archive(min_len: int = 0) -> FlowchartArchive:
+    """Flowchart archive of the current run, reopened if it has grown since it was opened"""
+    global _archive
+    if _archive is None or len(_archive) < min_len:
+        _archive = FlowchartArchive(ARCHIVE_DIR)
+    return _archive
+
+def load_flowchart(flowchart_id) -> Flowchart:
+    """Load a flowchart of the current run from its storage, see FLOWCHART_STORAGE"""
+    if FLOWCHART_STORAGE == ARCHIVE_STORAGE:
+        return get_archive(flowchart_id + 1).get(flowchart_id)
+    return load_pickle(flowchart_id)
+
 def is_valid_transition(matrix: List[List[int]], from_id: int, to_id: int) -> bool:
     """
     Check if the transition from from_id to to_id is valid.
@@ -61,18 +93,27 @@ def is_conditionally_valid_transition(matrix: List[List[int]], from_id: int, to_
     """
     return matrix[from_id][to_id] == condition_id and to_id != from_id
 
+def get_img_path(flowchart_id) -> str:
+    """Path of the image of a flowchart of the current run, its extension is IMG_FORMAT"""
+    return os.path.join(IMG_DIR, f"{flowchart_id}.{IMG_FORMAT}")
+
 def get_img_relative_path(flowchart_id):
-    return os.path.join(IMG_REF_DIR, f"{flowchart_id}.png")
+    return os.path.join(IMG_REF_DIR, f"{flowchart_id}.{IMG_FORMAT}")
 
-_cached_ocr_results = None
+_ocr_store = None
+_ocr_store_pid = None
 
 def get_ocr_content(flowchart_id):
-    global _cached_ocr_results
-    # load OCR results from cache if not already loaded
-    if _cached_ocr_results is None:
-        with open(os.path.join(OCR_DIR, "ocr_results.pkl"), "rb") as f:
-            _cached_ocr_results = pickle.load(f)
-    return _cached_ocr_results[flowchart_id]
+    """OCR content of a flowchart, loaded on demand from the OCR store of the run"""
+    global _ocr_store, _ocr_store_pid
+    # one connection per process, a connection must not be used across a fork
+    if _ocr_store is None or _ocr_store_pid != os.getpid():
+        _ocr_store = OcrStore(get_ocr_store_path(), readonly=True)
+        _ocr_store_pid = os.getpid()
+    content = _ocr_store.get_content(flowchart_id)
+    if content is None:
+        raise KeyError(f"No OCR result for flowchart {flowchart_id}")
+    return content
 
 def conv_builder(human_text: str, gpt_text: str) -> List[Dict[str, str]]:
     """